@@ -6,8 +6,17 @@ import sys
 import argparse
 import requests
 import csv
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Dict
 from dotenv import load_dotenv
+from litellm_client import DEFAULT_FETCH_WORKERS, DEFAULT_POOL_SIZE, get_client
+from team_directory import get_team_directory
+from atomic_file import atomic_write
+from inventory_snapshot import get_inventory_snapshot
+from run_journal import RunJournal
+from invitation_cache import get_invitation_endpoint
+from csv_ingest import read_csv_rows
+from csv_validation import RowValidator, print_rejected
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,19 +26,16 @@ SENSITIVE_KEYS = {"password", "hashed_password", "salt", "token"}  # 念のた
 
 def get_user_details(base_url: str, master_key: str, user_id: str, debug: bool = False) -> Dict:
     """Get detailed user information including API keys"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/info"
+    url = client.url("/user/info")
     params = {"user_id": user_id}
     
     if debug:
         print(f"DEBUG: Getting user details - URL: {url}, user_id: {user_id}", file=sys.stderr)
     
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        r = client.get(url, params=params)
         
         if debug:
             print(f"DEBUG: User details response status: {r.status_code}", file=sys.stderr)
@@ -44,38 +50,13 @@ def get_user_details(base_url: str, master_key: str, user_id: str, debug: bool =
         return {}
 
 def get_team_id_by_name(base_url: str, master_key: str, team_name: str, debug: bool = False) -> str:
-    """Get team ID by team name"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/team/list"
-    
-    if debug:
-        print(f"DEBUG: Getting team list - URL: {url}", file=sys.stderr)
-    
+    """Get team ID by team name (resolved through the shared team directory)"""
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        
-        if debug:
-            print(f"DEBUG: Team list response status: {r.status_code}", file=sys.stderr)
-            print(f"DEBUG: Team list response: {r.text[:500]}...", file=sys.stderr)
-        
-        r.raise_for_status()
-        data = r.json()
-        
-        # Get teams from response - API returns list directly
-        teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
-        
         # Find team by name (check both team_name and team_alias)
-        for team in teams:
-            if team.get("team_name") == team_name or team.get("team_alias") == team_name:
-                return team.get("team_id", "")
-        
-        if debug:
+        team_id = get_team_directory(base_url, master_key, debug).id_for_name(team_name)
+        if not team_id and debug:
             print(f"DEBUG: Team '{team_name}' not found in available teams", file=sys.stderr)
-        return ""
+        return team_id
         
     except Exception as e:
         if debug:
@@ -83,70 +64,54 @@ def get_team_id_by_name(base_url: str, master_key: str, team_name: str, debug: b
         return ""
 
 def get_team_name_by_id(base_url: str, master_key: str, team_id: str, debug: bool = False) -> str:
-    """Get team name by team ID"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/team/list"
-    
+    """Get team name by team ID (resolved through the shared team directory)"""
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        # Get teams from response - API returns list directly
-        teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
-        
-        # Find team by ID
-        for team in teams:
-            if team.get("team_id") == team_id:
-                return team.get("team_alias") or team.get("team_name", "")
-        
-        return ""
+        return get_team_directory(base_url, master_key, debug).name_for_id(team_id)
         
     except Exception as e:
         if debug:
             print(f"DEBUG: Error getting team name for ID {team_id}: {e}", file=sys.stderr)
         return ""
 
-def check_user_exists(base_url: str, master_key: str, user_email: str, debug: bool = False) -> bool:
-    """Check if user already exists"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/user/list"
+def normalize_email(email: str) -> str:
+    """Normalize an email address for duplicate detection"""
+    return email.strip().lower()
+
+def fetch_user_email_index(base_url: str, master_key: str, debug: bool = False, use_snapshot: bool = False) -> Dict[str, Dict]:
+    """Fetch the user list once (or read the inventory snapshot) and index users by normalized email"""
+    client = get_client(base_url, master_key)
     
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        # Get users from response
-        users = data.get("users") or data.get("data") or (data if isinstance(data, list) else [])
+        # Get users from response (all pages)
+        if use_snapshot:
+            # 作成するかどうかを判断するため、差分更新ではなく全件取得し直したスナップショットを使う
+            users = get_inventory_snapshot(base_url, master_key, debug, full=True).users
+        else:
+            users = client.fetch_all_users(debug=debug, compact=True)
         
-        # Check if user email exists
+        user_index = {}
         for user in users:
-            if user.get("user_email") == user_email:
-                return True
-        return False
+            if user.get("user_email"):
+                user_index.setdefault(normalize_email(user["user_email"]), user)
+        
+        if debug:
+            print(f"DEBUG: Indexed {len(user_index)} existing users by email", file=sys.stderr)
+        return user_index
         
     except Exception as e:
         if debug:
             print(f"DEBUG: Error checking user existence: {e}", file=sys.stderr)
-        return False  # If we can't check, assume user doesn't exist
+        return {}  # If we can't check, assume no user exists
+
+def check_user_exists(user_index: Dict[str, Dict], user_email: str) -> bool:
+    """Check if user already exists (case-insensitive) in the email index"""
+    return normalize_email(user_email) in user_index
 
 def create_user(base_url: str, master_key: str, user_email: str, user_role: str = DEFAULT_USER_ROLE, team_name: str = None, debug: bool = False) -> Dict:
     """Create a single user via LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/new"
+    url = client.url("/user/new")
     payload = {
         "user_email": user_email,
         "user_role": user_role,
@@ -165,27 +130,37 @@ def create_user(base_url: str, master_key: str, user_email: str, user_role: str
     
     if debug:
         print(f"DEBUG: Creating user - URL: {url}", file=sys.stderr)
-        print(f"DEBUG: Headers: {headers}", file=sys.stderr)
+        print(f"DEBUG: Headers: {client.headers}", file=sys.stderr)
         print(f"DEBUG: Payload: {payload}", file=sys.stderr)
     
-    r = requests.post(url, headers=headers, json=payload, timeout=30)
+    # /user/new is not idempotent: a transient failure is only retried after
+    # confirming that the earlier attempt did not create the user anyway
+    retry_if, existing = client.new_user_guard(user_email)
+    try:
+        r = client.post(url, json=payload, retry_if=retry_if)
+    except requests.RequestException:
+        if existing:
+            return existing
+        raise
     
     if debug:
         print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
         print(f"DEBUG: Response headers: {dict(r.headers)}", file=sys.stderr)
         print(f"DEBUG: Response text: {r.text[:500]}...", file=sys.stderr)
     
+    if existing and not r.ok:
+        if debug:
+            print(f"DEBUG: User {user_email} was created by an earlier attempt", file=sys.stderr)
+        return existing
+    
     r.raise_for_status()
     return r.json()
 
 def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias: str, debug: bool = False) -> Dict:
     """Update an existing API key's alias"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/key/update"
+    url = client.url("/key/update")
     payload = {
         "key": key_id,
         "key_alias": key_alias,
@@ -196,7 +171,7 @@ def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias:
         print(f"DEBUG: Update payload: {payload}", file=sys.stderr)
     
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
+        r = client.post(url, json=payload)
         
         if debug:
             print(f"DEBUG: Update response status: {r.status_code}", file=sys.stderr)
@@ -211,70 +186,20 @@ def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias:
         return {}
 
 def generate_invitation_id(base_url: str, master_key: str, user_id: str, debug: bool = False) -> str:
-    """Generate invitation ID for password setup"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    # Try different possible endpoints for invitation ID generation
-    possible_endpoints = [
-        f"{base_url.rstrip('/')}/user/invite",
-        f"{base_url.rstrip('/')}/invite",
-        f"{base_url.rstrip('/')}/user/invitation",
-        f"{base_url.rstrip('/')}/user/{user_id}/invite",
-        f"{base_url.rstrip('/')}/user/generate_invite",
-        f"{base_url.rstrip('/')}/generate_invite"
-    ]
-    
-    payload = {
-        "user_id": user_id,
-        "action": "reset_password"
-    }
-    
-    for url in possible_endpoints:
-        if debug:
-            print(f"DEBUG: Trying invitation endpoint - URL: {url}", file=sys.stderr)
-            print(f"DEBUG: Invitation payload: {payload}", file=sys.stderr)
-        
-        try:
-            r = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if debug:
-                print(f"DEBUG: Invitation response status: {r.status_code}", file=sys.stderr)
-                print(f"DEBUG: Invitation response: {r.text[:500]}...", file=sys.stderr)
-            
-            if r.status_code == 200:
-                r.raise_for_status()
-                response_data = r.json()
-                
-                # Try to extract invitation ID from different possible response formats
-                invitation_id = (
-                    response_data.get('invitation_id') or
-                    response_data.get('invite_id') or
-                    response_data.get('id') or
-                    response_data.get('token') or
-                    response_data.get('invitation_token')
-                )
-                
-                if invitation_id:
-                    if debug:
-                        print(f"DEBUG: Successfully generated invitation ID: {invitation_id}", file=sys.stderr)
-                    return invitation_id
-                
-        except requests.HTTPError as e:
-            if debug and e.response.status_code != 404:
-                print(f"DEBUG: HTTP error for {url}: {e}", file=sys.stderr)
-            continue
-        except Exception as e:
-            if debug:
-                print(f"DEBUG: Error trying {url}: {e}", file=sys.stderr)
-            continue
+    """Generate invitation ID for password setup
+
+    The proxy's invitation endpoint (or the fact that it has none) is discovered
+    once and cached on disk, see invitation_cache.py.
+    """
+    invitation_id = get_invitation_endpoint(base_url, master_key, debug).generate(user_id)
     
     if debug:
-        print(f"DEBUG: No invitation endpoint found, unable to generate invitation ID", file=sys.stderr)
+        if invitation_id:
+            print(f"DEBUG: Successfully generated invitation ID: {invitation_id}", file=sys.stderr)
+        else:
+            print(f"DEBUG: No invitation endpoint found, unable to generate invitation ID", file=sys.stderr)
     
-    return ""
+    return invitation_id
 
 def generate_invitation_url(base_url: str, master_key: str, user_id: str, debug: bool = False) -> str:
     """Generate invitation URL for password setup"""
@@ -296,24 +221,26 @@ def generate_invitation_url(base_url: str, master_key: str, user_id: str, debug:
     
     return manual_url
 
+def generate_invitation_urls(base_url: str, master_key: str, users: List[Dict], debug: bool = False, workers: int = DEFAULT_FETCH_WORKERS):
+    """Fill in "invitation_url" for every user that has a user_id, in parallel
+
+    Runs as one stage after provisioning. The first request discovers the
+    invitation endpoint; the remaining users reuse it.
+    """
+    pending = [u for u in users if u.get('user_id') and not u.get('invitation_url')]
+    if not pending:
+        return
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        urls = executor.map(lambda u: generate_invitation_url(base_url, master_key, u['user_id'], debug), pending)
+        for user, url in zip(pending, urls):
+            user['invitation_url'] = url
+
 def read_csv_users(csv_file: str, default_role: str) -> List[Dict[str, str]]:
     """Read user data (email, role, team_name, and key_name) from CSV file"""
-    users = []
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                email = row.get('email', '').strip()
-                role = row.get('role', '').strip() or default_role
-                team_name = row.get('team_name', '').strip()
-                key_name = row.get('key_name', '').strip()
-                if email:
-                    user_data = {"email": email, "role": role}
-                    if team_name:
-                        user_data["team_name"] = team_name
-                    if key_name:
-                        user_data["key_name"] = key_name
-                    users.append(user_data)
+        # 大きなファイルは複数プロセスで分割して解析する（結果の順序はCSVと同じ）
+        users = read_csv_rows(csv_file, default_role)
     except FileNotFoundError:
         print(f"ERROR: CSV file '{csv_file}' not found.", file=sys.stderr)
         sys.exit(1)
@@ -333,7 +260,7 @@ def write_error_csv(failed_users: List[Dict], filename: str = "user_reg_error.cs
         return
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
+        with atomic_write(filename, newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['email', 'role', 'error_reason'])
             for failed in failed_users:
@@ -342,13 +269,36 @@ def write_error_csv(failed_users: List[Dict], filename: str = "user_reg_error.cs
     except Exception as e:
         print(f"Failed to write error CSV: {e}", file=sys.stderr)
 
-def write_success_csv(created_users: List[Dict], filename: str = "user_reg_result.csv", base_url: str = "", master_key: str = "", debug: bool = False):
-    """Write successful user registrations to CSV file"""
+def resolve_report_fields(base_url: str, master_key: str, users: List[Dict], debug: bool = False, workers: int = DEFAULT_FETCH_WORKERS):
+    """Resolve everything write_success_csv needs from the API before the report is written
+
+    Team names come from the shared team directory (one /team/list call) and
+    invitation URLs from the parallel invitation stage.
+    """
+    if any(user.get('team_id') for user in users):
+        try:
+            directory = get_team_directory(base_url, master_key, debug).ensure_loaded()
+            for user in users:
+                if user.get('team_id') and not user.get('team_name'):
+                    user['team_name'] = directory.name_for_id(user['team_id'])
+        except Exception as e:
+            # 取得できなければレポートにはチームIDを出力する
+            print(f"WARNING: Failed to get team list, reporting team IDs instead of names: {e}", file=sys.stderr)
+    
+    generate_invitation_urls(base_url, master_key, users, debug, workers)
+
+def write_success_csv(created_users: List[Dict], filename: str = "user_reg_result.csv", base_url: str = ""):
+    """Write successful user registrations to CSV file
+
+    Makes no API calls: team names and invitation URLs are resolved beforehand
+    by resolve_report_fields(). Rows are streamed to a temporary file that
+    replaces the report only once it is complete.
+    """
     if not created_users:
         return
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
+        with atomic_write(filename, newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['email', 'role', 'user_id', 'team_name', 'models', 'api_keys', 'invitation_url'])
             for user in created_users:
@@ -358,13 +308,8 @@ def write_success_csv(created_users: List[Dict], filename: str = "user_reg_resul
                 models = user.get('models', [])
                 
                 # Get team information
-                team_name = ''
-                if user.get('team_id') and base_url and master_key:
-                    # Get actual team name from team ID
-                    team_name = get_team_name_by_id(base_url, master_key, user.get('team_id'))
-                    if not team_name:
-                        team_name = f"Team ID: {user.get('team_id')}"
-                elif user.get('team_id'):
+                team_name = user.get('team_name') or ''
+                if not team_name and user.get('team_id'):
                     team_name = f"Team ID: {user.get('team_id')}"
                 
                 # Get API key from different possible fields
@@ -374,16 +319,15 @@ def write_success_csv(created_users: List[Dict], filename: str = "user_reg_resul
                     user_info = user.get('user_info', {})
                     api_key = user_info.get('key', '') or user_info.get('api_key', '')
                 
-                # Generate invitation URL for password setup
-                invitation_url = ''
-                if user_id and base_url and master_key:
-                    invitation_url = generate_invitation_url(base_url, master_key, user_id, debug)
-                elif user_id and base_url:
-                    # Fallback: provide manual setup instructions
-                    invitation_url = f"Manual setup required - User ID: {user_id} (Access {base_url.rstrip('/')}/ui/ for password setup)"
-                elif user_id:
-                    # If no base_url, provide user ID for manual setup
-                    invitation_url = f"Manual setup required - User ID: {user_id}"
+                # Invitation URL for password setup (generated by the invitation stage)
+                invitation_url = user.get('invitation_url', '')
+                if not invitation_url:
+                    if user_id and base_url:
+                        # Fallback: provide manual setup instructions
+                        invitation_url = f"Manual setup required - User ID: {user_id} (Access {base_url.rstrip('/')}/ui/ for password setup)"
+                    elif user_id:
+                        # If no base_url, provide user ID for manual setup
+                        invitation_url = f"Manual setup required - User ID: {user_id}"
                 
                 # Convert lists to string representation, handle empty lists properly
                 if isinstance(models, list):
@@ -402,22 +346,17 @@ def write_success_csv(created_users: List[Dict], filename: str = "user_reg_resul
     except Exception as e:
         print(f"Failed to write success CSV: {e}", file=sys.stderr)
 
-def update_existing_users_csv(base_url: str, master_key: str, debug: bool = False, filename: str = "user_reg_result.csv"):
+def update_existing_users_csv(base_url: str, master_key: str, debug: bool = False, filename: str = "user_reg_result.csv", use_snapshot: bool = False):
     """Update CSV with existing user information"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/user/list"
+    client = get_client(base_url, master_key)
     
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        # Get users from response
-        users = data.get("users") or data.get("data") or (data if isinstance(data, list) else [])
+        # Get users from response (all pages)
+        if use_snapshot:
+            users = get_inventory_snapshot(base_url, master_key, debug).users
+        else:
+            # レポートに models と team_id を出力するため、UserRecord ではなく全項目を取得する
+            users = client.fetch_all_users(debug=debug)
         
         # Filter out users without email (like default_user_id)
         valid_users = [user for user in users if user.get("user_email")]
@@ -431,7 +370,8 @@ def update_existing_users_csv(base_url: str, master_key: str, debug: bool = Fals
                 user['api_key'] = 'No API key found'
         
         if valid_users:
-            write_success_csv(valid_users, filename, base_url, master_key)
+            resolve_report_fields(base_url, master_key, valid_users, debug)
+            write_success_csv(valid_users, filename, base_url)
             print(f"Updated {len(valid_users)} existing users in '{filename}'")
         else:
             print("No valid users found to update")
@@ -439,6 +379,104 @@ def update_existing_users_csv(base_url: str, master_key: str, debug: bool = Fals
     except Exception as e:
         print(f"Failed to update existing users: {e}", file=sys.stderr)
 
+def provision_user(base_url: str, master_key: str, user: Dict, debug: bool = False, journal: RunJournal = None) -> Dict:
+    """Run the provisioning chain for one user (create, key alias, details)
+
+    Console lines are collected in "output" instead of printed, so the caller can
+    report results in CSV order even when users are provisioned concurrently.
+    Each completed step is recorded in the journal; steps already recorded by
+    an interrupted run are skipped.
+    """
+    email = user['email']
+    role = user['role']
+    team_name = user.get('team_name')
+    key_name = user.get('key_name')
+    output = []
+    
+    try:
+        if debug:
+            debug_msg = f"\nDEBUG: Creating user: {email} with role: {role}"
+            if team_name:
+                debug_msg += f" and team: {team_name}"
+            if key_name:
+                debug_msg += f" and key name: {key_name}"
+            print(debug_msg, file=sys.stderr)
+        
+        key = normalize_email(email)
+        result = journal.result("create", key) if journal else None
+        if result is None:
+            result = sanitize_user(create_user(base_url, master_key, email, role, team_name, debug))
+            if journal:
+                journal.record("create", key, result)
+        elif debug:
+            print(f"DEBUG: User {email} was created by the interrupted run, resuming", file=sys.stderr)
+        created_user = dict(result)
+        
+        # Get user_id and API key from creation result
+        user_id = result.get('user_id')
+        api_key = result.get('key')
+        
+        if user_id and api_key and key_name:
+            # Update the automatically created API key's alias
+            if journal and journal.result("key_alias", key) is not None:
+                update_result = True
+            else:
+                update_result = update_api_key_alias(base_url, master_key, api_key, key_name, debug)
+                if journal and update_result:
+                    journal.record("key_alias", key, {"key_alias": key_name})
+            if update_result:
+                created_user['key_name'] = key_name
+                if debug:
+                    print(f"DEBUG: Updated API key alias to '{key_name}' for user {email}", file=sys.stderr)
+            else:
+                if debug:
+                    print(f"DEBUG: Failed to update API key alias for user {email}", file=sys.stderr)
+        
+        if user_id:
+            # Get detailed user information including API keys
+            user_details = get_user_details(base_url, master_key, user_id, debug)
+            if user_details:
+                # Merge creation result with detailed info
+                created_user.update(user_details)
+        
+        if journal:
+            journal.record("provisioned", key, created_user)
+        output.append((f"✓ Created user: {email} (role: {role})", False))
+        return {"email": email, "created_user": created_user, "failed_user": None, "output": output}
+        
+    except requests.HTTPError as e:
+        error_msg = f"HTTPError: {e}"
+        if hasattr(e, 'response') and e.response:
+            response_text = e.response.text
+            error_msg += f" - {response_text}"
+            # Detailed error classification
+            if "already exists" in response_text.lower() or "duplicate" in response_text.lower():
+                error_reason = "User already exists (API response)"
+            elif "invalid" in response_text.lower() and "role" in response_text.lower():
+                error_reason = f"Invalid role '{role}' - not supported by LiteLLM"
+            elif "invalid" in response_text.lower() and "email" in response_text.lower():
+                error_reason = f"Invalid email format '{email}'"
+            elif e.response.status_code == 400:
+                error_reason = f"Bad request - check email format and role validity"
+            elif e.response.status_code == 401:
+                error_reason = "Unauthorized - invalid master key"
+            elif e.response.status_code == 403:
+                error_reason = "Forbidden - insufficient permissions"
+            elif e.response.status_code == 409:
+                error_reason = "Conflict - user already exists"
+            else:
+                error_reason = f"HTTP {e.response.status_code} error: {response_text[:100]}"
+        else:
+            error_reason = f"HTTP {e.response.status_code if hasattr(e, 'response') else 'unknown'} error without response details"
+        
+        output.append((f"✗ Failed to create user {email}: {error_msg}", True))
+        return {"email": email, "created_user": None, "failed_user": {"email": email, "role": role, "error": error_reason}, "output": output}
+        
+    except Exception as e:
+        error_reason = f"Unexpected error: {str(e)}"
+        output.append((f"✗ Failed to create user {email}: {error_reason}", True))
+        return {"email": email, "created_user": None, "failed_user": {"email": email, "role": role, "error": error_reason}, "output": output}
+
 def main():
     parser = argparse.ArgumentParser(
         description="Create LiteLLM users from CSV file",
@@ -460,6 +498,9 @@ Example usage:
   python add_user.py --csv-file user_addlist.csv --dry-run
   python add_user.py --user-role proxy_admin --debug
   python add_user.py --update-existing --debug
+  python add_user.py --csv-file user_addlist.csv --concurrency 8
+  python add_user.py --snapshot
+  python add_user.py --csv-file user_addlist.csv --resume
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -493,11 +534,27 @@ Example usage:
         action="store_true",
         help="Show debug information including raw API requests/responses",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of users provisioned in parallel (default: 1)",
+    )
     parser.add_argument(
         "--update-existing",
         action="store_true",
         help="Update CSV with existing user information instead of creating new users",
     )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Read users from the on-disk inventory snapshot, refreshed incrementally (see LITELLM_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its checkpoint journal, skipping users it already provisioned",
+    )
     args = parser.parse_args()
 
     if not args.master_key:
@@ -507,7 +564,7 @@ Example usage:
     # Handle update existing users mode
     if args.update_existing:
         print("Updating existing users information...")
-        update_existing_users_csv(args.base_url, args.master_key, args.debug)
+        update_existing_users_csv(args.base_url, args.master_key, args.debug, use_snapshot=args.snapshot)
         return
 
     # Read users from CSV
@@ -518,6 +575,16 @@ Example usage:
 
     print(f"Found {len(users)} users in '{args.csv_file}'")
     
+    # Size the shared connection pool for the worker threads before the
+    # validator's team lookup creates the client with the default pool
+    get_client(args.base_url, args.master_key, pool_size=max(DEFAULT_POOL_SIZE, args.concurrency))
+    
+    # Invalid rows (email, role, team name, duplicates) are rejected before any user API call
+    users, rejected = RowValidator(args.base_url, args.master_key, split_teams=False, debug=args.debug).validate(users)
+    if rejected:
+        print(f"Rejected {len(rejected)} invalid rows before contacting the API:")
+        print_rejected(rejected)
+    
     if args.dry_run:
         print("\nDRY RUN - Users that would be created:")
         for user in users:
@@ -529,92 +596,63 @@ Example usage:
             print(display_msg)
         return
 
+    # Every completed step is journaled so an interrupted run can be resumed
+    journal = RunJournal("add", args.base_url, args.csv_file, debug=args.debug).start(args.resume)
+    if journal.resumed:
+        print(f"Resuming interrupted run: {len(journal.results.get('provisioned', {}))} users already provisioned")
+    
+    # Fetch existing users once; the index is kept up to date as users are created
+    user_index = fetch_user_email_index(args.base_url, args.master_key, args.debug, args.snapshot)
+    
     # Create users
     created_users = []
-    failed_users = []
+    failed_users = [{"email": u['email'], "role": u['role'], "error": u['error']} for u in rejected]
     
-    for user in users:
-        email = user['email']
-        role = user['role']
-        team_name = user.get('team_name')
-        key_name = user.get('key_name')
-        
-        # Check if user already exists
-        if check_user_exists(args.base_url, args.master_key, email, args.debug):
-            error_reason = "User already exists in the system"
-            print(f"✗ Skipped user {email}: {error_reason}", file=sys.stderr)
-            failed_users.append({"email": email, "role": role, "error": error_reason})
-            continue
-        
-        try:
-            if args.debug:
-                debug_msg = f"\nDEBUG: Creating user: {email} with role: {role}"
-                if team_name:
-                    debug_msg += f" and team: {team_name}"
-                if key_name:
-                    debug_msg += f" and key name: {key_name}"
-                print(debug_msg, file=sys.stderr)
-            
-            result = create_user(args.base_url, args.master_key, email, role, team_name, args.debug)
-            created_user = sanitize_user(result)
-            
-            # Get user_id and API key from creation result
-            user_id = result.get('user_id')
-            api_key = result.get('key')
-            
-            if user_id and api_key and key_name:
-                # Update the automatically created API key's alias
-                update_result = update_api_key_alias(args.base_url, args.master_key, api_key, key_name, args.debug)
-                if update_result:
-                    created_user['key_name'] = key_name
-                    if args.debug:
-                        print(f"DEBUG: Updated API key alias to '{key_name}' for user {email}", file=sys.stderr)
-                else:
-                    if args.debug:
-                        print(f"DEBUG: Failed to update API key alias for user {email}", file=sys.stderr)
-            
-            if user_id:
-                # Get detailed user information including API keys
-                user_details = get_user_details(args.base_url, args.master_key, user_id, args.debug)
-                if user_details:
-                    # Merge creation result with detailed info
-                    created_user.update(user_details)
+    # Existence checks run in CSV order before anything is dispatched, so the
+    # outcome does not depend on how the worker threads are scheduled.
+    # Duplicate emails were already rejected by RowValidator.
+    jobs = []
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        for user in users:
+            email = user['email']
+            role = user['role']
+            normalized = normalize_email(email)
             
-            created_users.append(created_user)
-            print(f"✓ Created user: {email} (role: {role})")
+            # Users provisioned by the interrupted run are carried over from the journal
+            provisioned = journal.result("provisioned", normalized)
+            if provisioned is not None:
+                jobs.append({
+                    "email": email,
+                    "created_user": provisioned,
+                    "failed_user": None,
+                    "output": [(f"✓ Created user: {email} (role: {role}) (resumed)", False)],
+                })
+                continue
             
-        except requests.HTTPError as e:
-            error_msg = f"HTTPError: {e}"
-            if hasattr(e, 'response') and e.response:
-                response_text = e.response.text
-                error_msg += f" - {response_text}"
-                # Detailed error classification
-                if "already exists" in response_text.lower() or "duplicate" in response_text.lower():
-                    error_reason = "User already exists (API response)"
-                elif "invalid" in response_text.lower() and "role" in response_text.lower():
-                    error_reason = f"Invalid role '{role}' - not supported by LiteLLM"
-                elif "invalid" in response_text.lower() and "email" in response_text.lower():
-                    error_reason = f"Invalid email format '{email}'"
-                elif e.response.status_code == 400:
-                    error_reason = f"Bad request - check email format and role validity"
-                elif e.response.status_code == 401:
-                    error_reason = "Unauthorized - invalid master key"
-                elif e.response.status_code == 403:
-                    error_reason = "Forbidden - insufficient permissions"
-                elif e.response.status_code == 409:
-                    error_reason = "Conflict - user already exists"
-                else:
-                    error_reason = f"HTTP {e.response.status_code} error: {response_text[:100]}"
+            # Check if user already exists (a user created by the interrupted run is finished instead)
+            if check_user_exists(user_index, email) and journal.result("create", normalized) is None:
+                error_reason = "User already exists in the system"
             else:
-                error_reason = f"HTTP {e.response.status_code if hasattr(e, 'response') else 'unknown'} error without response details"
-            
-            print(f"✗ Failed to create user {email}: {error_msg}", file=sys.stderr)
-            failed_users.append({"email": email, "role": role, "error": error_reason})
+                jobs.append(executor.submit(provision_user, args.base_url, args.master_key, user, args.debug, journal))
+                continue
             
-        except Exception as e:
-            error_reason = f"Unexpected error: {str(e)}"
-            print(f"✗ Failed to create user {email}: {error_reason}", file=sys.stderr)
-            failed_users.append({"email": email, "role": role, "error": error_reason})
+            jobs.append({
+                "email": email,
+                "created_user": None,
+                "failed_user": {"email": email, "role": role, "error": error_reason},
+                "output": [(f"✗ Skipped user {email}: {error_reason}", True)],
+            })
+        
+        # Report in CSV order; each result is printed as soon as it and all earlier ones are done
+        for job in jobs:
+            outcome = job.result() if isinstance(job, Future) else job
+            for line, is_error in outcome["output"]:
+                print(line, file=sys.stderr if is_error else sys.stdout)
+            if outcome["created_user"] is not None:
+                created_users.append(outcome["created_user"])
+                user_index[normalize_email(outcome["email"])] = outcome["created_user"]
+            if outcome["failed_user"] is not None:
+                failed_users.append(outcome["failed_user"])
 
     # Summary
     print(f"\nSummary:")
@@ -622,13 +660,18 @@ Example usage:
     print(f"  Failed: {len(failed_users)} users")
     
     if created_users:
-        write_success_csv(created_users, "user_reg_result.csv", args.base_url, args.master_key, args.debug)
+        # Team names and invitations for all created users are resolved in one stage before writing
+        resolve_report_fields(args.base_url, args.master_key, created_users, args.debug, max(args.concurrency, DEFAULT_FETCH_WORKERS))
+        write_success_csv(created_users, "user_reg_result.csv", args.base_url)
     
     if failed_users:
         write_error_csv(failed_users)
         print(f"\nFailed users:")
         for failed in failed_users:
             print(f"  {failed['email']} ({failed['role']}): {failed['error']}")
+    
+    # The run is complete and its reports are written
+    journal.finish()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
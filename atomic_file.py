@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+def _current_umask() -> int:
+    # umask は読み取るだけの API がないため、設定して即座に戻す
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# プロセス全体の設定なので、スレッドが動き出す前の import 時に一度だけ読む
+UMASK = _current_umask()
+
+def default_mode(path: str) -> int:
+    """Mode a plain open() would give `path`: the existing file's mode, else 0666 minus the umask"""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+@contextmanager
+def atomic_write(path: str, newline: Optional[str] = None, encoding: str = "utf-8", mode: Optional[int] = None) -> Iterator[IO[str]]:
+    """Open a temporary file next to `path` for writing and rename it over `path` on success
+
+    Readers see either the previous file or the complete new one, never a
+    partial write. If the block raises, the temporary file is removed and
+    `path` is left untouched. The file gets `mode`, or by default the mode
+    of the file it replaces (0666 minus the umask for a new file); pass
+    0o600 for private caches.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = "." + os.path.basename(path) + "."
+    fd, tmp = tempfile.mkstemp(prefix=prefix, suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", newline=newline, encoding=encoding) as f:
+            yield f
+            # mkstemp は 0600 で作成するため、置き換え前に本来のモードへ戻す
+            os.fchmod(f.fileno(), default_mode(path) if mode is None else mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
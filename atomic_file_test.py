@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+import atomic_file
+from atomic_file import atomic_write
+
+def mode_of(path):
+    return os.stat(path).st_mode & 0o777
+
+def test_new_file_follows_the_umask(tmp_path, monkeypatch):
+    monkeypatch.setattr(atomic_file, "UMASK", 0o027)
+    path = str(tmp_path / "result.csv")
+    with atomic_write(path, newline='') as f:
+        f.write("email\n")
+    assert mode_of(path) == 0o640
+
+def test_existing_file_keeps_its_mode(tmp_path):
+    path = tmp_path / "result.csv"
+    path.write_text("old\n")
+    os.chmod(path, 0o604)
+    with atomic_write(str(path)) as f:
+        f.write("new\n")
+    assert path.read_text() == "new\n"
+    assert mode_of(path) == 0o604
+
+def test_explicit_mode_for_private_caches(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{}")
+    os.chmod(path, 0o644)
+    with atomic_write(str(path), mode=0o600) as f:
+        f.write("[]")
+    assert mode_of(path) == 0o600
+
+def test_failed_write_leaves_the_file_untouched(tmp_path):
+    path = tmp_path / "result.csv"
+    path.write_text("old\n")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write("partial")
+            raise RuntimeError("boom")
+    assert path.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["result.csv"]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import gc
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List
+import list_user
+import sync_user
+from team_directory import get_team_directory
+from user_record import compact_users
+
+# API を呼ばないダミーの接続先（チーム一覧は事前にロード済みのディレクトリから引く）
+BENCH_BASE_URL = "http://bench.invalid"
+BENCH_MASTER_KEY = "sk-bench"
+BENCHMARKS = ["read_csv_users", "compare_users", "sanitize_user", "compact_users", "write_sync_report", "list_filter_format"]
+ROLES = ["internal_user", "internal_user", "internal_user", "internal_user_viewer", "proxy_admin", "proxy_admin_viewer"]
+LIST_COLUMNS = ["user_id", "user_email", "user_role", "teams", "created_at", "updated_at"]
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def make_teams(count: int) -> List[Dict]:
+    return [{"team_id": f"team-id-{i:04d}", "team_alias": f"team{i:03d}", "members_with_roles": []} for i in range(count)]
+
+def make_api_users(size: int, teams: List[Dict], rng: random.Random) -> List[Dict]:
+    """Synthetic /user/list records shaped like the proxy's response"""
+    users = []
+    for i in range(size):
+        team_ids = [teams[i % len(teams)]["team_id"]]
+        if rng.random() < 0.1:
+            team_ids.append(teams[(i + 1) % len(teams)]["team_id"])
+        users.append({
+            "user_id": f"uid-{i:08d}",
+            "user_email": f"user{i:08d}@example.com",
+            "user_role": ROLES[i % len(ROLES)],
+            "teams": team_ids,
+            "models": [],
+            "spend": round(rng.random() * 10, 4),
+            "max_budget": None,
+            "key_count": 1,
+            "metadata": {"department": f"dept{i % 50}"},
+            "password": "x",  # sanitize_user で除外される項目
+            "created_at": "2024-01-01T00:00:00.000000Z",
+            "updated_at": "2024-01-02T00:00:00.000000Z",
+        })
+    return users
+
+def csv_rows(api_users: List[Dict], teams: List[Dict], changes: float) -> List[List[str]]:
+    """Desired-state rows derived from the inventory with a fraction of deletions, role changes and additions"""
+    names = {t["team_id"]: t["team_alias"] for t in teams}
+    step = max(1, int(1 / changes)) if changes > 0 else 0
+    rows = []
+    for i, u in enumerate(api_users):
+        if step and i % step == 0:
+            continue  # 削除対象
+        role = u["user_role"]
+        if step and i % step == 1:
+            role = "internal_user_viewer" if role != "internal_user_viewer" else "internal_user"
+        rows.append([u["user_email"], role, " ".join(names[t] for t in u["teams"]), f"{i:08d}_chatbot"])
+    additions = len(api_users) // step if step else 0
+    for i in range(additions):
+        rows.append([f"new{i:08d}@example.com", "internal_user", teams[0]["team_alias"], ""])
+    return rows
+
+def write_csv(filename: str, rows: List[List[str]]):
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "role", "team_name", "key_name"])
+        writer.writerows(rows)
+
+def make_sync_results(to_add: List[Dict], to_delete: List[Dict], to_update: List[Dict], unchanged: List[Dict]) -> Dict:
+    """Shape the comparison result like apply_sync_plan() does after a successful run"""
+    return {
+        "added": [dict(u, user_id="uid-new", api_key="sk-xxxx", success=True) for u in to_add],
+        "deleted": [dict(u, success=True) for u in to_delete],
+        "updated": [{"email": u["email"], "user_id": u["user_id"], "role": u["new_role"], "team_name": u["new_teams"],
+                     "api_key": "", "success": True} for u in to_update],
+        "unchanged": unchanged,
+    }
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """Best wall time over `repeat` runs (GC disabled while timing)"""
+    best = None
+    for _ in range(max(1, repeat)):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure_allocations(func: Callable[[], object]) -> Dict[str, int]:
+    """Memory blocks allocated by one run, traced with tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    retained_blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    retained_bytes = sum(s.size_diff for s in stats if s.size_diff > 0)
+    del result
+    return {"peak_bytes": peak, "retained_blocks": retained_blocks, "retained_bytes": retained_bytes}
+
+def bench_size(size: int, args, workdir: str) -> List[Dict]:
+    rng = random.Random(args.seed)
+    teams = make_teams(args.teams)
+    # 事前にロードしたチームディレクトリを使い、/team/list を呼ばない
+    get_team_directory(BENCH_BASE_URL, BENCH_MASTER_KEY).load(teams=teams)
+
+    started = time.perf_counter()
+    api_users = make_api_users(size, teams, rng)
+    csv_file = os.path.join(workdir, f"users_{size}.csv")
+    write_csv(csv_file, csv_rows(api_users, teams, args.changes))
+    print(f"[{size} records] dataset generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    csv_users = sync_user.read_csv_users(csv_file, sync_user.DEFAULT_USER_ROLE)
+    to_add, to_delete, to_update, unchanged = sync_user.compare_users(csv_users, api_users, BENCH_BASE_URL, BENCH_MASTER_KEY)
+    sync_results = make_sync_results(to_add, to_delete, to_update, unchanged)
+    report_file = os.path.join(workdir, "user_sync_result.csv")
+
+    def run_write_sync_report():
+        with redirect_stdout(io.StringIO()):
+            sync_user.write_sync_report(sync_results, report_file)
+
+    def run_list_filter_format():
+        sink = io.StringIO()
+        writer = list_user.RowWriter(args.format, LIST_COLUMNS, sink)
+        # list_user.main と同じ ページ単位の フィルタ → サニタイズ → 出力
+        for start in range(0, len(api_users), args.page_size):
+            page = api_users[start:start + args.page_size]
+            writer.write_page(list_user.sanitize_user(u) for u in page if list_user.user_matches(u, True, None, args.email_like))
+        return sink.tell()
+
+    cases = {
+        "read_csv_users": (lambda: sync_user.read_csv_users(csv_file, sync_user.DEFAULT_USER_ROLE), len(csv_users)),
+        "compare_users": (lambda: sync_user.compare_users(csv_users, api_users, BENCH_BASE_URL, BENCH_MASTER_KEY), len(csv_users) + len(api_users)),
+        "sanitize_user": (lambda: [sync_user.sanitize_user(u) for u in api_users], len(api_users)),
+        "compact_users": (lambda: compact_users(api_users), len(api_users)),
+        "write_sync_report": (run_write_sync_report, sum(len(v) for v in sync_results.values())),
+        "list_filter_format": (run_list_filter_format, len(api_users)),
+    }
+
+    results = []
+    for name in args.benchmarks:
+        func, records = cases[name]
+        seconds = measure(func, args.repeat)
+        result = {
+            "benchmark": name,
+            "size": size,
+            "records": records,
+            "best_seconds": round(seconds, 4),
+            "ns_per_record": round(seconds / records * 1e9, 1) if records else None,
+        }
+        if not args.no_alloc:
+            alloc = measure_allocations(func)
+            result.update(alloc)
+            result["peak_bytes_per_record"] = round(alloc["peak_bytes"] / records, 1) if records else None
+            result["retained_blocks_per_record"] = round(alloc["retained_blocks"] / records, 2) if records else None
+        print(f"[{size} records] {name:<19} {result['best_seconds']:>9.4f}s {result['ns_per_record'] or 0:>10.1f} ns/rec"
+              + (f" {result['peak_bytes_per_record']:>9.1f} B/rec peak" if not args.no_alloc else ""), file=sys.stderr)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks for the CPU-bound steps of sync_user.py and list_user.py (no API calls)",
+        epilog="""
+Benchmarks:
+  read_csv_users      sync_user.read_csv_users on a generated CSV
+  compare_users       sync_user.compare_users (team names from a pre-loaded TeamDirectory)
+  sanitize_user       sync_user.sanitize_user over every API record
+  compact_users       projection of every API record into a UserRecord
+  write_sync_report   sync_user.write_sync_report for the comparison result
+  list_filter_format  list_user filter -> sanitize -> RowWriter loop, page by page
+
+Timings are the best of --repeat runs with GC disabled. Allocation figures come
+from a separate run under tracemalloc: peak traced bytes and blocks still
+allocated afterwards (which include the returned data).
+
+Example usage:
+  python bench_cpu.py
+  python bench_cpu.py --sizes 10000,100000 --benchmarks compare_users,list_filter_format
+  python bench_cpu.py --sizes 1000000 --no-alloc --output bench_cpu.json
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=parse_int_list, default=[10000, 100000, 1000000],
+                        help="Comma-separated dataset sizes (default: 10000,100000,1000000)")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help=f"Comma-separated benchmarks to run (default: {','.join(BENCHMARKS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark, best is reported (default: 3)")
+    parser.add_argument("--changes", type=float, default=0.01,
+                        help="Fraction of users deleted, updated and added in the CSV (default: 0.01)")
+    parser.add_argument("--teams", type=int, default=20, help="Number of synthetic teams (default: 20)")
+    parser.add_argument("--format", choices=["tsv", "csv", "ndjson"], default="tsv", help="list_user output format (default: tsv)")
+    parser.add_argument("--email-like", default=None, help="list_user --email-like filter (default: none)")
+    parser.add_argument("--page-size", type=int, default=100, help="Page size for the list loop (default: 100)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the dataset (default: 42)")
+    parser.add_argument("--no-alloc", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file (default: stdout)")
+    args = parser.parse_args()
+
+    args.benchmarks = [b.strip() for b in args.benchmarks.split(",") if b.strip()]
+    unknown = [b for b in args.benchmarks if b not in BENCHMARKS]
+    if unknown:
+        print(f"ERROR: Unknown benchmark(s): {', '.join(unknown)}", file=sys.stderr)
+        sys.exit(1)
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+        },
+        "config": {
+            "sizes": args.sizes,
+            "benchmarks": args.benchmarks,
+            "repeat": args.repeat,
+            "changes": args.changes,
+            "teams": args.teams,
+            "format": args.format,
+            "email_like": args.email_like,
+            "page_size": args.page_size,
+        },
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="litellm-bench-cpu-") as workdir:
+        for size in args.sizes:
+            report["results"].extend(bench_size(size, args, workdir))
+            gc.collect()
+
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+        print(f"Benchmark report written to: {args.output}", file=sys.stderr)
+    else:
+        print(data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import csv
+import json
+import time
+import re
+import argparse
+import platform
+import tempfile
+import subprocess
+import http.client
+from urllib.parse import urlparse
+from typing import Dict, List, Optional
+from mock_litellm_server import MockLiteLLMServer, MockLiteLLMState
+from sync_user import INTERNAL_ROLES
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["list", "sync-dry-run", "add", "del", "sync"]
+BENCH_DOMAIN = "bench.example"
+BENCH_MASTER_KEY = "sk-bench"
+UUID_SEGMENT = re.compile(r"/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?=/|$)")
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def snapshot_stats(server: MockLiteLLMServer) -> Dict[str, int]:
+    with server.state.lock:
+        return dict(server.state.stats)
+
+def diff_stats(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    """Requests per endpoint issued between two snapshots (user IDs in paths collapsed)"""
+    diff: Dict[str, int] = {}
+    for key in sorted(after):
+        delta = after[key] - before.get(key, 0)
+        if delta:
+            endpoint = UUID_SEGMENT.sub("/{user_id}", key)
+            diff[endpoint] = diff.get(endpoint, 0) + delta
+    return diff
+
+def mock_round_trip_ms(server: MockLiteLLMServer, samples: int = 50) -> float:
+    """Median round trip of /_stats over one keep-alive connection (the mock's own floor per request)"""
+    # /_stats は遅延注入・エラー注入・認証の前に応答するため、モックと HTTP スタック自体のコストだけを測れる
+    url = urlparse(server.base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    timings = []
+    try:
+        for _ in range(samples):
+            started = time.perf_counter()
+            conn.request("GET", "/_stats")
+            conn.getresponse().read()
+            timings.append(time.perf_counter() - started)
+    finally:
+        conn.close()
+    timings.sort()
+    return round(timings[len(timings) // 2] * 1000, 3)
+
+def peak_rss_kb(rusage) -> int:
+    # ru_maxrss は Linux では KB、macOS では バイト単位
+    return rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+
+def team_display(state: MockLiteLLMState, team_ids: List[str]) -> str:
+    names = {t["team_id"]: t.get("team_alias") or t.get("team_name", "") for t in state.teams}
+    return " ".join(names[t] for t in team_ids if t in names)
+
+def write_csv(filename: str, header: List[str], rows: List[List[str]]):
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def inventory_rows(state: MockLiteLLMState) -> List[List[str]]:
+    """CSV rows (email, role, team_name, key_name) matching the current inventory"""
+    with state.lock:
+        users = list(state.ordered_users())
+    rows = []
+    for u in users:
+        # sync_user.py が同期対象としないロールは CSV に含めない
+        if u.get("user_email") and u.get("user_role") in INTERNAL_ROLES:
+            rows.append([u["user_email"], u["user_role"], team_display(state, u.get("teams", [])), ""])
+    return rows
+
+def prepare_add_csv(workdir: str, state: MockLiteLLMState, tag: str, changes: int) -> str:
+    team = state.teams[0]["team_alias"] if state.teams else ""
+    rows = [[f"{tag}-{i:06d}@{BENCH_DOMAIN}", "internal_user", team, ""] for i in range(changes)]
+    filename = os.path.join(workdir, f"add_{tag}.csv")
+    write_csv(filename, ["email", "role", "team_name", "key_name"], rows)
+    return filename
+
+def prepare_del_csv(workdir: str, tag: str, changes: int) -> str:
+    rows = [[f"{tag}-{i:06d}@{BENCH_DOMAIN}"] for i in range(changes)]
+    filename = os.path.join(workdir, f"del_{tag}.csv")
+    write_csv(filename, ["email"], rows)
+    return filename
+
+def prepare_sync_csv(workdir: str, state: MockLiteLLMState, tag: str, changes: int) -> str:
+    """Inventory CSV with `changes` deletions, role changes and additions each"""
+    rows = inventory_rows(state)
+    rows = rows[changes:]  # 先頭を削除対象にする
+    for row in rows[:changes]:
+        row[1] = "internal_user_viewer" if row[1] != "internal_user_viewer" else "internal_user"
+    team = state.teams[0]["team_alias"] if state.teams else ""
+    rows.extend([f"{tag}-sync-{i:06d}@{BENCH_DOMAIN}", "internal_user", team, ""] for i in range(changes))
+    filename = os.path.join(workdir, f"sync_{tag}.csv")
+    write_csv(filename, ["email", "role", "team_name", "key_name"], rows)
+    return filename
+
+def run_script(args: List[str], workdir: str, env: Dict[str, str], timeout: Optional[float]) -> Dict:
+    """Run one script as a child process and measure wall time and peak RSS"""
+    log = os.path.join(workdir, "last_run.log")
+    with open(log, "wb") as out:
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + args, cwd=workdir, env=env,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=out)
+        # wait4 で子プロセス単体の rusage を取得する（RUSAGE_CHILDREN は全子プロセスの最大値になるため）
+        deadline = started + timeout if timeout else None
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if deadline and time.perf_counter() > deadline:
+                proc.kill()
+                pid, status, rusage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(0.01)
+        wall = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    with open(log, "rb") as f:
+        tail = f.read()[-2000:].decode("utf-8", "replace")
+    return {
+        "exit_code": proc.returncode,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_kb": peak_rss_kb(rusage),
+        "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "stderr_tail": tail if proc.returncode else "",
+    }
+
+def bench_scenario(server: MockLiteLLMServer, scenario: str, script_args: List[str], records: int,
+                   workdir: str, env: Dict[str, str], timeout: Optional[float], meta: Dict) -> Dict:
+    before = snapshot_stats(server)
+    result = run_script(script_args, workdir, env, timeout)
+    by_endpoint = diff_stats(before, snapshot_stats(server))
+    requests_total = by_endpoint.pop("total", 0)
+    result.update({
+        "scenario": scenario,
+        "records": records,
+        "requests": requests_total,
+        "requests_per_record": round(requests_total / records, 3) if records else None,
+        "requests_per_second": round(requests_total / result["wall_seconds"], 1) if result["wall_seconds"] else None,
+        "requests_by_endpoint": by_endpoint,
+        "command": " ".join(os.path.basename(a) if i == 0 else a for i, a in enumerate(script_args)),
+    })
+    result.update(meta)
+    return result
+
+def bench_size(size: int, args, workdir: str) -> List[Dict]:
+    started = time.perf_counter()
+    state = MockLiteLLMState(size, args.teams, args.seed)
+    server = MockLiteLLMServer("127.0.0.1", 0, state, BENCH_MASTER_KEY, args.latency_ms / 1000.0,
+                               args.jitter_ms / 1000.0, args.error_rate)
+    server.start_background()
+    floor_ms = mock_round_trip_ms(server)
+    print(f"[{size} users] seeded in {time.perf_counter() - started:.1f}s, mock at {server.base_url}, "
+          f"round trip {floor_ms:.2f}ms", file=sys.stderr)
+
+    env = dict(os.environ)
+    env.update({
+        "LITELLM_BASE_URL": server.base_url,
+        "LITELLM_MASTER_KEY": BENCH_MASTER_KEY,
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    if args.page_size:
+        env["LITELLM_PAGE_SIZE"] = str(args.page_size)
+
+    def script(name: str) -> str:
+        return os.path.join(SCRIPT_DIR, name)
+
+    common = ["--base-url", server.base_url, "--master-key", BENCH_MASTER_KEY]
+    results = []
+
+    def record(scenario: str, script_args: List[str], records: int, **meta):
+        meta = dict({"users": size, "concurrency": None, "mock_round_trip_ms": floor_ms}, **meta)
+        result = bench_scenario(server, scenario, script_args, records, workdir, env, args.timeout, meta)
+        status = "ok" if result["exit_code"] == 0 else f"exit {result['exit_code']}"
+        print(f"[{size} users] {scenario:<13} c={meta['concurrency'] or '-':<3} {result['wall_seconds']:>8.2f}s "
+              f"{result['requests']:>7} req {result['peak_rss_kb'] / 1024:>7.1f} MiB  {status}", file=sys.stderr)
+        results.append(result)
+
+    try:
+        if "list" in args.scenarios:
+            record("list", [script("list_user.py")] + common + ["--show-all"], len(state.users))
+
+        if "sync-dry-run" in args.scenarios:
+            csv_file = prepare_sync_csv(workdir, state, "dry", args.changes)
+            record("sync-dry-run", [script("sync_user.py")] + common + ["--csv-file", csv_file, "--dry-run"], len(state.users))
+
+        for concurrency in args.concurrency:
+            tag = f"c{concurrency}"
+            if "add" in args.scenarios:
+                csv_file = prepare_add_csv(workdir, state, tag, args.changes)
+                record("add", [script("add_user.py")] + common + ["--csv-file", csv_file, "--concurrency", str(concurrency)],
+                       args.changes, concurrency=concurrency)
+            if "del" in args.scenarios:
+                csv_file = prepare_del_csv(workdir, tag, args.changes)
+                record("del", [script("del_user.py")] + common + ["--csv-file", csv_file, "--batch-size", str(args.batch_size)],
+                       args.changes, concurrency=concurrency)
+            if "sync" in args.scenarios:
+                csv_file = prepare_sync_csv(workdir, state, tag, args.changes)
+                record("sync", [script("sync_user.py")] + common + ["--csv-file", csv_file, "--concurrency", str(concurrency)],
+                       args.changes * 3, concurrency=concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end throughput benchmark of add/del/list/sync against a local mock LiteLLM proxy",
+        epilog="""
+Each scenario runs the real script as a child process against an in-process
+mock_litellm_server.py and reports wall time, requests issued (per endpoint
+and per record), requests/sec and peak RSS of the child as JSON. Every
+result also carries mock_round_trip_ms, the mock's own per-request floor
+measured before the run; time spent in the mock is part of wall_seconds.
+
+Scenarios:
+  list          list_user.py --show-all over the whole inventory
+  sync-dry-run  sync_user.py --dry-run with an inventory-sized CSV
+  add           add_user.py creating --changes new users
+  del           del_user.py deleting the users created by "add"
+  sync          sync_user.py applying --changes deletions, role changes and additions
+
+Example usage:
+  python bench_throughput.py
+  python bench_throughput.py --sizes 1000,10000 --latency-ms 20 --concurrency 1,8
+  python bench_throughput.py --scenarios list,sync-dry-run --sizes 100000 --output bench.json
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=parse_int_list, default=[1000, 10000, 100000],
+                        help="Comma-separated inventory sizes (default: 1000,10000,100000)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run (default: {','.join(SCENARIOS)})")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Latency injected per request (default: 5)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency per request (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503 (default: 0)")
+    parser.add_argument("--changes", type=int, default=100,
+                        help="Users added/deleted/updated by the mutating scenarios (default: 100)")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1],
+                        help="Comma-separated --concurrency values to compare for add/sync (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=100, help="del_user.py --batch-size (default: 100)")
+    parser.add_argument("--page-size", type=int, default=None, help="LITELLM_PAGE_SIZE passed to the scripts (default: script default)")
+    parser.add_argument("--teams", type=int, default=20, help="Number of seeded teams (default: 20)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the dataset (default: 42)")
+    parser.add_argument("--timeout", type=float, default=None, help="Kill a scenario after this many seconds (default: none)")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file (default: stdout)")
+    args = parser.parse_args()
+
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        print(f"ERROR: Unknown scenario(s): {', '.join(unknown)}", file=sys.stderr)
+        sys.exit(1)
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "sizes": args.sizes,
+            "scenarios": args.scenarios,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "changes": args.changes,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "page_size": args.page_size,
+        },
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="litellm-bench-") as workdir:
+        for size in args.sizes:
+            report["results"].extend(bench_size(size, args, workdir))
+
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+        print(f"Benchmark report written to: {args.output}", file=sys.stderr)
+    else:
+        print(data)
+
+    if any(r["exit_code"] != 0 for r in report["results"]):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
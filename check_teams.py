@@ -1,19 +1,14 @@
 #!/usr/bin/env python3
 import os
-import requests
 from dotenv import load_dotenv
+from litellm_client import get_client
 
 load_dotenv()
 base_url = os.getenv('LITELLM_BASE_URL', 'http://localhost:4000')
 master_key = os.getenv('LITELLM_MASTER_KEY')
 
-headers = {
-    'Authorization': f'Bearer {master_key}',
-    'Content-Type': 'application/json',
-}
-
-url = f'{base_url.rstrip("/")}/team/list'
-r = requests.get(url, headers=headers, timeout=30)
+client = get_client(base_url, master_key)
+r = client.get('/team/list')
 r.raise_for_status()
 data = r.json()
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import csv
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_CSV_WORKERS = int(os.getenv("LITELLM_CSV_WORKERS", "0"))  # 0 = CPU数
+PARALLEL_MIN_BYTES = int(os.getenv("LITELLM_CSV_PARALLEL_MIN_BYTES", str(32 * 1024 * 1024)))  # これより小さいファイルは1プロセスで読む
+CHUNKS_PER_WORKER = 4
+
+USER_COLUMNS = ("email", "role", "team_name", "key_name")
+EMAIL_COLUMNS = ("email",)
+
+def column_indexes(header: List[str], columns: Tuple[str, ...]) -> Tuple[int, ...]:
+    """Position of each wanted column in the header (-1 if absent)"""
+    # 同名の列が複数ある場合は DictReader と同じく最後の列を使う
+    positions = {name: i for i, name in enumerate(header)}
+    return tuple(positions.get(column, -1) for column in columns)
+
+def user_rows(rows: Iterable[List[str]], indexes: Tuple[int, ...], default_role: str) -> Iterator[Dict[str, str]]:
+    """User dicts (email, role, team_name, key_name) from CSV rows, skipping rows without an email"""
+    email_i, role_i, team_i, key_i = indexes
+    for row in rows:
+        width = len(row)
+        email = row[email_i].strip() if 0 <= email_i < width else ""
+        if not email:
+            continue
+        role = (row[role_i].strip() if 0 <= role_i < width else "") or default_role
+        user_data = {"email": email, "role": role}
+        team_name = row[team_i].strip() if 0 <= team_i < width else ""
+        if team_name:
+            user_data["team_name"] = team_name
+        key_name = row[key_i].strip() if 0 <= key_i < width else ""
+        if key_name:
+            user_data["key_name"] = key_name
+        yield user_data
+
+def email_rows(rows: Iterable[List[str]], indexes: Tuple[int, ...]) -> Iterator[str]:
+    """Non-empty email addresses from CSV rows"""
+    email_i = indexes[0]
+    for row in rows:
+        email = row[email_i].strip() if 0 <= email_i < len(row) else ""
+        if email:
+            yield email
+
+def parse_rows(rows: Iterable[List[str]], indexes: Tuple[int, ...], default_role: Optional[str]) -> Iterator:
+    if default_role is None:
+        return email_rows(rows, indexes)
+    return user_rows(rows, indexes, default_role)
+
+def record_end(data, start: int, after: Optional[int] = None) -> int:
+    """Offset just past the first record-ending line break at or after `after` (-1 if none)
+
+    `start` must be a record boundary. Assumes RFC 4180 quoting: a quote only
+    appears inside a quoted field, where it is doubled, so a line break ends a
+    record exactly when the number of quotes since `start` is even.
+    """
+    pos = start if after is None else after
+    quotes = data[start:pos].count(b'"')
+    while True:
+        newline = data.find(b"\n", pos)
+        if newline < 0:
+            return -1
+        quotes += data[pos:newline].count(b'"')
+        pos = newline + 1
+        if quotes % 2 == 0:
+            return pos
+
+def split_records(data, start: int, end: int, parts: int) -> List[Tuple[int, int]]:
+    """Split data[start:end] into about `parts` (start, end) ranges that each hold whole records"""
+    ranges = []
+    step = max(1, (end - start) // max(1, parts))
+    begin = start
+    while begin < end:
+        # 目標位置を含むレコードの終わりで区切る
+        boundary = record_end(data, begin, min(begin + step, end))
+        if boundary < 0 or boundary >= end:
+            ranges.append((begin, end))
+            break
+        ranges.append((begin, boundary))
+        begin = boundary
+    return ranges
+
+def parse_chunk(csv_file: str, start: int, end: int, indexes: Tuple[int, ...], default_role: Optional[str]) -> List:
+    """Parse the whole records in bytes [start, end) of the file (runs in a worker process)"""
+    with open(csv_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = data[start:end].decode("utf-8")
+    # open(..., 'r') と同じく改行コードを \n に変換してから解析する
+    return list(parse_rows(csv.reader(io.StringIO(text, newline=None)), indexes, default_role))
+
+def read_header(data) -> Tuple[List[str], int]:
+    """Header row and the offset where the data rows start"""
+    end = record_end(data, 0)
+    if end < 0:
+        end = len(data)
+    text = data[:end].decode("utf-8")
+    header = next(csv.reader(io.StringIO(text, newline=None)), [])
+    return header, end
+
+def iter_csv_rows(csv_file: str, default_role: Optional[str] = None) -> Iterator:
+    """Parse the CSV file in this process one row at a time
+
+    Yields user dicts when `default_role` is given, email strings otherwise.
+    """
+    with open(csv_file, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = EMAIL_COLUMNS if default_role is None else USER_COLUMNS
+        yield from parse_rows(reader, column_indexes(header, columns), default_role)
+
+def read_csv_rows(csv_file: str, default_role: Optional[str] = None, workers: int = DEFAULT_CSV_WORKERS) -> List:
+    """Parse a whole CSV file, in parallel chunks for large files
+
+    The file is memory-mapped and split at record boundaries; the chunks are
+    parsed in a process pool and concatenated in file order, so the result
+    (and with it duplicate detection, which runs in CSV order) is identical
+    to iter_csv_rows. Files smaller than LITELLM_CSV_PARALLEL_MIN_BYTES, a
+    single worker, or a failing pool fall back to parsing in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(csv_file)
+    if workers <= 1 or size < PARALLEL_MIN_BYTES:
+        return list(iter_csv_rows(csv_file, default_role))
+
+    with open(csv_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header, start = read_header(data)
+            ranges = split_records(data, start, size, workers * CHUNKS_PER_WORKER)
+    if not ranges:
+        return []
+    columns = EMAIL_COLUMNS if default_role is None else USER_COLUMNS
+    indexes = column_indexes(header, columns)
+
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            futures = [executor.submit(parse_chunk, csv_file, begin, end, indexes, default_role) for begin, end in ranges]
+            rows = []
+            for future in futures:
+                rows.extend(future.result())
+            return rows
+    except (OSError, ImportError, RuntimeError):
+        # プロセスを作れない環境（セマフォ非対応など）では1プロセスで読む
+        return list(iter_csv_rows(csv_file, default_role))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv_ingest
+from csv_ingest import USER_COLUMNS, column_indexes, iter_csv_rows, parse_chunk, read_csv_rows, read_header, split_records
+
+# 引用符内の改行（LF / CRLF）・二重引用符・区切り文字・多バイト文字を含む CSV
+QUOTED_MULTILINE = (
+    'email,role,team_name,key_name\r\n'
+    'a@example.com,internal_user,"Data\nScience","key, ""one"""\r\n'
+    'b@example.com,,"team1\r\nteam2",\r\n'
+    '"c@example.com",proxy_admin,"""quoted""\n\nlines",ユーザー\r\n'
+    ',internal_user,skipped,\r\n'
+    'd@example.com,internal_user,"",last'
+)
+
+def write(tmp_path, text):
+    path = tmp_path / "users.csv"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+def chunked_rows(csv_file, parts, default_role):
+    """Rows parsed chunk by chunk the way read_csv_rows does, in this process"""
+    with open(csv_file, "rb") as f:
+        data = f.read()
+    header, start = read_header(data)
+    indexes = column_indexes(header, USER_COLUMNS if default_role else csv_ingest.EMAIL_COLUMNS)
+    ranges = split_records(data, start, len(data), parts)
+    # 範囲は隙間なく連続し、ファイル末尾まで覆う
+    assert [begin for begin, _ in ranges] == [start] + [end for _, end in ranges[:-1]]
+    assert ranges[-1][1] == len(data)
+    rows = []
+    for begin, end in ranges:
+        rows.extend(parse_chunk(csv_file, begin, end, indexes, default_role))
+    return rows
+
+def test_chunk_edges_inside_quoted_newlines(tmp_path):
+    csv_file = write(tmp_path, QUOTED_MULTILINE)
+    size = len(QUOTED_MULTILINE.encode("utf-8"))
+    for default_role in (None, "internal_user"):
+        expected = list(iter_csv_rows(csv_file, default_role))
+        # 分割数を1バイト単位まで増やし、チャンク境界があらゆる位置に来るようにする
+        for parts in range(1, size + 1):
+            assert chunked_rows(csv_file, parts, default_role) == expected, (default_role, parts)
+
+def test_quoted_fields_keep_their_line_breaks(tmp_path):
+    rows = list(iter_csv_rows(write(tmp_path, QUOTED_MULTILINE), "internal_user"))
+    assert [row["email"] for row in rows] == ["a@example.com", "b@example.com", "c@example.com", "d@example.com"]
+    assert rows[0]["team_name"] == "Data\nScience"
+    assert rows[1] == {"email": "b@example.com", "role": "internal_user", "team_name": "team1\nteam2"}
+    assert rows[2]["key_name"] == "ユーザー"
+
+def test_duplicate_header_uses_the_last_column(tmp_path):
+    csv_file = write(tmp_path, "email,note,email\nfirst@example.com,x,last@example.com\n")
+    assert list(iter_csv_rows(csv_file)) == ["last@example.com"]
+    assert chunked_rows(csv_file, 4, None) == ["last@example.com"]
+
+def test_read_csv_rows_with_a_process_pool_matches_one_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_ingest, "PARALLEL_MIN_BYTES", 0)
+    csv_file = write(tmp_path, QUOTED_MULTILINE + "\n" + "\n".join(f"u{i}@example.com,,\"t\n{i}\"," for i in range(50)))
+    for default_role in (None, "internal_user"):
+        assert read_csv_rows(csv_file, default_role, workers=2) == list(iter_csv_rows(csv_file, default_role))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+from typing import Dict, Iterable, List, Tuple
+from sync_state import normalize_email
+from team_directory import get_team_directory
+
+INTERNAL_ROLES = {
+    "internal_user",
+    "internal_user_viewer",
+    "proxy_admin",
+    "proxy_admin_viewer",
+    "user",
+    "default",
+    "end_user",
+}
+
+# local@domain: 空白・@・区切り文字を含まず、ドメインは空でないラベルをドットでつないだもの
+EMAIL_PATTERN = re.compile(r'[^\s@"(),:;<>\[\]\\]+@[^\s@"(),:;<>\[\]\\.]+(?:\.[^\s@"(),:;<>\[\]\\.]+)*')
+
+DUPLICATE_EMAIL = "Duplicate email in CSV file"
+
+def email_error(email: str) -> str:
+    """Reason an email address is malformed ("" if it looks valid)"""
+    if not EMAIL_PATTERN.fullmatch(email):
+        return f"Invalid email address '{email}'"
+    return ""
+
+class RowValidator:
+    """Checks CSV user rows locally, before any user API call is made
+
+    Every row is checked against the email grammar, the role set and the team
+    directory (one /team/list fetch, shared with the rest of the run), and
+    repeated emails are rejected case-insensitively, keeping the first row.
+    Team lookups are memoized per distinct team_name value, so a large CSV
+    costs a few set and dict lookups per row. With `split_teams` the team_name
+    column is a space-separated list of teams, resolved like the sync
+    comparison so names containing spaces match as a whole (sync_user),
+    otherwise a single team name (add_user).
+    """
+
+    def __init__(self, base_url: str, master_key: str, split_teams: bool = True, debug: bool = False):
+        self.base_url = base_url
+        self.master_key = master_key
+        self.split_teams = split_teams
+        self.debug = debug
+        self.directory = None
+        self.directory_checked = False
+        self.team_errors: Dict[str, str] = {}
+
+    def team_error(self, team_name: str) -> str:
+        """Reason a team_name value names unknown teams ("" if all exist)"""
+        error = self.team_errors.get(team_name)
+        if error is not None:
+            return error
+        if not self.directory_checked:
+            self.directory_checked = True
+            try:
+                self.directory = get_team_directory(self.base_url, self.master_key, self.debug).ensure_loaded()
+            except Exception as e:
+                # チーム一覧が取得できない場合はチームの検証を省略し、従来どおり API 側で判定する
+                print(f"WARNING: Could not load the team list, team names are not pre-validated: {e}", file=sys.stderr)
+        if self.directory is None:
+            return ""
+        # 比較側（UserComparator）と同じ解決方法を使い、スペースを含むチーム名も1つの名前として扱う
+        if self.split_teams:
+            _, unknown = self.directory.ids_for_team_field(team_name)
+        else:
+            _, unknown = self.directory.ids_for_names([team_name])
+        error = f"Team '{unknown[0]}' not found" if unknown else ""
+        self.team_errors[team_name] = error
+        return error
+
+    def row_error(self, user: Dict) -> str:
+        """Reason a row is invalid ("" if it can be sent to the API)"""
+        error = email_error(user['email'])
+        if error:
+            return error
+        if user['role'] not in INTERNAL_ROLES:
+            return f"Unknown role '{user['role']}'"
+        if user.get('team_name'):
+            return self.team_error(user['team_name'])
+        return ""
+
+    def validate(self, users: Iterable[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Split rows into (valid, rejected), both in CSV order; rejected rows carry an "error" reason"""
+        valid: List[Dict] = []
+        rejected: List[Dict] = []
+        seen = set()
+        for user in users:
+            error = self.row_error(user)
+            if not error:
+                email = normalize_email(user['email'])
+                if email not in seen:
+                    seen.add(email)
+                    valid.append(user)
+                    continue
+                error = DUPLICATE_EMAIL
+            rejected.append(dict(user, error=error))
+        return valid, rejected
+
+def print_rejected(rejected: List[Dict]):
+    for user in rejected:
+        print(f"✗ Rejected user {user['email']}: {user['error']}", file=sys.stderr)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from csv_validation import DUPLICATE_EMAIL, RowValidator
+from team_directory import get_team_directory
+
+# API を呼ばないダミーの接続先（チーム一覧は事前にロード済みのディレクトリから引く）
+BASE_URL = "http://csv-validation-test.invalid"
+MASTER_KEY = "sk-test"
+TEAMS = [{"team_id": "T1", "team_alias": "Data Science"}, {"team_id": "T2", "team_alias": "Ops"}]
+
+def validator(split_teams=True):
+    get_team_directory(BASE_URL, MASTER_KEY).load(teams=TEAMS)
+    return RowValidator(BASE_URL, MASTER_KEY, split_teams=split_teams)
+
+def user(email, team_name="", role="internal_user"):
+    row = {"email": email, "role": role}
+    if team_name:
+        row["team_name"] = team_name
+    return row
+
+def test_multi_word_team_names_are_valid():
+    rows = [user("a@example.com", "Data Science"), user("b@example.com", "Data Science Ops")]
+    valid, rejected = validator().validate(rows)
+    assert valid == rows
+    assert rejected == []
+
+def test_multi_word_team_name_is_one_team_for_add_user():
+    valid, rejected = validator(split_teams=False).validate([user("a@example.com", "Data Science")])
+    assert len(valid) == 1 and rejected == []
+
+def test_unknown_team_is_rejected_with_its_name():
+    _, rejected = validator().validate([user("a@example.com", "Data Science Nope")])
+    assert [r["error"] for r in rejected] == ["Team 'Nope' not found"]
+
+def test_invalid_rows_and_duplicates_are_rejected_in_csv_order():
+    rows = [user("a@example.com"), user("nope"), user("A@example.com"), user("c@example.com", role="admin")]
+    valid, rejected = validator().validate(rows)
+    assert valid == rows[:1]
+    assert [(r["email"], r["error"]) for r in rejected] == [
+        ("nope", "Invalid email address 'nope'"),
+        ("A@example.com", DUPLICATE_EMAIL),
+        ("c@example.com", "Unknown role 'admin'"),
+    ]
@@ -8,79 +8,74 @@ import requests
 import csv
 from typing import List, Dict
 from dotenv import load_dotenv
+from atomic_file import atomic_write
+from litellm_client import get_client
+from inventory_snapshot import forget_deleted_users, get_inventory_snapshot
+from csv_ingest import read_csv_rows
 
 # Load environment variables from .env file
 load_dotenv()
 
 SENSITIVE_KEYS = {"password", "hashed_password", "salt", "token"}  # 念のため除外
 
-def get_user_id_by_email(base_url: str, master_key: str, user_email: str, debug: bool = False) -> str:
-    """Get user ID by email address"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+def normalize_email(email: str) -> str:
+    """Normalize an email address for lookups"""
+    return email.strip().lower()
+
+def fetch_user_id_index(base_url: str, master_key: str, debug: bool = False, use_snapshot: bool = False) -> Dict[str, str]:
+    """Fetch the user list once (or read the inventory snapshot) and map normalized email to user ID"""
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/list"
+    url = client.url("/user/list")
     
     if debug:
-        print(f"DEBUG: Getting user list to find user ID for {user_email}", file=sys.stderr)
+        print(f"DEBUG: Getting user list to resolve user IDs - URL: {url}", file=sys.stderr)
     
-    try:
-        r = requests.get(url, headers=headers, timeout=30)
-        
-        if debug:
-            print(f"DEBUG: User list response status: {r.status_code}", file=sys.stderr)
-        
-        r.raise_for_status()
-        data = r.json()
-        
-        # Get users from response
-        users = data.get("users") or data.get("data") or (data if isinstance(data, list) else [])
-        
-        # Find user by email
-        for user in users:
-            if user.get("user_email") == user_email:
-                user_id = user.get("user_id", "")
-                if debug:
-                    print(f"DEBUG: Found user ID '{user_id}' for email '{user_email}'", file=sys.stderr)
-                return user_id
-        
-        if debug:
-            print(f"DEBUG: User '{user_email}' not found in user list", file=sys.stderr)
-        return ""
-        
-    except Exception as e:
-        if debug:
-            print(f"DEBUG: Error getting user list: {e}", file=sys.stderr)
-        return ""
+    # Get users from response (all pages)
+    if use_snapshot:
+        # 削除対象を決めるため、差分更新ではなく全件取得し直したスナップショットを使う
+        users = get_inventory_snapshot(base_url, master_key, debug, full=True).users
+    else:
+        users = client.fetch_all_users(debug=debug, compact=True)
+    
+    user_ids = {}
+    for user in users:
+        if user.get("user_email") and user.get("user_id"):
+            user_ids.setdefault(normalize_email(user["user_email"]), user["user_id"])
+    
+    if debug:
+        print(f"DEBUG: Indexed {len(user_ids)} users by email", file=sys.stderr)
+    
+    return user_ids
 
-def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = False) -> bool:
-    """Delete a single user via LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+def delete_users(base_url: str, master_key: str, user_ids: List[str], debug: bool = False) -> Dict:
+    """Delete a batch of users via LiteLLM API (raises requests.HTTPError on failure)"""
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/delete"
+    url = client.url("/user/delete")
     payload = {
-        "user_ids": [user_id],
+        "user_ids": list(user_ids),
     }
     
     if debug:
-        print(f"DEBUG: Deleting user - URL: {url}", file=sys.stderr)
-        print(f"DEBUG: Headers: {headers}", file=sys.stderr)
+        print(f"DEBUG: Deleting {len(user_ids)} users - URL: {url}", file=sys.stderr)
+        print(f"DEBUG: Headers: {client.headers}", file=sys.stderr)
         print(f"DEBUG: Payload: {payload}", file=sys.stderr)
     
+    r = client.post(url, json=payload)
+    
+    if debug:
+        print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
+        print(f"DEBUG: Response headers: {dict(r.headers)}", file=sys.stderr)
+        print(f"DEBUG: Response text: {r.text[:500]}...", file=sys.stderr)
+    
+    r.raise_for_status()
+    return r.json() if r.content else {}
+
+def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = False) -> bool:
+    """Delete a single user via LiteLLM API"""
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if debug:
-            print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
-            print(f"DEBUG: Response headers: {dict(r.headers)}", file=sys.stderr)
-            print(f"DEBUG: Response text: {r.text[:500]}...", file=sys.stderr)
-        
-        r.raise_for_status()
+        delete_users(base_url, master_key, [user_id], debug)
         return True
         
     except Exception as e:
@@ -88,16 +83,33 @@ def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = Fals
             print(f"DEBUG: Error deleting user: {e}", file=sys.stderr)
         return False
 
+def classify_delete_error(e: Exception) -> str:
+    """Turn a deletion exception into the error_reason written to the error CSV"""
+    if not isinstance(e, requests.HTTPError):
+        return f"Unexpected error: {str(e)}"
+    
+    if e.response is not None:
+        response_text = e.response.text
+        # Detailed error classification
+        if "not found" in response_text.lower():
+            return "User not found (API response)"
+        elif e.response.status_code == 400:
+            return "Bad request - invalid user ID format"
+        elif e.response.status_code == 401:
+            return "Unauthorized - invalid master key"
+        elif e.response.status_code == 403:
+            return "Forbidden - insufficient permissions"
+        elif e.response.status_code == 404:
+            return "User not found"
+        else:
+            return f"HTTP {e.response.status_code} error: {response_text[:100]}"
+    return "HTTP unknown error without response details"
+
 def read_csv_emails(csv_file: str) -> List[str]:
     """Read email addresses from CSV file"""
-    emails = []
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                email = row.get('email', '').strip()
-                if email:
-                    emails.append(email)
+        # 大きなファイルは複数プロセスで分割して解析する（結果の順序はCSVと同じ）
+        emails = read_csv_rows(csv_file)
     except FileNotFoundError:
         print(f"ERROR: CSV file '{csv_file}' not found.", file=sys.stderr)
         sys.exit(1)
@@ -113,7 +125,7 @@ def write_error_csv(failed_deletions: List[Dict], filename: str = "user_del_erro
         return
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
+        with atomic_write(filename, newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['email', 'user_id', 'error_reason'])
             for failed in failed_deletions:
@@ -128,7 +140,7 @@ def write_success_csv(deleted_users: List[Dict], filename: str = "user_del_resul
         return
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
+        with atomic_write(filename, newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['email', 'user_id', 'status'])
             for user in deleted_users:
@@ -150,6 +162,8 @@ CSV File Format (user_dellist.csv):
 Example usage:
   python del_user.py --csv-file user_dellist.csv --dry-run
   python del_user.py --debug
+  python del_user.py --batch-size 50
+  python del_user.py --snapshot
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -173,6 +187,17 @@ Example usage:
         action="store_true",
         help="Show what would be deleted without actually deleting users",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of user IDs sent per /user/delete request (default: 100)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Read users from the on-disk inventory snapshot, refreshed incrementally (see LITELLM_CACHE_DIR)",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -198,13 +223,24 @@ Example usage:
             print(f"  Email: {email}")
         return
 
+    # Resolve all emails against a single user list fetch
+    try:
+        user_id_index = fetch_user_id_index(args.base_url, args.master_key, args.debug, args.snapshot)
+    except requests.HTTPError as e:
+        print(f"HTTPError: {e} - {getattr(e.response, 'text', '')}", file=sys.stderr)
+        sys.exit(2)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
     # Delete users
     deleted_users = []
     failed_deletions = []
+    targets = []
+    scheduled_ids = set()
     
     for email in emails:
-        # Get user ID by email
-        user_id = get_user_id_by_email(args.base_url, args.master_key, email, args.debug)
+        user_id = user_id_index.get(normalize_email(email), "")
         
         if not user_id:
             error_reason = "User not found in the system"
@@ -212,48 +248,60 @@ Example usage:
             failed_deletions.append({"email": email, "error": error_reason})
             continue
         
-        try:
-            if args.debug:
-                print(f"\nDEBUG: Deleting user: {email} (ID: {user_id})", file=sys.stderr)
-            
-            success = delete_user(args.base_url, args.master_key, user_id, args.debug)
-            
-            if success:
-                deleted_users.append({"email": email, "user_id": user_id})
-                print(f"✓ Deleted user: {email} (ID: {user_id})")
-            else:
-                error_reason = "Failed to delete user (API error)"
-                print(f"✗ Failed to delete user {email}: {error_reason}", file=sys.stderr)
-                failed_deletions.append({"email": email, "user_id": user_id, "error": error_reason})
-            
-        except requests.HTTPError as e:
-            error_msg = f"HTTPError: {e}"
-            if hasattr(e, 'response') and e.response:
-                response_text = e.response.text
-                error_msg += f" - {response_text}"
-                # Detailed error classification
-                if "not found" in response_text.lower():
-                    error_reason = "User not found (API response)"
-                elif e.response.status_code == 400:
-                    error_reason = f"Bad request - invalid user ID format"
-                elif e.response.status_code == 401:
-                    error_reason = "Unauthorized - invalid master key"
-                elif e.response.status_code == 403:
-                    error_reason = "Forbidden - insufficient permissions"
-                elif e.response.status_code == 404:
-                    error_reason = "User not found"
-                else:
-                    error_reason = f"HTTP {e.response.status_code} error: {response_text[:100]}"
-            else:
-                error_reason = f"HTTP {e.response.status_code if hasattr(e, 'response') else 'unknown'} error without response details"
-            
-            print(f"✗ Failed to delete user {email}: {error_msg}", file=sys.stderr)
+        if user_id in scheduled_ids:
+            error_reason = "Duplicate entry in CSV"
+            print(f"✗ Skipped user {email}: {error_reason}", file=sys.stderr)
             failed_deletions.append({"email": email, "user_id": user_id, "error": error_reason})
-            
+            continue
+        
+        scheduled_ids.add(user_id)
+        targets.append({"email": email, "user_id": user_id})
+    
+    def record_success(target: Dict):
+        deleted_users.append(target)
+        print(f"✓ Deleted user: {target['email']} (ID: {target['user_id']})")
+    
+    def record_failure(target: Dict, e: Exception):
+        error_reason = classify_delete_error(e)
+        if isinstance(e, requests.HTTPError):
+            error_msg = f"HTTPError: {e}"
+            if e.response is not None:
+                error_msg += f" - {e.response.text}"
+        else:
+            error_msg = error_reason
+        print(f"✗ Failed to delete user {target['email']}: {error_msg}", file=sys.stderr)
+        failed_deletions.append({"email": target['email'], "user_id": target['user_id'], "error": error_reason})
+    
+    batch_size = max(1, args.batch_size)
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        
+        if args.debug:
+            print(f"\nDEBUG: Deleting batch of {len(batch)} users: {[t['email'] for t in batch]}", file=sys.stderr)
+        
+        try:
+            delete_users(args.base_url, args.master_key, [t['user_id'] for t in batch], args.debug)
         except Exception as e:
-            error_reason = f"Unexpected error: {str(e)}"
-            print(f"✗ Failed to delete user {email}: {error_reason}", file=sys.stderr)
-            failed_deletions.append({"email": email, "user_id": user_id, "error": error_reason})
+            if len(batch) == 1:
+                record_failure(batch[0], e)
+                continue
+            
+            # Fall back to one request per user so each failure is reported exactly
+            if args.debug:
+                print(f"DEBUG: Batch delete failed ({e}), falling back to per-user deletes", file=sys.stderr)
+            for target in batch:
+                try:
+                    delete_users(args.base_url, args.master_key, [target['user_id']], args.debug)
+                    record_success(target)
+                except Exception as e:
+                    record_failure(target, e)
+        else:
+            for target in batch:
+                record_success(target)
+
+    # 削除したユーザーをスナップショットからも除き、次回も差分更新で済むようにする
+    if args.snapshot and deleted_users:
+        forget_deleted_users(args.base_url, args.master_key, [u['user_id'] for u in deleted_users], args.debug)
 
     # Summary
     print(f"\nSummary:")
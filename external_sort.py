@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import heapq
+import shutil
+import tempfile
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from inventory_snapshot import DEFAULT_CACHE_DIR
+
+DEFAULT_SORT_RUN_SIZE = int(os.getenv("LITELLM_SORT_RUN_SIZE", "200000"))  # 1つのソート済みランに含める行数
+
+def dump_line(item: Any) -> str:
+    return json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def read_run(path: str) -> Iterator[List]:
+    """Yield the rows of a run file in order"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+class SpillList:
+    """Append-only list kept in a JSON-lines file, supporting len() and iteration
+
+    Used for result lists too large to keep in memory (e.g. the unchanged users
+    of a multi-million-row sync), which are only counted and written out later.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self._count = 0
+
+    def append(self, item: Any):
+        self._file.write(dump_line(item))
+        self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Any]:
+        self._file.flush()
+        return read_run(self.path)
+
+    def close(self):
+        self._file.close()
+
+class ExternalSorter:
+    """Sort rows larger than memory by spilling sorted runs to disk and merging them
+
+    Rows are lists whose leading elements are the sort key; add() buffers up to
+    run_size rows, sorts them and writes them to a run file, and merged()
+    streams all runs back in one ordered sequence (heapq.merge), so at most
+    run_size rows are in memory at a time. Run files live in a private
+    temporary directory removed by close().
+    """
+
+    def __init__(self, run_size: int = DEFAULT_SORT_RUN_SIZE, cache_dir: str = DEFAULT_CACHE_DIR, prefix: str = "sort-"):
+        self.run_size = max(1, run_size)
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # メールアドレスなどを含むため所有者のみアクセス可能なディレクトリに置く
+        self.directory = tempfile.mkdtemp(prefix=prefix, dir=cache_dir)
+        self.runs: List[str] = []
+        self.count = 0
+        self._buffer: List[List] = []
+        self._spills: List[SpillList] = []
+
+    def add(self, row: List):
+        self._buffer.append(row)
+        self.count += 1
+        if len(self._buffer) >= self.run_size:
+            self._spill()
+
+    def extend(self, rows: Iterable[List]) -> "ExternalSorter":
+        for row in rows:
+            self.add(row)
+        return self
+
+    def _spill(self):
+        if not self._buffer:
+            return
+        self._buffer.sort()
+        path = os.path.join(self.directory, f"run-{len(self.runs):05d}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(dump_line(row) for row in self._buffer)
+        self.runs.append(path)
+        self._buffer = []
+
+    def merged(self) -> Iterator[List]:
+        """All rows added so far in sorted order"""
+        if not self.runs:
+            # 1ラン分に収まる場合はディスクに書かずにそのまま返す
+            self._buffer.sort()
+            return iter(self._buffer)
+        self._spill()
+        return heapq.merge(*(read_run(path) for path in self.runs))
+
+    def spill_list(self, name: str) -> SpillList:
+        """A SpillList stored (and removed) with this sorter's run files"""
+        spill = SpillList(os.path.join(self.directory, name))
+        self._spills.append(spill)
+        return spill
+
+    def close(self):
+        self._buffer = []
+        for spill in self._spills:
+            spill.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def keep_last(previous: List, row: List) -> List:
+    return row
+
+def collapse_keys(rows: Iterable[List], key: Callable[[List], Any], combine: Callable[[List, List], List] = keep_last) -> Iterator[Tuple[Any, List]]:
+    """Collapse consecutive rows with the same key into one with combine(previous, row) (input must be sorted by key)"""
+    current_key = None
+    current: Optional[List] = None
+    for row in rows:
+        k = key(row)
+        if current is not None and k == current_key:
+            current = combine(current, row)
+            continue
+        if current is not None:
+            yield current_key, current
+        current_key, current = k, row
+    if current is not None:
+        yield current_key, current
+
+def merge_join(left: Iterable[List], right: Iterable[List], key: Callable[[List], Any], combine: Callable[[List, List], List] = keep_last) -> Iterator[Tuple[Optional[List], Optional[List]]]:
+    """Full outer join of two streams sorted by key, yielding (left, right) pairs
+
+    A side is None when the key exists on the other side only. Duplicate keys
+    within one side are collapsed with combine(previous, row), which by
+    default keeps the later row.
+    """
+    lefts = collapse_keys(left, key, combine)
+    rights = collapse_keys(right, key, combine)
+    l = next(lefts, None)
+    r = next(rights, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield l[1], None
+            l = next(lefts, None)
+        elif l is None or r[0] < l[0]:
+            yield None, r[1]
+            r = next(rights, None)
+        else:
+            yield l[1], r[1]
+            l = next(lefts, None)
+            r = next(rights, None)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+from csv_validation import RowValidator
+from external_sort import ExternalSorter, merge_join
+from sync_user import compare_users, compare_users_external
+from team_directory import get_team_directory
+
+# API を呼ばないダミーの接続先（チーム一覧は事前にロード済みのディレクトリから引く）
+BASE_URL = "http://external-sort-test.invalid"
+MASTER_KEY = "sk-test"
+TEAMS = [{"team_id": "T1", "team_alias": "team1"}, {"team_id": "T2", "team_alias": "team2"}]
+
+CSV_USERS = [
+    {"email": "b@example.com", "role": "internal_user", "team_name": "team1"},
+    {"email": "a@example.com", "role": "proxy_admin"},
+    {"email": "new@example.com", "role": "internal_user", "team_name": "team2"},
+    # 同じメールの2行目（最初の位置に最後の行の内容を使う）と、大文字小文字だけが異なるメール
+    {"email": "b@example.com", "role": "internal_user_viewer", "team_name": "team2"},
+    {"email": "C@example.com", "role": "internal_user"},
+    {"email": "not-an-email", "role": "internal_user"},
+]
+API_USERS = [
+    {"user_id": "default_user_id", "user_email": None, "user_role": "proxy_admin", "teams": []},
+    {"user_id": "u-a", "user_email": "a@example.com", "user_role": "internal_user", "teams": []},
+    {"user_id": "u-b", "user_email": "b@example.com", "user_role": "internal_user", "teams": ["T1"]},
+    {"user_id": "u-c", "user_email": "c@example.com", "user_role": "internal_user", "teams": []},
+    {"user_id": "u-gone", "user_email": "gone@example.com", "user_role": "internal_user", "teams": ["T2"]},
+    {"user_id": "u-customer", "user_email": "customer@example.com", "user_role": "customer", "teams": []},
+]
+
+def as_json(value):
+    # SpillList を経由した値（タプル→リストなど）と比較できるよう JSON に揃える
+    return json.dumps(value, sort_keys=True)
+
+def test_sorter_spills_runs_and_merges_them_in_order(tmp_path):
+    rows = [[k % 7, k] for k in range(20)]
+    sorter = ExternalSorter(run_size=3, cache_dir=str(tmp_path)).extend(rows)
+    assert len(sorter.runs) == 6
+    assert list(sorter.merged()) == sorted(rows)
+    sorter.close()
+    assert not os.path.exists(sorter.directory)
+
+def test_merge_join_collapses_duplicate_keys():
+    left = [["a", 1], ["a", 2], ["c", 3]]
+    right = [["b", 4], ["c", 5], ["c", 6]]
+    assert list(merge_join(left, right, key=lambda row: row[0])) == [
+        (["a", 2], None), (None, ["b", 4]), (["c", 3], ["c", 6])]
+
+def external_diff(tmp_path, validate: bool):
+    sorters = []
+
+    def new_sorter(prefix):
+        # ラン長 1 で、全行をディスクに書き出してからマージする
+        sorter = ExternalSorter(run_size=1, cache_dir=str(tmp_path), prefix=prefix)
+        sorters.append(sorter)
+        return sorter
+
+    rejected = []
+    validator = RowValidator(BASE_URL, MASTER_KEY) if validate else None
+    try:
+        to_add, to_delete, to_update, unchanged, csv_count, api_count = compare_users_external(
+            iter(CSV_USERS), iter(API_USERS), BASE_URL, MASTER_KEY, new_sorter, validator=validator, rejected=rejected)
+        assert all(len(sorter.runs) > 1 for sorter in sorters)
+        assert (csv_count, api_count) == (len(CSV_USERS), len(API_USERS))
+        return to_add, to_delete, to_update, list(unchanged), rejected
+    finally:
+        for sorter in sorters:
+            sorter.close()
+
+def test_external_diff_matches_compare_users(tmp_path):
+    get_team_directory(BASE_URL, MASTER_KEY).load(teams=TEAMS)
+    expected = compare_users(CSV_USERS, API_USERS, BASE_URL, MASTER_KEY)
+    to_add, to_delete, to_update, unchanged, rejected = external_diff(tmp_path, validate=False)
+    assert as_json([to_add, to_delete, to_update]) == as_json(list(expected[:3]))
+    assert sorted(map(as_json, unchanged)) == sorted(map(as_json, expected[3]))
+    assert rejected == []
+
+def test_external_diff_with_validator_matches_validated_compare_users(tmp_path):
+    get_team_directory(BASE_URL, MASTER_KEY).load(teams=TEAMS)
+    valid, expected_rejected = RowValidator(BASE_URL, MASTER_KEY).validate(CSV_USERS)
+    expected = compare_users(valid, API_USERS, BASE_URL, MASTER_KEY)
+    to_add, to_delete, to_update, unchanged, rejected = external_diff(tmp_path, validate=True)
+    assert as_json([to_add, to_delete, to_update]) == as_json(list(expected[:3]))
+    assert sorted(map(as_json, unchanged)) == sorted(map(as_json, expected[3]))
+    assert as_json(rejected) == as_json(expected_rejected)
+    assert [r["email"] for r in rejected] == ["b@example.com", "not-an-email"]
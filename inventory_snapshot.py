@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional
+from atomic_file import atomic_write
+from user_record import parse_timestamp
+from litellm_client import DEFAULT_PAGE_SIZE, LiteLLMClient, clamp_page_size, count_pages, extract_users, get_client
+from team_directory import get_team_directory
+
+DEFAULT_CACHE_DIR = os.getenv("LITELLM_CACHE_DIR", ".litellm_cache")
+DEFAULT_MAX_AGE = float(os.getenv("LITELLM_SNAPSHOT_MAX_AGE", "86400"))  # 秒。これより古いスナップショットは全件取得し直す
+SNAPSHOT_VERSION = 1
+
+SENSITIVE_KEYS = {"password", "hashed_password", "salt", "token"}  # キャッシュには保存しない
+
+def snapshot_path(base_url: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Cache file for a proxy (one file per base URL)"""
+    digest = hashlib.sha256(base_url.rstrip('/').encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"inventory-{digest}.json")
+
+class InventorySnapshot:
+    """On-disk copy of /user/list and /team/list for one proxy
+
+    refresh() pulls only the users whose updated_at is at or after the stored
+    high-water mark (GET /user/list sorted by updated_at, newest first) and
+    falls back to a full download when the proxy does not honor the sort, the
+    user count no longer matches (users were deleted elsewhere), or the last
+    full download is older than max_age.
+
+    The count only catches a net change: a user deleted elsewhere goes
+    unnoticed when another one appears that the updated_at scan misses (clock
+    skew, imported timestamps). Commands that decide what to create or delete
+    from the snapshot therefore ask for refresh(full=True).
+    """
+
+    def __init__(self, client: LiteLLMClient, cache_dir: str = DEFAULT_CACHE_DIR, max_age: float = DEFAULT_MAX_AGE, debug: bool = False):
+        self.client = client
+        self.debug = debug
+        self.max_age = max_age
+        self.path = snapshot_path(client.base_url, cache_dir)
+        self.by_id: Dict[str, Dict] = {}
+        self.teams: List[Dict] = []
+        self.high_water: Optional[float] = None
+        self.full_refreshed_at = 0.0
+        self.refreshed_at = 0.0
+        self.verified = False  # この実行中に全件取得したか
+
+    @property
+    def users(self) -> List[Dict]:
+        return list(self.by_id.values())
+
+    def load(self) -> bool:
+        """Read the snapshot file, returns False if there is no usable snapshot"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Ignoring unreadable inventory snapshot '{self.path}': {e}", file=sys.stderr)
+            return False
+
+        if data.get("version") != SNAPSHOT_VERSION or data.get("base_url") != self.client.base_url:
+            return False
+        self.by_id = {u["user_id"]: u for u in data.get("users", []) if u.get("user_id")}
+        self.teams = data.get("teams", [])
+        self.high_water = data.get("high_water")
+        self.full_refreshed_at = data.get("full_refreshed_at", 0.0)
+        self.refreshed_at = data.get("refreshed_at", 0.0)
+        if self.debug:
+            print(f"DEBUG: Loaded inventory snapshot '{self.path}' ({len(self.by_id)} users)", file=sys.stderr)
+        return True
+
+    def save(self):
+        """Write the snapshot atomically (readers never see a partial file)"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "base_url": self.client.base_url,
+            "full_refreshed_at": self.full_refreshed_at,
+            "refreshed_at": self.refreshed_at,
+            "high_water": self.high_water,
+            "teams": self.teams,
+            "users": self.users,
+        }
+        with atomic_write(self.path, mode=0o600) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    def put_users(self, users: Iterable[Dict]):
+        """Insert or replace users and advance the high-water mark"""
+        for user in users:
+            if not user.get("user_id"):
+                continue
+            self.by_id[user["user_id"]] = {k: v for k, v in user.items() if k not in SENSITIVE_KEYS}
+            ts = parse_timestamp(user.get("updated_at"))
+            if ts is not None and (self.high_water is None or ts > self.high_water):
+                self.high_water = ts
+
+    def remove_users(self, user_ids: Iterable[str]):
+        """Drop users deleted by this process so the next refresh stays incremental"""
+        for user_id in user_ids:
+            self.by_id.pop(user_id, None)
+
+    def refresh_teams(self):
+        r = self.client.get("/team/list")
+        r.raise_for_status()
+        data = r.json()
+        self.teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
+
+    def full_refresh(self, page_size: int = DEFAULT_PAGE_SIZE):
+        """Download every user (remaining pages in parallel)"""
+        if self.debug:
+            print(f"DEBUG: Full inventory refresh from {self.client.url('/user/list')}", file=sys.stderr)
+        users = self.client.fetch_all_users(page_size, debug=self.debug)
+        self.by_id = {}
+        self.high_water = None
+        self.put_users(users)
+        self.full_refreshed_at = time.time()
+        self.verified = True
+
+    def incremental_refresh(self, page_size: int = DEFAULT_PAGE_SIZE) -> bool:
+        """Pull users changed since the high-water mark, False if a full refresh is needed"""
+        if self.high_water is None:
+            return False
+
+        page_size = clamp_page_size(page_size)
+        changed: List[Dict] = []
+        total = None
+        page = 1
+        while True:
+            r = self.client.get("/user/list", params={"page": page, "page_size": page_size,
+                                                      "sort_by": "updated_at", "sort_order": "desc"})
+            r.raise_for_status()
+            data = r.json()
+            users = extract_users(data)
+            if page == 1:
+                total = data.get("total") if isinstance(data, dict) else None
+                if total is None:
+                    # 総件数が分からないと削除を検知できない
+                    return False
+
+            timestamps = [parse_timestamp(u.get("updated_at")) for u in users]
+            known = [ts for ts in timestamps if ts is not None]
+            if any(a < b for a, b in zip(known, known[1:])):
+                if self.debug:
+                    print("DEBUG: /user/list ignored sort_by=updated_at, falling back to a full refresh", file=sys.stderr)
+                return False
+
+            # 同じ時刻のレコードは取り込み済みか判断できないため、境界と同時刻のものは取り直す。
+            # updated_at を持たないユーザー（NULL は先頭に並ぶ）は毎回取り込む
+            reached = False
+            for user, ts in zip(users, timestamps):
+                if ts is not None and ts < self.high_water:
+                    reached = True
+                    break
+                changed.append(user)
+            if reached or not users or page >= count_pages(data, page_size):
+                break
+            page += 1
+
+        self.put_users(changed)
+        if self.debug:
+            print(f"DEBUG: Incremental refresh pulled {len(changed)} changed users in {page} request(s)", file=sys.stderr)
+
+        if len(self.by_id) != int(total):
+            if self.debug:
+                print(f"DEBUG: Snapshot has {len(self.by_id)} users but proxy reports {total}, falling back to a full refresh", file=sys.stderr)
+            return False
+        return True
+
+    def refresh(self, page_size: int = DEFAULT_PAGE_SIZE, full: bool = False) -> "InventorySnapshot":
+        """Bring the snapshot up to date (incrementally when possible, always fully with `full`) and save it"""
+        loaded = self.load()
+        stale = time.time() - self.full_refreshed_at > self.max_age
+        if full or not loaded or stale or not self.incremental_refresh(page_size):
+            self.full_refresh(page_size)
+        self.refresh_teams()
+        self.refreshed_at = time.time()
+        self.save()
+        return self
+
+_snapshots: Dict[int, InventorySnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+def get_inventory_snapshot(base_url: str, master_key: str, debug: bool = False, page_size: int = DEFAULT_PAGE_SIZE,
+                           full: bool = False) -> InventorySnapshot:
+    """Return the refreshed snapshot for a proxy (refreshed once per run)
+
+    Pass `full` when users will be created or deleted based on the snapshot:
+    it is then downloaded in full instead of incrementally, so users deleted
+    elsewhere are never acted on. The team list stored with the snapshot
+    also primes the shared team directory, so the run does not call
+    /team/list again.
+    """
+    client = get_client(base_url, master_key)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(id(client))
+        if snapshot is None or (full and not snapshot.verified):
+            snapshot = InventorySnapshot(client, debug=debug).refresh(page_size, full)
+            get_team_directory(base_url, master_key, debug).load(teams=snapshot.teams)
+            _snapshots[id(client)] = snapshot
+    return snapshot
+
+def forget_deleted_users(base_url: str, master_key: str, user_ids: Iterable[str], debug: bool = False):
+    """Remove users deleted in this run from the snapshot and save it"""
+    try:
+        snapshot = get_inventory_snapshot(base_url, master_key, debug)
+        snapshot.remove_users(user_ids)
+        snapshot.save()
+    except Exception as e:
+        # 保存に失敗しても次回の更新時に件数不一致で全件取得し直すため、処理は継続
+        print(f"WARNING: Failed to update inventory snapshot: {e}", file=sys.stderr)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Optional
+from atomic_file import atomic_write
+from inventory_snapshot import DEFAULT_CACHE_DIR
+from litellm_client import LiteLLMClient, get_client
+
+DEFAULT_INVITATION_CACHE_TTL = float(os.getenv("LITELLM_INVITATION_CACHE_TTL", "604800"))  # 秒。これを過ぎたら再探索
+CACHE_VERSION = 1
+
+# 招待IDを発行できる可能性のあるエンドポイント（LiteLLM のバージョンにより異なる）
+CANDIDATE_ENDPOINTS = [
+    "/user/invite",
+    "/invite",
+    "/user/invitation",
+    "/user/{user_id}/invite",
+    "/user/generate_invite",
+    "/generate_invite",
+]
+ABSENT_STATUSES = {404, 405}  # エンドポイントが存在しないと判断するステータス
+
+def cache_path(base_url: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Cache file for a proxy (one file per base URL)"""
+    digest = hashlib.sha256(base_url.rstrip('/').encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"invitation-{digest}.json")
+
+def extract_invitation_id(response_data) -> str:
+    """Pick the invitation ID out of the different response formats"""
+    if not isinstance(response_data, dict):
+        return ""
+    return (
+        response_data.get('invitation_id') or
+        response_data.get('invite_id') or
+        response_data.get('id') or
+        response_data.get('token') or
+        response_data.get('invitation_token') or
+        ""
+    )
+
+class InvitationEndpoint:
+    """Which invitation endpoint a proxy supports, discovered once and cached on disk
+
+    The first user of a run probes the candidate endpoints in order; the working
+    one (or the fact that none exists) is stored per base URL, so later users and
+    later runs POST to that endpoint directly. A cached endpoint that starts
+    answering 404 is forgotten and discovery runs again.
+    """
+
+    def __init__(self, client: LiteLLMClient, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_INVITATION_CACHE_TTL, debug: bool = False):
+        self.client = client
+        self.debug = debug
+        self.ttl = ttl
+        self.path = cache_path(client.base_url, cache_dir)
+        self.lock = threading.Lock()
+        self.known = False
+        self.endpoint: Optional[str] = None  # None = エンドポイントなし
+        self.discovered_at = 0.0
+
+    def load(self) -> bool:
+        """Read the cache file, returns False if there is no usable entry"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Ignoring unreadable invitation endpoint cache '{self.path}': {e}", file=sys.stderr)
+            return False
+
+        if data.get("version") != CACHE_VERSION or data.get("base_url") != self.client.base_url:
+            return False
+        discovered_at = data.get("discovered_at", 0.0)
+        if time.time() - discovered_at > self.ttl:
+            return False
+        self.endpoint = data.get("endpoint")
+        self.discovered_at = discovered_at
+        self.known = True
+        if self.debug:
+            print(f"DEBUG: Cached invitation endpoint for {self.client.base_url}: {self.endpoint or 'none'}", file=sys.stderr)
+        return True
+
+    def save(self):
+        """Write the cache atomically"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        data = {
+            "version": CACHE_VERSION,
+            "base_url": self.client.base_url,
+            "endpoint": self.endpoint,
+            "discovered_at": self.discovered_at,
+        }
+        with atomic_write(self.path, mode=0o600) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    def remember(self, endpoint: Optional[str]):
+        self.endpoint = endpoint
+        self.discovered_at = time.time()
+        self.known = True
+        try:
+            self.save()
+        except OSError as e:
+            # 保存できなくても今回の実行中はメモリ上の結果を使う
+            print(f"WARNING: Failed to save invitation endpoint cache: {e}", file=sys.stderr)
+
+    def post(self, endpoint: str, user_id: str):
+        """POST one invitation request, returns (status_code, invitation_id)"""
+        url = self.client.url(endpoint.format(user_id=user_id))
+        payload = {"user_id": user_id, "action": "reset_password"}
+        if self.debug:
+            print(f"DEBUG: Invitation request - URL: {url}", file=sys.stderr)
+            print(f"DEBUG: Invitation payload: {payload}", file=sys.stderr)
+        r = self.client.post(url, json=payload)
+        if self.debug:
+            print(f"DEBUG: Invitation response status: {r.status_code}", file=sys.stderr)
+            print(f"DEBUG: Invitation response: {r.text[:500]}...", file=sys.stderr)
+        if r.status_code != 200:
+            return r.status_code, ""
+        try:
+            return r.status_code, extract_invitation_id(r.json())
+        except ValueError:
+            return r.status_code, ""
+
+    def discover(self, user_id: str) -> str:
+        """Probe the candidate endpoints with a real request, returns the invitation ID if one worked"""
+        conclusive = True
+        for endpoint in CANDIDATE_ENDPOINTS:
+            try:
+                status, invitation_id = self.post(endpoint, user_id)
+            except Exception as e:
+                if self.debug:
+                    print(f"DEBUG: Error trying invitation endpoint {endpoint}: {e}", file=sys.stderr)
+                conclusive = False
+                continue
+            if invitation_id:
+                if self.debug:
+                    print(f"DEBUG: Discovered invitation endpoint {endpoint}", file=sys.stderr)
+                self.remember(endpoint)
+                return invitation_id
+            if status not in ABSENT_STATUSES and status != 200:
+                # 5xx や 401 などはエンドポイントの有無を判断できない
+                conclusive = False
+
+        if conclusive:
+            if self.debug:
+                print(f"DEBUG: No invitation endpoint on {self.client.base_url}, caching the result", file=sys.stderr)
+            self.remember(None)
+        else:
+            # 判定できなかった場合はディスクに保存せず、この実行中だけ探索を止める
+            self.endpoint = None
+            self.known = True
+        return ""
+
+    def generate(self, user_id: str) -> str:
+        """Generate an invitation ID for one user ("" if the proxy has no invitation endpoint)"""
+        with self.lock:
+            if not self.known:
+                self.load()
+            if not self.known:
+                # 最初のユーザーで探索する。他のスレッドは結果が出るまで待つ
+                return self.discover(user_id)
+            endpoint = self.endpoint
+
+        if endpoint is None:
+            return ""
+        try:
+            status, invitation_id = self.post(endpoint, user_id)
+        except Exception as e:
+            if self.debug:
+                print(f"DEBUG: Error calling invitation endpoint {endpoint}: {e}", file=sys.stderr)
+            return ""
+        if status in ABSENT_STATUSES:
+            with self.lock:
+                if self.endpoint == endpoint:
+                    if self.debug:
+                        print(f"DEBUG: Cached invitation endpoint {endpoint} returned {status}, rediscovering", file=sys.stderr)
+                    return self.discover(user_id)
+            return self.generate(user_id)
+        return invitation_id
+
+_endpoints: Dict[int, InvitationEndpoint] = {}
+_endpoints_lock = threading.Lock()
+
+def get_invitation_endpoint(base_url: str, master_key: str, debug: bool = False) -> InvitationEndpoint:
+    """Return the shared invitation endpoint cache for a proxy"""
+    client = get_client(base_url, master_key)
+    with _endpoints_lock:
+        endpoint = _endpoints.get(id(client))
+        if endpoint is None:
+            endpoint = InvitationEndpoint(client, debug=debug)
+            _endpoints[id(client)] = endpoint
+    return endpoint
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import codecs
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+WHITESPACE = " \t\n\r"
+NUMBER_TAIL = frozenset("0123456789+-.eE")  # 数値の続きになり得る文字
+
+class JsonArrayStream:
+    """Decode the user array of a JSON response incrementally from byte chunks
+
+    Accepts either a bare array or an object whose "users" / "data" member is
+    the array. Iterating yields the array elements one by one as soon as each
+    one is complete (optionally passed through `project`), so neither the raw
+    body nor the whole parsed tree is ever held in memory. The other members of
+    the object (total, total_pages, next ...) are collected in `meta`, which is
+    complete once iteration has finished.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], array_keys: Tuple[str, ...] = ("users", "data"), project: Optional[Callable[[Dict], Any]] = None):
+        self.chunks = iter(chunks)
+        self.array_keys = array_keys
+        self.project = project
+        self.meta: Dict[str, Any] = {}
+        self.count = 0
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer, False at end of input"""
+        while not self._eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self._eof = True
+                text = self._utf8.decode(b"", final=True)
+            else:
+                text = self._utf8.decode(chunk)
+            if text:
+                # 読み終えた部分は捨て、バッファが応答全体に育たないようにする
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ("" at end of input)"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expecting '{char}' at offset {self._pos} of the buffered response")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        """Decode one complete JSON value at the current position"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 数値などはチャンク境界で途切れていても解釈できてしまうため、続きがあれば読み直す。
+            # "1." や "6.02e" のように小数部・指数部の途中で途切れた数値も同様
+            if self._may_continue(value, end) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _may_continue(self, value: Any, end: int) -> bool:
+        """True if the value decoded up to `end` could be cut short by the end of the buffer"""
+        if end == len(self._buf):
+            return True
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return all(char in NUMBER_TAIL for char in self._buf[end:])
+
+    def _elements(self) -> Iterator[Any]:
+        """Yield the elements of the array at the current position"""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            value = self._value()
+            self.count += 1
+            yield self.project(value) if self.project else value
+            char = self._peek()
+            self._pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expecting ',' or ']' after array element {self.count}")
+
+    def __iter__(self) -> Iterator[Any]:
+        char = self._peek()
+        if char == "[":
+            yield from self._elements()
+            return
+        if char != "{":
+            # 配列もオブジェクトでもない応答（エラー文字列など）はそのまま meta に残す
+            self.meta = {"value": self._value()}
+            return
+
+        self._pos += 1
+        streamed = False
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if not streamed and key in self.array_keys and self._peek() == "[":
+                before = self.count
+                yield from self._elements()
+                # 空配列だった場合は別のキー（users / data）の配列を使う
+                streamed = self.count > before
+            else:
+                self.meta[key] = self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Expecting ',' or '}}' after member '{key}'")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+from json_stream import JsonArrayStream
+
+def split_at(data: bytes, *offsets: int):
+    bounds = [0, *offsets, len(data)]
+    return [data[a:b] for a, b in zip(bounds, bounds[1:])]
+
+def decode(chunks):
+    stream = JsonArrayStream(chunks)
+    return list(stream), stream.meta
+
+def test_every_two_chunk_split_matches_json_loads():
+    data = json.dumps({"total": 2, "users": [{"user_email": "ユーザー@example.com", "spend": 1.5e-07},
+                                            {"user_email": "b@example.com", "spend": -12, "ok": True}],
+                       "next": None}, ensure_ascii=False).encode("utf-8")
+    expected = json.loads(data)
+    for offset in range(len(data) + 1):
+        users, meta = decode(split_at(data, offset))
+        assert users == expected["users"], offset
+        assert meta == {"total": 2, "next": None}, offset
+
+def test_one_byte_chunks_split_utf8_characters():
+    data = '["ユーザー😀", "é"]'.encode("utf-8")
+    assert decode([data[i:i + 1] for i in range(len(data))])[0] == ["ユーザー😀", "é"]
+
+def test_number_tails_cut_at_chunk_boundaries():
+    # 小数部・指数部の途中で途切れた数値を途中までの値として読まないこと
+    for text in ["1.5", "6.02e+23", "-0.25", "12345678901234567890", "1E-7"]:
+        data = f'{{"total":{text},"users":[{text}]}}'.encode("utf-8")
+        for offset in range(len(data) + 1):
+            users, meta = decode(split_at(data, offset))
+            assert users == [json.loads(text)], (text, offset)
+            assert meta == {"total": json.loads(text)}, (text, offset)
+
+def test_empty_users_falls_back_to_data_and_empty_chunks_are_ignored():
+    data = b'{"users": [], "data": [1, 2], "page": 1}'
+    users, meta = decode([b"", *split_at(data, 5, 20), b""])
+    assert users == [1, 2]
+    assert meta == {"page": 1}
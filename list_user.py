@@ -4,9 +4,13 @@
 import os
 import sys
 import argparse
+import csv
+import json
 import requests
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional, TextIO
 from dotenv import load_dotenv
+from litellm_client import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, get_client, page_size_arg
+from inventory_snapshot import get_inventory_snapshot
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,51 +27,59 @@ INTERNAL_ROLES = {
 
 SENSITIVE_KEYS = {"password", "hashed_password", "salt", "token"}  # 念のため除外
 
-def fetch_all_users(base_url: str, master_key: str, debug: bool = False) -> List[Dict]:
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    users: List[Dict] = []
-
-    # 典型的にはシンプルなGETで全件返りますが、
-    # 将来のページング拡張を考慮し next / page_token があれば辿る実装にしています。
-    url = f"{base_url.rstrip('/')}/user/list"
-    params = {}
-
-    if debug:
-        print(f"DEBUG: Requesting URL: {url}", file=sys.stderr)
-        print(f"DEBUG: Headers: {headers}", file=sys.stderr)
-
-    while True:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        
-        if debug:
-            print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
-            print(f"DEBUG: Response headers: {dict(r.headers)}", file=sys.stderr)
-            print(f"DEBUG: Response text: {r.text[:500]}...", file=sys.stderr)
-        
-        r.raise_for_status()
-        data = r.json()
-
-        if debug:
-            print(f"DEBUG: Parsed JSON data: {data}", file=sys.stderr)
-
-        # data が { "data": [...], "users": [...], "next": ... } の形式でも、単なる配列でも対応
-        chunk = data.get("data") or data.get("users") or (data if isinstance(data, list) else [])
-        users.extend(chunk)
-
-        next_token = data.get("next") or data.get("next_page_token")
-        if next_token:
-            params["page_token"] = next_token
-        else:
-            break
-
-    return users
-
 def sanitize_user(u: Dict) -> Dict:
     return {k: v for k, v in u.items() if k not in SENSITIVE_KEYS}
 
+def user_matches(u: Dict, show_all: bool = False, role: Optional[str] = None, email_like: Optional[str] = None) -> bool:
+    """Apply the list filters to a single user"""
+    user_role = str(u.get("user_role"))
+    # internal roles に限定（--show-allが指定されていない場合のみ）
+    if not show_all and user_role not in INTERNAL_ROLES:
+        return False
+    # 任意フィルタ
+    if role and user_role != role:
+        return False
+    if email_like and email_like.lower() not in str(u.get("user_email", "")).lower():
+        return False
+    return True
+
+def format_value(val) -> str:
+    # ネスト対策（軽くJSON化）
+    if isinstance(val, (dict, list)):
+        return json.dumps(val, ensure_ascii=False)
+    return str(val)
+
+class RowWriter:
+    """Write selected columns as TSV, CSV or NDJSON, one page at a time"""
+
+    def __init__(self, fmt: str, cols: List[str], out: TextIO):
+        self.fmt = fmt
+        self.cols = cols
+        self.out = out
+        self.csv_writer = csv.writer(out) if fmt == "csv" else None
+
+    def write_header(self):
+        # 見出し（NDJSONは各行がキーを持つため出力しない）
+        if self.fmt == "tsv":
+            self.out.write("\t".join(self.cols) + "\n")
+        elif self.fmt == "csv":
+            self.csv_writer.writerow(self.cols)
+        self.out.flush()
+
+    def write_row(self, u: Dict):
+        if self.fmt == "ndjson":
+            self.out.write(json.dumps({c: u.get(c, "") for c in self.cols}, ensure_ascii=False) + "\n")
+        elif self.fmt == "csv":
+            self.csv_writer.writerow([format_value(u.get(c, "")) for c in self.cols])
+        else:
+            self.out.write("\t".join(format_value(u.get(c, "")) for c in self.cols) + "\n")
+
+    def write_page(self, users: Iterable[Dict]):
+        """Write a page of rows and flush so they are visible immediately"""
+        for u in users:
+            self.write_row(u)
+        self.out.flush()
+
 def main():
     parser = argparse.ArgumentParser(
         description="List LiteLLM Internal Users via /user/list",
@@ -82,6 +94,8 @@ Available User Roles:
 Example usage:
   python list_user.py --role internal_user
   python list_user.py --show-all --email-like "@company.com"
+  python list_user.py --email-like "@company.com" --format ndjson
+  python list_user.py --snapshot --role proxy_admin
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -109,11 +123,28 @@ Example usage:
         default="user_id,user_email,user_role,teams,created_at,updated_at",
         help="Comma-separated fields to print (best-effort)",
     )
+    parser.add_argument(
+        "--format",
+        choices=("tsv", "csv", "ndjson"),
+        default="tsv",
+        help="Output format; rows are written page by page as they arrive (default: tsv)",
+    )
     parser.add_argument(
         "--show-all",
         action="store_true",
         help="Show all users regardless of role (not just internal roles)",
     )
+    parser.add_argument(
+        "--page-size",
+        type=page_size_arg,
+        default=DEFAULT_PAGE_SIZE,
+        help=f"Users requested per /user/list page, 1-{MAX_PAGE_SIZE}; remaining pages are fetched in parallel (default: {DEFAULT_PAGE_SIZE})",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Read users from the on-disk inventory snapshot, refreshed incrementally (see LITELLM_CACHE_DIR)",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -125,12 +156,35 @@ Example usage:
         print("ERROR: --master-key or env LITELLM_MASTER_KEY is required.", file=sys.stderr)
         sys.exit(1)
 
+    cols = [c.strip() for c in args.columns.split(",") if c.strip()]
+    writer = RowWriter(args.format, cols, sys.stdout)
+    fetched = 0
+
+    # ページ単位で 取得 → フィルタ → サニタイズ → 出力 を行い、全件をメモリに保持しない
     try:
-        all_users = fetch_all_users(args.base_url, args.master_key, args.debug)
+        client = get_client(args.base_url, args.master_key)
+        # 該当ユーザーが0件でも見出しだけは出力する
+        writer.write_header()
+        if args.snapshot:
+            # スナップショットを差分更新し、ローカルのデータをページ単位で出力
+            users = get_inventory_snapshot(args.base_url, args.master_key, args.debug, args.page_size).users
+            pages = (users[i:i + args.page_size] for i in range(0, len(users), args.page_size))
+        else:
+            if args.debug:
+                print(f"DEBUG: Requesting URL: {client.url('/user/list')} (page_size={args.page_size})", file=sys.stderr)
+            pages = client.iter_user_pages(args.page_size, debug=args.debug)
+        for page in pages:
+            if args.debug and fetched == 0:
+                for i, user in enumerate(page[:3]):  # Show first 3 users for debugging
+                    print(f"DEBUG: User {i+1}: {user}", file=sys.stderr)
+            fetched += len(page)
+            writer.write_page(sanitize_user(u) for u in page if user_matches(u, args.show_all, args.role, args.email_like))
         if args.debug:
-            print(f"DEBUG: Fetched {len(all_users)} users from API", file=sys.stderr)
-            for i, user in enumerate(all_users[:3]):  # Show first 3 users for debugging
-                print(f"DEBUG: User {i+1}: {user}", file=sys.stderr)
+            print(f"DEBUG: Fetched {fetched} users from API", file=sys.stderr)
+    except BrokenPipeError:
+        # 出力先（head など）が先に閉じられた場合は静かに終了
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
     except requests.HTTPError as e:
         print(f"HTTPError: {e} - {getattr(e.response, 'text', '')}", file=sys.stderr)
         sys.exit(2)
@@ -138,36 +192,5 @@ Example usage:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(2)
 
-    # internal roles に限定（--show-allが指定されていない場合のみ）
-    if args.show_all:
-        filtered_users = all_users
-    else:
-        filtered_users = [u for u in all_users if str(u.get("user_role")) in INTERNAL_ROLES]
-
-    # 任意フィルタ
-    if args.role:
-        filtered_users = [u for u in filtered_users if str(u.get("user_role")) == args.role]
-    if args.email_like:
-        q = args.email_like.lower()
-        filtered_users = [u for u in filtered_users if q in str(u.get("user_email", "")).lower()]
-
-    # センシティブ項目を除去
-    filtered_users = [sanitize_user(u) for u in filtered_users]
-
-    # 出力
-    cols = [c.strip() for c in args.columns.split(",") if c.strip()]
-    # 見出し
-    print("\t".join(cols))
-    for u in filtered_users:
-        row = []
-        for c in cols:
-            val = u.get(c, "")
-            # ネスト対策（軽くJSON化）
-            if isinstance(val, (dict, list)):
-                import json
-                val = json.dumps(val, ensure_ascii=False)
-            row.append(str(val))
-        print("\t".join(row))
-
 if __name__ == "__main__":
     main()
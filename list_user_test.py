@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+from list_user import RowWriter
+
+def written(fmt, pages):
+    out = io.StringIO()
+    writer = RowWriter(fmt, ["user_id", "user_email"], out)
+    writer.write_header()
+    for page in pages:
+        writer.write_page(page)
+    return out.getvalue()
+
+def test_header_is_written_without_any_rows():
+    assert written("tsv", []) == "user_id\tuser_email\n"
+    assert written("csv", [[]]) == "user_id,user_email\r\n"
+    assert written("ndjson", []) == ""
+
+def test_header_is_written_once_across_pages():
+    pages = [[{"user_id": "u1", "user_email": "a@example.com"}], [], [{"user_id": "u2"}]]
+    assert written("tsv", pages) == "user_id\tuser_email\nu1\ta@example.com\nu2\t\n"
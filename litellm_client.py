@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import argparse
+import time
+import random
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from json_stream import JsonArrayStream
+from user_record import UserRecord
+
+DEFAULT_POOL_SIZE = int(os.getenv("LITELLM_POOL_SIZE", "10"))
+DEFAULT_TIMEOUT = float(os.getenv("LITELLM_TIMEOUT", "30"))
+DEFAULT_MAX_RETRIES = int(os.getenv("LITELLM_MAX_RETRIES", "5"))
+DEFAULT_RATE_LIMIT = float(os.getenv("LITELLM_RATE_LIMIT", "0"))  # requests/sec, 0 = unlimited
+MAX_PAGE_SIZE = 100  # /user/list が受け付ける page_size の上限（超えると 422 になる）
+DEFAULT_PAGE_SIZE = max(1, min(MAX_PAGE_SIZE, int(os.getenv("LITELLM_PAGE_SIZE", "100"))))
+DEFAULT_FETCH_WORKERS = int(os.getenv("LITELLM_FETCH_WORKERS", "8"))
+STREAM_CHUNK_SIZE = 64 * 1024  # /user/list の応答を読み込む単位（バイト）
+
+# プロキシが過負荷・スロットリング時に返す一時的なエラー
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# 再送しても結果が変わらないPOST（GETは常に再送可能）。/user/new などそれ以外は再送前に確認が必要
+IDEMPOTENT_POSTS = {"/user/update", "/key/update"}
+
+# 429（処理前に拒否された）の時だけ再送するPOST。/user/delete は 502/503/504 の時点で削除済みのことがあり、
+# 再送すると "not found" の 400 になってバッチ全体が失敗扱いになるため
+THROTTLE_RETRY_POSTS = {"/user/delete"}
+THROTTLED_STATUS = 429
+
+# エンドポイントごとのタイムアウト（秒）。全件取得系は応答が大きくなるため長めに設定
+ENDPOINT_TIMEOUTS = {
+    "/user/list": 120,
+    "/team/list": 60,
+}
+
+def build_headers(master_key: str) -> Dict[str, str]:
+    """Build the admin API request headers"""
+    return {
+        "Authorization": f"Bearer {master_key}",
+        "Content-Type": "application/json",
+    }
+
+def extract_users(data) -> List[Dict]:
+    """Return the user records of a /user/list response ({"users": [...]}, {"data": [...]} or a bare list)"""
+    if isinstance(data, list):
+        return data
+    return data.get("users") or data.get("data") or []
+
+def response_chunks(r: requests.Response, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a streamed response body in chunks and release the connection afterwards"""
+    try:
+        yield from r.iter_content(chunk_size)
+    finally:
+        r.close()
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Group items into lists of at most `size` (always yields at least one list)"""
+    batch = []
+    yielded = False
+    for item in items:
+        batch.append(item)
+        if len(batch) >= max(1, size):
+            yield batch
+            yielded = True
+            batch = []
+    if batch or not yielded:
+        yield batch
+
+def clamp_page_size(page_size: int) -> int:
+    """page_size limited to what /user/list accepts (1..MAX_PAGE_SIZE)"""
+    return max(1, min(MAX_PAGE_SIZE, page_size))
+
+def page_size_arg(value: str) -> int:
+    """argparse type for --page-size: an integer between 1 and MAX_PAGE_SIZE"""
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {MAX_PAGE_SIZE} (the /user/list limit), got {page_size}")
+    return page_size
+
+def count_pages(data, requested_page_size: int) -> int:
+    """Number of pages announced by a paginated /user/list response (0 if not paginated)"""
+    if not isinstance(data, dict):
+        return 0
+    if data.get("total_pages"):
+        return int(data["total_pages"])
+    if data.get("total") is not None:
+        total = int(data["total"])
+        # プロキシ側で page_size が上限に丸められる場合があるため、応答の値を優先
+        page_size = int(data.get("page_size") or requested_page_size)
+        return (total + page_size - 1) // page_size if page_size > 0 else 0
+    return 0
+
+def parse_retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    """Return the Retry-After delay in seconds (delta-seconds or HTTP-date), if any"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that honors Retry-After"""
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, backoff_base: float = 0.5, backoff_max: float = 30.0, statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.statuses = set(statuses)
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Seconds to wait before retry number `attempt + 1`"""
+        retry_after = parse_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the request rate of the whole process"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# 全クライアント・全スレッドで共有するレートリミッター
+rate_limiter = TokenBucket(DEFAULT_RATE_LIMIT)
+
+class LiteLLMClient:
+    """Keep-alive HTTP client for the LiteLLM admin API
+
+    All requests share one requests.Session, so the TCP/TLS connection is reused
+    across calls instead of being re-established for every request. Requests pass
+    through the process-wide rate limiter, and transient errors (429/502/503/504,
+    connection errors) are retried for idempotent calls. Deletes are retried only
+    on 429, which the proxy returns before doing any work. Other calls are retried
+    only when the caller's retry_if() confirms that resending is safe.
+    """
+
+    def __init__(self, base_url: str, master_key: str, pool_size: int = DEFAULT_POOL_SIZE, timeouts: Optional[Dict[str, float]] = None, retry: Optional[RetryPolicy] = None):
+        self.base_url = base_url.rstrip('/')
+        self.master_key = master_key
+        self.pool_size = pool_size
+        self.retry = retry or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        self.session = requests.Session()
+        self.session.headers.update(build_headers(master_key))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Auth headers sent with every request"""
+        return build_headers(self.master_key)
+
+    def url(self, path: str) -> str:
+        """Build an absolute URL for an API path"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def timeout_for(self, path: str) -> float:
+        """Return the timeout configured for an API path"""
+        return self.timeouts.get(self.path_of(path), DEFAULT_TIMEOUT)
+
+    def path_of(self, path_or_url: str) -> str:
+        """Return the API path for a path or an absolute URL on this proxy"""
+        if path_or_url.startswith(self.base_url + "/"):
+            return path_or_url[len(self.base_url):]
+        return "/" + path_or_url.lstrip('/')
+
+    def is_idempotent(self, method: str, path: str) -> bool:
+        return method.upper() == "GET" or path in IDEMPOTENT_POSTS
+
+    def request(self, method: str, path_or_url: str, retry_if: Optional[Callable[[], bool]] = None, **kwargs) -> requests.Response:
+        """Send a request over the shared session (accepts an API path or a URL built by url())
+
+        retry_if is consulted before resending a non-idempotent request and must
+        return True only if the previous attempt certainly had no effect.
+        """
+        path = self.path_of(path_or_url)
+        url = self.url(path)
+        kwargs.setdefault("timeout", self.timeout_for(path))
+        idempotent = self.is_idempotent(method, path)
+        attempt = 0
+
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retry.max_retries or not (idempotent or (retry_if and retry_if())):
+                    raise
+                reason = type(e).__name__
+                delay = self.retry.delay(attempt)
+            else:
+                if r.status_code not in self.retry.statuses or attempt >= self.retry.max_retries:
+                    return r
+                throttled = r.status_code == THROTTLED_STATUS and path in THROTTLE_RETRY_POSTS
+                if not idempotent and not throttled and not (retry_if and retry_if()):
+                    return r
+                reason = f"HTTP {r.status_code}"
+                delay = self.retry.delay(attempt, r)
+                r.close()
+
+            attempt += 1
+            print(f"WARNING: {reason} from {method} {path}, retrying in {delay:.1f}s (attempt {attempt}/{self.retry.max_retries})", file=sys.stderr)
+            time.sleep(delay)
+
+    def get(self, path_or_url: str, **kwargs) -> requests.Response:
+        return self.request("GET", path_or_url, **kwargs)
+
+    def post(self, path_or_url: str, **kwargs) -> requests.Response:
+        return self.request("POST", path_or_url, **kwargs)
+
+    def stream_user_list(self, params: Dict, debug: bool = False, project: Optional[Callable[[Dict], Dict]] = None) -> JsonArrayStream:
+        """GET /user/list and decode its user array incrementally as the body arrives
+
+        Iterate the returned stream for the users; the other response fields
+        (total, total_pages, next ...) are in its meta once iteration is done.
+        """
+        r = self.get("/user/list", params=params, stream=True)
+        if debug:
+            print(f"DEBUG: /user/list {params} response status: {r.status_code}", file=sys.stderr)
+        if r.status_code >= 400:
+            # エラー本文は小さいため読み込んでから例外にする（呼び出し側で e.response.text を表示）
+            r.content
+            r.raise_for_status()
+        return JsonArrayStream(response_chunks(r), project=project)
+
+    def fetch_user_page(self, page: int, page_size: int, debug: bool = False, project: Optional[Callable[[Dict], Dict]] = None) -> Tuple[List[Dict], Dict]:
+        """Fetch one whole page of /user/list, returns (users, other response fields)
+
+        A connection lost while the body is being read is retried like a failed
+        request.
+        """
+        attempt = 0
+        while True:
+            stream = self.stream_user_list({"page": page, "page_size": page_size}, debug, project)
+            try:
+                return list(stream), stream.meta
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= self.retry.max_retries:
+                    raise
+                delay = self.retry.delay(attempt)
+                attempt += 1
+                print(f"WARNING: {type(e).__name__} while reading /user/list page {page}, retrying in {delay:.1f}s (attempt {attempt}/{self.retry.max_retries})", file=sys.stderr)
+                time.sleep(delay)
+
+    def iter_user_pages(self, page_size: int = DEFAULT_PAGE_SIZE, workers: int = DEFAULT_FETCH_WORKERS, debug: bool = False, project: Optional[Callable[[Dict], Dict]] = None) -> Iterator[List[Dict]]:
+        """Yield /user/list pages in order
+
+        The first page tells how many pages exist (total / total_pages); the rest
+        are then downloaded concurrently, at most `workers` at a time, and yielded
+        in page order. Proxies that answer with next / next_page_token are followed
+        serially, and proxies without pagination return everything in one page.
+
+        Responses are decoded incrementally, and a response holding more than
+        page_size users (a proxy that ignores paging) is yielded in page_size
+        batches while it is read, so memory does not grow with the response.
+        Users are passed through `project` (e.g. UserRecord.from_api) as parsed.
+        page_size is clamped to MAX_PAGE_SIZE, which the proxy would reject.
+        """
+        page_size = clamp_page_size(page_size)
+        first = self.stream_user_list({"page": 1, "page_size": page_size}, debug, project)
+        yield from batched(first, page_size)
+
+        total_pages = count_pages(first.meta, page_size)
+        if total_pages > 1:
+            if debug:
+                print(f"DEBUG: /user/list has {total_pages} pages, fetching with {workers} workers", file=sys.stderr)
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                pending = []
+                next_page = 2
+                while next_page <= total_pages or pending:
+                    # ワーカー数分だけ先読みし、メモリ使用量をページ数に依存させない
+                    while next_page <= total_pages and len(pending) < max(1, workers):
+                        pending.append(executor.submit(self.fetch_user_page, next_page, page_size, debug, project))
+                        next_page += 1
+                    yield pending.pop(0).result()[0]
+            return
+
+        # 旧形式: next / next_page_token を辿る
+        meta = first.meta
+        params = {}
+        while meta.get("next") or meta.get("next_page_token"):
+            params["page_token"] = meta.get("next") or meta.get("next_page_token")
+            stream = self.stream_user_list(params, debug, project)
+            yield from batched(stream, page_size)
+            meta = stream.meta
+
+    def fetch_all_users(self, page_size: int = DEFAULT_PAGE_SIZE, workers: int = DEFAULT_FETCH_WORKERS, debug: bool = False, compact: bool = False) -> List[Dict]:
+        """Download every user from /user/list
+
+        With compact each user is projected into a UserRecord as soon as it is
+        parsed, so the full API dicts are never held for the whole inventory.
+        """
+        users: List[Dict] = []
+        project = partial(UserRecord.from_api, shared={}) if compact else None
+        for page in self.iter_user_pages(page_size, workers, debug, project):
+            users.extend(page)
+        return users
+
+    def find_user_by_email(self, user_email: str) -> Dict:
+        """Look up a single user by email (case-insensitive), {} if not found
+
+        The user_email filter of /user/list may match partially, so the
+        exact address can be on any page of the result; pages are read until
+        it is found or the result ends.
+        """
+        wanted = user_email.strip().lower()
+        page = 1
+        while True:
+            r = self.get("/user/list", params={"user_email": user_email, "page": page, "page_size": MAX_PAGE_SIZE})
+            r.raise_for_status()
+            data = r.json()
+            users = extract_users(data)
+            for user in users:
+                if (user.get("user_email") or "").strip().lower() == wanted:
+                    return user
+            # ページングしないプロキシは1回の応答で全件を返す
+            if not users or page >= count_pages(data, MAX_PAGE_SIZE):
+                return {}
+            page += 1
+
+    def new_user_guard(self, user_email: str) -> Tuple[Callable[[], bool], Dict]:
+        """Build a retry_if for POST /user/new
+
+        Before /user/new is resent, the user is looked up. If the earlier attempt
+        created it after all, the lookup result is stored in the returned dict and
+        the request is not resent.
+        """
+        existing: Dict = {}
+
+        def retry_if() -> bool:
+            try:
+                user = self.find_user_by_email(user_email)
+            except Exception:
+                return False
+            if user:
+                existing.update(user)
+                return False
+            return True
+
+        return retry_if, existing
+
+    def close(self):
+        self.session.close()
+
+_clients: Dict[Tuple[str, str], LiteLLMClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(base_url: str, master_key: str, pool_size: int = DEFAULT_POOL_SIZE) -> LiteLLMClient:
+    """Return the shared client for a proxy, creating it on first use"""
+    key = (base_url.rstrip('/'), master_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = LiteLLMClient(base_url, master_key, pool_size)
+            _clients[key] = client
+    return client
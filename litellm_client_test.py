@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mock_litellm_server
+from litellm_client import LiteLLMClient
+from mock_litellm_server import MockLiteLLMServer, MockLiteLLMState
+
+MASTER_KEY = "sk-test"
+
+def test_find_user_by_email_reads_every_page_of_a_partial_match(monkeypatch):
+    user_list = mock_litellm_server.ROUTES[("GET", "/user/list")]
+
+    def partial_match(state, query, body):
+        # user_email を部分一致として扱うプロキシ: ドメインだけで絞り込む
+        query = dict(query, user_email=query["user_email"].split("@")[1])
+        return user_list(state, query, body)
+
+    monkeypatch.setitem(mock_litellm_server.ROUTES, ("GET", "/user/list"), partial_match)
+    server = MockLiteLLMServer("127.0.0.1", 0, MockLiteLLMState(450, 1, 1), MASTER_KEY, 0, 0, 0)
+    server.start_background()
+    try:
+        client = LiteLLMClient(server.base_url, MASTER_KEY)
+        last = max(u["user_email"] for u in server.state.users.values() if u.get("user_email"))
+        domain = last.split("@")[1]
+        # 同じドメインのユーザーが1ページに収まらないこと
+        assert sum(1 for u in server.state.users.values() if (u.get("user_email") or "").endswith(domain)) > 100
+        assert client.find_user_by_email(last.upper())["user_email"] == last
+        assert client.find_user_by_email("nobody@" + domain) == {}
+    finally:
+        server.shutdown()
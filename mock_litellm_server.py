@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from typing import Dict, List, Optional, Tuple
+
+# LiteLLM Proxy の /user/list と同じページング既定値・上限
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# LiteLLM の LitellmUserRoles に対応
+VALID_ROLES = {"proxy_admin", "proxy_admin_viewer", "org_admin", "internal_user", "internal_user_viewer", "team", "customer"}
+SEED_ROLES = ["internal_user", "internal_user", "internal_user", "internal_user_viewer", "proxy_admin", "proxy_admin_viewer"]
+SEED_DOMAINS = ["example.com", "company.com", "corp.com", "domain.org"]
+
+def isoformat(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+class MockLiteLLMState:
+    """In-memory LiteLLM admin data: users, teams and keys"""
+
+    def __init__(self, users: int = 1000, teams: int = 20, seed: int = 42, paginate: bool = True):
+        self.lock = threading.Lock()
+        self.paginate = paginate
+        self.rng = random.Random(seed)
+        self.users: Dict[str, Dict] = {}
+        self.user_ids_by_email: Dict[str, str] = {}
+        self.teams: List[Dict] = []
+        self.keys: Dict[str, Dict] = {}
+        self.keys_by_user: Dict[str, List[str]] = {}
+        self.stats: Dict[str, int] = {}
+        self._ordered: Optional[List[Dict]] = None
+        self._seed(users, teams)
+
+    def new_uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _seed(self, user_count: int, team_count: int):
+        epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for i in range(team_count):
+            name = f"team{i:03d}"
+            self.teams.append({"team_id": self.new_uuid(), "team_alias": name, "members_with_roles": []})
+
+        # LiteLLM には email を持たない既定ユーザーが存在する
+        self.put_user({"user_id": "default_user_id", "user_email": None, "user_role": "proxy_admin", "teams": [], "key_count": 0,
+                        "created_at": isoformat(epoch), "updated_at": isoformat(epoch)})
+
+        for i in range(user_count):
+            created = epoch + timedelta(minutes=i)
+            team_ids = [self.teams[i % team_count]["team_id"]] if team_count else []
+            if team_count > 1 and self.rng.random() < 0.1:
+                team_ids.append(self.teams[(i + 1) % team_count]["team_id"])
+            user = {
+                "user_id": self.new_uuid(),
+                "user_email": f"user{i:06d}@{SEED_DOMAINS[i % len(SEED_DOMAINS)]}",
+                "user_role": SEED_ROLES[i % len(SEED_ROLES)],
+                "teams": team_ids,
+                "models": [],
+                "spend": round(self.rng.random() * 10, 4),
+                "max_budget": None,
+                "key_count": 1,
+                "metadata": {},
+                "created_at": isoformat(created),
+                "updated_at": isoformat(created),
+            }
+            self.put_user(user)
+            self.new_key(user["user_id"])
+
+    def put_user(self, user: Dict):
+        previous = self.users.get(user["user_id"])
+        if previous:
+            self.unindex_email(previous)
+        self.users[user["user_id"]] = user
+        self.index_email(user)
+        self._ordered = None
+
+    def index_email(self, user: Dict):
+        if user.get("user_email"):
+            self.user_ids_by_email[user["user_email"].lower()] = user["user_id"]
+
+    def unindex_email(self, user: Dict):
+        email = (user.get("user_email") or "").lower()
+        if email and self.user_ids_by_email.get(email) == user["user_id"]:
+            del self.user_ids_by_email[email]
+
+    def new_key(self, user_id: str, key_alias: Optional[str] = None) -> str:
+        key = "sk-" + uuid.UUID(int=self.rng.getrandbits(128)).hex
+        self.keys[key] = {"key_name": key[:5] + "..." + key[-4:], "key_alias": key_alias, "user_id": user_id, "token": uuid.uuid4().hex}
+        self.keys_by_user.setdefault(user_id, []).append(key)
+        return key
+
+    def ordered_users(self) -> List[Dict]:
+        # 更新があった時だけ並べ直す（ページ取得ごとに全件をコピーしない）
+        if self._ordered is None:
+            self._ordered = list(self.users.values())
+        return self._ordered
+
+    def count(self, endpoint: str):
+        self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+        self.stats["total"] = self.stats.get("total", 0) + 1
+
+    def find_by_email(self, email: str) -> Optional[Dict]:
+        # 全件を走査せず索引で引く（ロックを保持する時間をユーザー数に依存させない）
+        user_id = self.user_ids_by_email.get(email.lower())
+        return self.users.get(user_id) if user_id else None
+
+def error(status: int, message: str) -> Tuple[int, Dict]:
+    return status, {"error": {"message": message, "type": "bad_request_error" if status < 500 else "server_error", "code": str(status)}}
+
+class MockLiteLLMHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the subset of the LiteLLM admin API used by the scripts"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLiteLLM/1.0"
+    # ヘッダーとボディの書き込みが Nagle と遅延 ACK で待たされないようにする
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write("%s - %s\n" % (self.address_string(), format % args))
+
+    def send_json(self, status: int, body, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def dispatch(self, method: str):
+        # 応答を返す前に必ずボディを読み切る（keep-alive 接続を壊さないため）
+        body = self.read_json() if method == "POST" else {}
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/") or "/"
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        server = self.server
+        state = server.state
+
+        if path == "/_stats":
+            with state.lock:
+                return self.send_json(200, dict(state.stats))
+
+        if server.master_key and self.headers.get("Authorization") != f"Bearer {server.master_key}":
+            return self.send_json(*error(401, "Authentication Error, invalid master key"))
+
+        with state.lock:
+            state.count(f"{method} {path}")
+
+        if server.latency:
+            time.sleep(server.latency + (random.random() * server.jitter if server.jitter else 0))
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_json(*error(503, "Injected transient error"), headers={"Retry-After": "0"})
+
+        route = ROUTES.get((method, path))
+        if route is None:
+            return self.send_json(404, {"detail": "Not Found"})
+        with state.lock:
+            status, payload = route(state, query, body)
+        self.send_json(status, payload)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+def user_list(state: MockLiteLLMState, query: Dict, body: Dict):
+    users = state.ordered_users()
+    if query.get("user_email"):
+        needle = query["user_email"].lower()
+        if "@" in needle:
+            # 完全なアドレスは索引で一致するユーザーだけを返す（部分一致の走査をしない）
+            user = state.find_by_email(needle)
+            users = [user] if user else []
+        else:
+            users = [u for u in users if needle in (u.get("user_email") or "").lower()]
+    if query.get("role"):
+        users = [u for u in users if u.get("user_role") == query["role"]]
+    if query.get("sort_by") in ("created_at", "updated_at", "user_email", "user_id"):
+        key = query["sort_by"]
+        users = sorted(users, key=lambda u: u.get(key) or "", reverse=query.get("sort_order", "asc") == "desc")
+
+    if not state.paginate:
+        # ページングに対応していない旧プロキシ: 全件を1つの応答で返す
+        return 200, {"users": users}
+
+    try:
+        page = max(1, int(query.get("page", 1)))
+        page_size = int(query.get("page_size", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return error(422, "page and page_size must be integers")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        return error(422, f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+
+    total = len(users)
+    start = (page - 1) * page_size
+    return 200, {
+        "users": users[start:start + page_size],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size,
+    }
+
+def user_info(state: MockLiteLLMState, query: Dict, body: Dict):
+    user = state.users.get(query.get("user_id", ""))
+    if not user:
+        return error(404, f"User {query.get('user_id')} not found")
+    keys = [state.keys[k] for k in state.keys_by_user.get(user["user_id"], [])]
+    teams = [t for t in state.teams if t["team_id"] in user.get("teams", [])]
+    return 200, {"user_id": user["user_id"], "user_info": user, "keys": keys, "teams": teams}
+
+def user_new(state: MockLiteLLMState, query: Dict, body: Dict):
+    email = body.get("user_email")
+    if email and state.find_by_email(email):
+        return error(400, f"User with email {email} already exists")
+    if body.get("user_role") and body["user_role"] not in VALID_ROLES:
+        return error(400, f"Invalid user_role {body['user_role']}")
+    team_ids = list(body.get("teams") or [])
+    if body.get("team_id"):
+        if not any(t["team_id"] == body["team_id"] for t in state.teams):
+            return error(400, f"Team {body['team_id']} does not exist")
+        team_ids.insert(0, body["team_id"])
+    now = isoformat(datetime.now(timezone.utc))
+    user = {
+        "user_id": body.get("user_id") or state.new_uuid(),
+        "user_email": email,
+        "user_role": body.get("user_role") or "internal_user",
+        "teams": team_ids,
+        "models": body.get("models") or [],
+        "spend": 0.0,
+        "max_budget": body.get("max_budget"),
+        "key_count": 1,
+        "metadata": body.get("metadata") or {},
+        "created_at": now,
+        "updated_at": now,
+    }
+    state.put_user(user)
+    key = state.new_key(user["user_id"])
+    return 200, dict(user, key=key, team_id=body.get("team_id"))
+
+def user_update(state: MockLiteLLMState, query: Dict, body: Dict):
+    user = state.users.get(body.get("user_id", ""))
+    if not user:
+        return error(404, f"User {body.get('user_id')} not found")
+    if "user_role" in body:
+        user["user_role"] = body["user_role"]
+    if "teams" in body:
+        user["teams"] = list(body["teams"])
+    if "user_email" in body:
+        state.unindex_email(user)
+        user["user_email"] = body["user_email"]
+        state.index_email(user)
+    for field in ("models", "max_budget", "metadata"):
+        if field in body:
+            user[field] = body[field]
+    user["updated_at"] = isoformat(datetime.now(timezone.utc))
+    return 200, dict(user)
+
+def user_delete(state: MockLiteLLMState, query: Dict, body: Dict):
+    ids = body.get("user_ids") or []
+    missing = [i for i in ids if i not in state.users]
+    if missing:
+        return error(400, f"Users not found: {missing}")
+    for user_id in ids:
+        state.unindex_email(state.users.pop(user_id))
+        for key in state.keys_by_user.pop(user_id, []):
+            del state.keys[key]
+    state._ordered = None
+    return 200, {"deleted_user_ids": ids}
+
+def team_list(state: MockLiteLLMState, query: Dict, body: Dict):
+    return 200, list(state.teams)
+
+def key_update(state: MockLiteLLMState, query: Dict, body: Dict):
+    key = state.keys.get(body.get("key", ""))
+    if not key:
+        return error(404, "Key not found")
+    if "key_alias" in body:
+        key["key_alias"] = body["key_alias"]
+    return 200, dict(key, key=body["key"])
+
+ROUTES = {
+    ("GET", "/user/list"): user_list,
+    ("GET", "/user/info"): user_info,
+    ("POST", "/user/new"): user_new,
+    ("POST", "/user/update"): user_update,
+    ("POST", "/user/delete"): user_delete,
+    ("GET", "/team/list"): team_list,
+    ("POST", "/key/update"): key_update,
+}
+
+class MockLiteLLMServer(ThreadingHTTPServer):
+    """Threaded HTTP server usable as LITELLM_BASE_URL for every script"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 4000, state: Optional[MockLiteLLMState] = None,
+                 master_key: Optional[str] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, verbose: bool = False):
+        super().__init__((host, port), MockLiteLLMHandler)
+        self.state = state or MockLiteLLMState()
+        self.master_key = master_key
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_background(self) -> threading.Thread:
+        """Serve from a daemon thread (for use inside tests and benchmarks)"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the LiteLLM Proxy admin API (offline testing and benchmarks)",
+        epilog="""
+Implemented endpoints:
+  GET  /user/list   (page, page_size <= 100, user_email, role, sort_by, sort_order)
+  GET  /user/info   POST /user/new   POST /user/update   POST /user/delete
+  GET  /team/list   POST /key/update
+  GET  /_stats      request counters per endpoint (not part of LiteLLM)
+
+With --no-pagination /user/list ignores page/page_size and returns every
+user in one {"users": [...]} body, like older proxies.
+
+Example usage:
+  python mock_litellm_server.py --users 100000 --latency-ms 20
+  LITELLM_BASE_URL=http://127.0.0.1:4000 python list_user.py --show-all
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=4000, help="Port (default: 4000)")
+    parser.add_argument("--users", type=int, default=1000, help="Number of seeded users (default: 1000)")
+    parser.add_argument("--teams", type=int, default=20, help="Number of seeded teams (default: 20)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the dataset (default: 42)")
+    parser.add_argument("--master-key", default=None, help="Require this Bearer key (default: accept any)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every request (default: 0)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay up to this value (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503 + Retry-After (default: 0)")
+    parser.add_argument("--no-pagination", action="store_true", help="Return every user from /user/list in one response")
+    parser.add_argument("--verbose", action="store_true", help="Log every request to stderr")
+    args = parser.parse_args()
+
+    started = time.time()
+    state = MockLiteLLMState(args.users, args.teams, args.seed, paginate=not args.no_pagination)
+    server = MockLiteLLMServer(args.host, args.port, state, args.master_key, args.latency_ms / 1000.0,
+                               args.jitter_ms / 1000.0, args.error_rate, args.verbose)
+    print(f"Seeded {args.users} users and {args.teams} teams in {time.time() - started:.1f}s")
+    print(f"Mock LiteLLM admin API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Optional
+from inventory_snapshot import DEFAULT_CACHE_DIR
+
+JOURNAL_VERSION = 1
+
+def file_digest(filename: str) -> str:
+    """sha256 of a file's contents (used to detect a CSV edited between runs)"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def journal_path(script: str, base_url: str, csv_file: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Journal file for one script run against one proxy with one CSV file"""
+    key = f"{script}\n{base_url.rstrip('/')}\n{os.path.abspath(csv_file)}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"journal-{script}-{digest}.jsonl")
+
+class RunJournal:
+    """Append-only checkpoint journal of the operations a bulk run has completed
+
+    Every finished operation (create, key alias, delete, update, ...) is
+    appended as one JSON line and fsynced before the run moves on, so after a
+    crash `--resume` can skip the work that was already done and carry its
+    results into the reports. The journal is removed when the run completes.
+    A torn last line from a crash is ignored on load.
+    """
+
+    def __init__(self, script: str, base_url: str, csv_file: str, cache_dir: str = DEFAULT_CACHE_DIR, debug: bool = False):
+        self.script = script
+        self.base_url = base_url.rstrip('/')
+        self.csv_file = os.path.abspath(csv_file)
+        self.path = journal_path(script, base_url, csv_file, cache_dir)
+        self.debug = debug
+        self.results: Dict[str, Dict[str, Dict]] = {}  # op -> key -> 成功した結果
+        self.resumed = False
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self, csv_digest: str) -> bool:
+        """Read the journal of an interrupted run, returns False if there is nothing to resume"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"WARNING: Ignoring unreadable journal '{self.path}': {e}", file=sys.stderr)
+            return False
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # クラッシュ時に途中まで書かれた行
+                continue
+        if not records or records[0].get("op") != "header":
+            return False
+        header = records[0]
+        if header.get("version") != JOURNAL_VERSION or header.get("base_url") != self.base_url:
+            return False
+        if header.get("csv_sha256") != csv_digest:
+            print(f"WARNING: '{self.csv_file}' changed since the interrupted run, starting a new run", file=sys.stderr)
+            return False
+
+        for record in records[1:]:
+            if record.get("success"):
+                self.results.setdefault(record["op"], {})[record["key"]] = record.get("result", {})
+        self.resumed = True
+        if self.debug:
+            done = sum(len(v) for v in self.results.values())
+            print(f"DEBUG: Loaded journal '{self.path}' ({done} completed operations)", file=sys.stderr)
+        return True
+
+    def start(self, resume: bool = False) -> "RunJournal":
+        """Open the journal, continuing the interrupted run if `resume` and one exists"""
+        csv_digest = file_digest(self.csv_file)
+        if resume and not self.load(csv_digest):
+            print(f"No interrupted run to resume for '{self.csv_file}', starting a new run")
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.resumed else os.O_TRUNC)
+        # 作成したユーザーのAPIキーを含むため所有者のみ読み書き可
+        self._file = os.fdopen(os.open(self.path, flags, 0o600), "a", encoding="utf-8")
+        if not self.resumed:
+            self._append({
+                "op": "header",
+                "version": JOURNAL_VERSION,
+                "script": self.script,
+                "base_url": self.base_url,
+                "csv_file": self.csv_file,
+                "csv_sha256": csv_digest,
+                "started_at": time.time(),
+            })
+        return self
+
+    def _append(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, op: str, key: str, result: Dict, success: bool = True):
+        """Append one completed operation (thread-safe, durable once it returns)"""
+        with self._lock:
+            self._append({"op": op, "key": key, "success": bool(success), "result": result, "at": time.time()})
+            if success:
+                self.results.setdefault(op, {})[key] = result
+
+    def result(self, op: str, key: str) -> Optional[Dict]:
+        """Result of a successfully completed operation from this or the interrupted run"""
+        return self.results.get(op, {}).get(key)
+
+    def finish(self):
+        """Remove the journal once the run has completed and its reports are written"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import hashlib
+from typing import Dict, Iterable, List, Set, Tuple
+from atomic_file import atomic_write
+from inventory_snapshot import DEFAULT_CACHE_DIR
+
+DEFAULT_DELTA_MAX_AGE = float(os.getenv("LITELLM_CSV_DELTA_MAX_AGE", str(7 * 86400)))  # 秒。これを超えたら全件照合
+STATE_VERSION = 1
+
+def normalize_email(email: str) -> str:
+    return (email or "").strip().lower()
+
+def row_fingerprint(user: Dict) -> str:
+    """Fingerprint of the CSV fields sync_user.py reconciles (role and team names)"""
+    teams = " ".join((user.get("team_name") or "").split())
+    return hashlib.sha256(f"{user.get('role', '')}\x1f{teams}".encode("utf-8")).hexdigest()[:16]
+
+def state_path(base_url: str, csv_file: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """State file for one CSV file synced against one proxy"""
+    key = f"{base_url.rstrip('/')}\n{os.path.abspath(csv_file)}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"csv-sync-{digest}.json")
+
+class CsvSyncState:
+    """Fingerprints of the CSV rows whose desired state was last applied
+
+    delta() compares the current CSV with the stored fingerprints so only the
+    rows that were added, removed or changed since the last run have to be
+    reconciled against the proxy.
+    """
+
+    def __init__(self, base_url: str, csv_file: str, cache_dir: str = DEFAULT_CACHE_DIR, max_age: float = DEFAULT_DELTA_MAX_AGE, debug: bool = False):
+        self.base_url = base_url.rstrip('/')
+        self.csv_file = os.path.abspath(csv_file)
+        self.path = state_path(base_url, csv_file, cache_dir)
+        self.max_age = max_age
+        self.debug = debug
+        self.rows: Dict[str, str] = {}
+        self.full_reconciled_at = 0.0
+        self.loaded = False
+
+    def load(self) -> bool:
+        """Read the state file, returns False if there is no usable state"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Ignoring unreadable CSV sync state '{self.path}': {e}", file=sys.stderr)
+            return False
+
+        if data.get("version") != STATE_VERSION or data.get("base_url") != self.base_url:
+            return False
+        self.rows = data.get("rows", {})
+        self.full_reconciled_at = data.get("full_reconciled_at", 0.0)
+        self.loaded = True
+        if self.debug:
+            print(f"DEBUG: Loaded CSV sync state '{self.path}' ({len(self.rows)} rows)", file=sys.stderr)
+        return True
+
+    def save(self):
+        """Write the state atomically"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        data = {
+            "version": STATE_VERSION,
+            "base_url": self.base_url,
+            "csv_file": self.csv_file,
+            "full_reconciled_at": self.full_reconciled_at,
+            "saved_at": time.time(),
+            "rows": self.rows,
+        }
+        with atomic_write(self.path, mode=0o600) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    def needs_full_reconciliation(self) -> bool:
+        return not self.loaded or time.time() - self.full_reconciled_at > self.max_age
+
+    def delta(self, csv_users: List[Dict]) -> Tuple[Set[str], Set[str], Set[str]]:
+        """Return (added, changed, removed) normalized emails relative to the stored state"""
+        current = {normalize_email(u["email"]): row_fingerprint(u) for u in csv_users}
+        added = {e for e in current if e not in self.rows}
+        changed = {e for e, fp in current.items() if e in self.rows and self.rows[e] != fp}
+        removed = {e for e in self.rows if e not in current}
+        return added, changed, removed
+
+    def record_results(self, csv_users: List[Dict], sync_results: Dict, full: bool, removed: Iterable[str] = ()):
+        """Store fingerprints for rows whose desired state is now applied
+
+        Rows that failed are dropped (seen as added next time) and deletions
+        that failed or were skipped keep an entry (seen as removed next time),
+        so everything that did not converge is reconciled again on the next run.
+        Removed rows with nothing to delete on the proxy are dropped. After a
+        full reconciliation the state is rebuilt from scratch.
+        """
+        fingerprints = {normalize_email(u["email"]): row_fingerprint(u) for u in csv_users}
+        previous = self.rows
+        rows = {} if full else dict(previous)
+        for email in removed:
+            rows.pop(email, None)
+
+        for user in list(sync_results.get("added", [])) + list(sync_results.get("updated", [])):
+            email = normalize_email(user.get("email"))
+            if user.get("success") and email in fingerprints:
+                rows[email] = fingerprints[email]
+            else:
+                rows.pop(email, None)
+        for user in sync_results.get("unchanged", []):
+            email = normalize_email(user.get("email"))
+            if email in fingerprints:
+                rows[email] = fingerprints[email]
+        for user in sync_results.get("deleted", []):
+            email = normalize_email(user.get("email"))
+            if user.get("success"):
+                rows.pop(email, None)
+            else:
+                rows[email] = previous.get(email, "")
+
+        self.rows = rows
+        if full:
+            self.full_reconciled_at = time.time()
+
+    def mark_pending_deletes(self, emails: Iterable[str]):
+        """Keep entries for removed rows that were not deleted (e.g. --no-delete)"""
+        for email in emails:
+            email = normalize_email(email)
+            self.rows.setdefault(email, "")
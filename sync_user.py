@@ -6,80 +6,79 @@ import sys
 import argparse
 import requests
 import csv
-from typing import List, Dict, Set, Tuple
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
+from typing import Callable, Iterable, Iterator, List, Dict, FrozenSet, Optional, Set, Tuple
 from dotenv import load_dotenv
+from atomic_file import atomic_write
+from litellm_client import DEFAULT_FETCH_WORKERS, DEFAULT_PAGE_SIZE, DEFAULT_POOL_SIZE, MAX_PAGE_SIZE, get_client, page_size_arg
+from team_directory import get_team_directory
+from inventory_snapshot import forget_deleted_users, get_inventory_snapshot
+from run_journal import RunJournal, file_digest
+from sync_state import CsvSyncState, normalize_email
+from user_record import compact_users
+from external_sort import DEFAULT_SORT_RUN_SIZE, ExternalSorter, SpillList, merge_join
+from csv_ingest import iter_csv_rows, read_csv_rows
+from csv_validation import DUPLICATE_EMAIL, INTERNAL_ROLES, RowValidator, print_rejected
 
 # Load environment variables from .env file
 load_dotenv()
 
 DEFAULT_USER_ROLE = "proxy_admin"
-INTERNAL_ROLES = {
-    "internal_user",
-    "internal_user_viewer",
-    "proxy_admin",
-    "proxy_admin_viewer",
-    "user",
-    "default",
-    "end_user",
-}
 SENSITIVE_KEYS = {"password", "hashed_password", "salt", "token"}  # 念のため除外
+PLAN_VERSION = 1
 
-def fetch_all_users(base_url: str, master_key: str, debug: bool = False) -> List[Dict]:
-    """Fetch all users from LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    users: List[Dict] = []
+def fetch_all_users(base_url: str, master_key: str, debug: bool = False, page_size: int = DEFAULT_PAGE_SIZE, use_snapshot: bool = False,
+                    full_snapshot: bool = False) -> List[Dict]:
+    """Fetch all users from LiteLLM API (remaining pages are fetched in parallel)
 
-    url = f"{base_url.rstrip('/')}/user/list"
-    params = {}
+    Users are kept as compact UserRecord objects rather than the full API dicts.
+    With use_snapshot the on-disk inventory snapshot is refreshed incrementally
+    (fully with full_snapshot) and returned instead of downloading every page.
+    """
+    if use_snapshot:
+        return get_inventory_snapshot(base_url, master_key, debug, page_size, full_snapshot).users
 
-    if debug:
-        print(f"DEBUG: Requesting URL: {url}", file=sys.stderr)
+    client = get_client(base_url, master_key)
 
-    while True:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        
-        if debug:
-            print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
-        
-        r.raise_for_status()
-        data = r.json()
+    if debug:
+        print(f"DEBUG: Requesting URL: {client.url('/user/list')} (page_size={page_size})", file=sys.stderr)
 
-        # data が { "data": [...], "users": [...], "next": ... } の形式でも、単なる配列でも対応
-        chunk = data.get("data") or data.get("users") or (data if isinstance(data, list) else [])
-        users.extend(chunk)
+    return client.fetch_all_users(page_size, debug=debug, compact=True)
 
-        next_token = data.get("next") or data.get("next_page_token")
-        if next_token:
-            params["page_token"] = next_token
-        else:
-            break
-
-    return users
+def iter_all_users(base_url: str, master_key: str, debug: bool = False, page_size: int = DEFAULT_PAGE_SIZE, use_snapshot: bool = False,
+                   full_snapshot: bool = False) -> Iterator[Dict]:
+    """Like fetch_all_users, but yield users page by page instead of keeping the whole list"""
+    if use_snapshot:
+        yield from get_inventory_snapshot(base_url, master_key, debug, page_size, full_snapshot).users
+        return
+    
+    client = get_client(base_url, master_key)
+    for page in client.iter_user_pages(page_size, debug=debug):
+        yield from page
 
-def get_team_id_by_name(base_url: str, master_key: str, team_name: str, debug: bool = False) -> str:
-    """Get team ID by team name"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+def fetch_users_by_email(base_url: str, master_key: str, emails: List[str], debug: bool = False) -> List[Dict]:
+    """Look up only the given users (one /user/list?user_email= call each, in parallel)"""
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/team/list"
+    if debug:
+        print(f"DEBUG: Looking up {len(emails)} users by email", file=sys.stderr)
     
+    with ThreadPoolExecutor(max_workers=max(1, DEFAULT_FETCH_WORKERS)) as executor:
+        found = list(executor.map(client.find_user_by_email, emails))
+    return compact_users(user for user in found if user)
+
+def get_team_id_by_name(base_url: str, master_key: str, team_name: str, debug: bool = False) -> str:
+    """Get team ID by team name (resolved through the shared team directory)"""
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
-        
-        for team in teams:
-            if team.get("team_name") == team_name or team.get("team_alias") == team_name:
-                return team.get("team_id", "")
-        
-        return ""
+        # Find team by name (check both team_name and team_alias)
+        team_id = get_team_directory(base_url, master_key, debug).id_for_name(team_name)
+        if not team_id and debug:
+            print(f"DEBUG: Team '{team_name}' not found in available teams", file=sys.stderr)
+        return team_id
         
     except Exception as e:
         if debug:
@@ -87,26 +86,9 @@ def get_team_id_by_name(base_url: str, master_key: str, team_name: str, debug: b
         return ""
 
 def get_team_name_by_id(base_url: str, master_key: str, team_id: str, debug: bool = False) -> str:
-    """Get team name by team ID"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/team/list"
-    
+    """Get team name by team ID (resolved through the shared team directory)"""
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
-        
-        for team in teams:
-            if team.get("team_id") == team_id:
-                return team.get("team_alias") or team.get("team_name", "")
-        
-        return ""
+        return get_team_directory(base_url, master_key, debug).name_for_id(team_id)
         
     except Exception as e:
         if debug:
@@ -115,12 +97,9 @@ def get_team_name_by_id(base_url: str, master_key: str, team_id: str, debug: boo
 
 def create_user(base_url: str, master_key: str, user_email: str, user_role: str = DEFAULT_USER_ROLE, team_name: str = None, debug: bool = False) -> Dict:
     """Create a single user via LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/new"
+    url = client.url("/user/new")
     payload = {
         "user_email": user_email,
         "user_role": user_role,
@@ -137,23 +116,33 @@ def create_user(base_url: str, master_key: str, user_email: str, user_role: str
         print(f"DEBUG: Creating user - URL: {url}", file=sys.stderr)
         print(f"DEBUG: Payload: {payload}", file=sys.stderr)
     
-    r = requests.post(url, headers=headers, json=payload, timeout=30)
+    # /user/new is not idempotent: a transient failure is only retried after
+    # confirming that the earlier attempt did not create the user anyway
+    retry_if, existing = client.new_user_guard(user_email)
+    try:
+        r = client.post(url, json=payload, retry_if=retry_if)
+    except requests.RequestException:
+        if existing:
+            return existing
+        raise
     
     if debug:
         print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
         print(f"DEBUG: Response text: {r.text[:500]}...", file=sys.stderr)
     
+    if existing and not r.ok:
+        if debug:
+            print(f"DEBUG: User {user_email} was created by an earlier attempt", file=sys.stderr)
+        return existing
+    
     r.raise_for_status()
     return r.json()
 
 def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias: str, debug: bool = False) -> Dict:
     """Update an existing API key's alias"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/key/update"
+    url = client.url("/key/update")
     payload = {
         "key": key_id,
         "key_alias": key_alias,
@@ -164,7 +153,7 @@ def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias:
         print(f"DEBUG: Update payload: {payload}", file=sys.stderr)
     
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
+        r = client.post(url, json=payload)
         
         if debug:
             print(f"DEBUG: Update response status: {r.status_code}", file=sys.stderr)
@@ -180,12 +169,9 @@ def update_api_key_alias(base_url: str, master_key: str, key_id: str, key_alias:
 
 def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = False) -> bool:
     """Delete a single user via LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/delete"
+    url = client.url("/user/delete")
     payload = {
         "user_ids": [user_id],
     }
@@ -195,7 +181,7 @@ def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = Fals
         print(f"DEBUG: Payload: {payload}", file=sys.stderr)
     
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
+        r = client.post(url, json=payload)
         
         if debug:
             print(f"DEBUG: Response status: {r.status_code}", file=sys.stderr)
@@ -209,65 +195,56 @@ def delete_user(base_url: str, master_key: str, user_id: str, debug: bool = Fals
             print(f"DEBUG: Error deleting user: {e}", file=sys.stderr)
         return False
 
+def iter_csv_users(csv_file: str, default_role: str) -> Iterator[Dict[str, str]]:
+    """Yield user data (email, role, team_name, and key_name) from CSV file one row at a time"""
+    try:
+        yield from iter_csv_rows(csv_file, default_role)
+    except FileNotFoundError:
+        print(f"ERROR: CSV file '{csv_file}' not found.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"ERROR: Failed to read CSV file '{csv_file}': {e}", file=sys.stderr)
+        sys.exit(1)
+
 def read_csv_users(csv_file: str, default_role: str) -> List[Dict[str, str]]:
     """Read user data (email, role, team_name, and key_name) from CSV file"""
-    users = []
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                email = row.get('email', '').strip()
-                role = row.get('role', '').strip() or default_role
-                team_name = row.get('team_name', '').strip()
-                key_name = row.get('key_name', '').strip()
-                if email:
-                    user_data = {"email": email, "role": role}
-                    if team_name:
-                        user_data["team_name"] = team_name
-                    if key_name:
-                        user_data["key_name"] = key_name
-                    users.append(user_data)
+        # 大きなファイルは複数プロセスで分割して解析する（結果の順序はCSVと同じ）
+        return read_csv_rows(csv_file, default_role)
     except FileNotFoundError:
         print(f"ERROR: CSV file '{csv_file}' not found.", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         print(f"ERROR: Failed to read CSV file '{csv_file}': {e}", file=sys.stderr)
         sys.exit(1)
-    
-    return users
+
+def resolve_team_field(base_url: str, master_key: str, team_names: str, debug: bool = False) -> List[str]:
+    """Team IDs for a CSV team_name value (raises ValueError if a team is unknown)"""
+    team_ids, unknown = get_team_directory(base_url, master_key, debug).ids_for_team_field(team_names)
+    if unknown:
+        if debug:
+            print(f"DEBUG: Team '{unknown[0]}' not found", file=sys.stderr)
+        raise ValueError(f"Team '{unknown[0]}' not found")
+    if debug:
+        print(f"DEBUG: Found team IDs {team_ids} for team names '{team_names}'", file=sys.stderr)
+    return team_ids
 
 def update_user_teams_safely(base_url: str, master_key: str, user_id: str, current_team_ids: List[str], new_team_names: str, debug: bool = False) -> Dict:
     """Safely update user's teams by adding to new teams first, then removing from old teams"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
     if not new_team_names:
         if debug:
             print(f"DEBUG: No new team names provided for user {user_id}", file=sys.stderr)
         return {"success": True, "message": "No team changes needed"}
     
-    # Parse new team names
-    new_team_name_list = [name.strip() for name in new_team_names.split() if name.strip()]
-    if not new_team_name_list:
+    # Get new team IDs (team names may contain spaces, see TeamDirectory.ids_for_team_field)
+    new_team_ids = resolve_team_field(base_url, master_key, new_team_names, debug)
+    if not new_team_ids:
         if debug:
             print(f"DEBUG: Empty team names list for user {user_id}", file=sys.stderr)
         return {"success": True, "message": "No team changes needed"}
     
-    # Get new team IDs
-    new_team_ids = []
-    for team_name in new_team_name_list:
-        team_id = get_team_id_by_name(base_url, master_key, team_name, debug)
-        if team_id:
-            new_team_ids.append(team_id)
-            if debug:
-                print(f"DEBUG: Found team ID '{team_id}' for team name '{team_name}'", file=sys.stderr)
-        else:
-            if debug:
-                print(f"DEBUG: Team '{team_name}' not found", file=sys.stderr)
-            raise ValueError(f"Team '{team_name}' not found")
-    
     if not new_team_ids:
         raise ValueError("No valid team IDs found for the specified team names")
     
@@ -280,7 +257,7 @@ def update_user_teams_safely(base_url: str, master_key: str, user_id: str, curre
             print(f"DEBUG: Team IDs are the same, no changes needed for user {user_id}", file=sys.stderr)
         return {"success": True, "message": "Teams are already up to date"}
     
-    url = f"{base_url.rstrip('/')}/user/update"
+    url = client.url("/user/update")
     
     # Step 1: Add user to new teams (combine current and new teams)
     combined_team_ids = list(current_team_ids_set | new_team_ids_set)
@@ -302,7 +279,7 @@ def update_user_teams_safely(base_url: str, master_key: str, user_id: str, curre
         print(f"DEBUG: Step 1 payload: {payload_add}", file=sys.stderr)
     
     try:
-        r = requests.post(url, headers=headers, json=payload_add, timeout=30)
+        r = client.post(url, json=payload_add)
         if debug:
             print(f"DEBUG: Step 1 response status: {r.status_code}", file=sys.stderr)
             print(f"DEBUG: Step 1 response text: {r.text[:500]}...", file=sys.stderr)
@@ -321,7 +298,7 @@ def update_user_teams_safely(base_url: str, master_key: str, user_id: str, curre
         if debug:
             print(f"DEBUG: Step 2 payload: {payload_final}", file=sys.stderr)
         
-        r = requests.post(url, headers=headers, json=payload_final, timeout=30)
+        r = client.post(url, json=payload_final)
         if debug:
             print(f"DEBUG: Step 2 response status: {r.status_code}", file=sys.stderr)
             print(f"DEBUG: Step 2 response text: {r.text[:500]}...", file=sys.stderr)
@@ -335,40 +312,34 @@ def update_user_teams_safely(base_url: str, master_key: str, user_id: str, curre
         raise
 def recreate_user_with_teams(base_url: str, master_key: str, user_id: str, user_email: str, user_role: str, team_names: str, debug: bool = False) -> Dict:
     """Recreate user with correct teams as fallback when update fails"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
     if debug:
         print(f"DEBUG: Recreating user {user_email} with teams {team_names}", file=sys.stderr)
     
     try:
         # Step 1: Delete the user
-        delete_url = f"{base_url.rstrip('/')}/user/delete"
+        delete_url = client.url("/user/delete")
         delete_payload = {"user_ids": [user_id]}
         
         if debug:
             print(f"DEBUG: Deleting user {user_id}", file=sys.stderr)
         
-        r = requests.post(delete_url, headers=headers, json=delete_payload, timeout=30)
+        r = client.post(delete_url, json=delete_payload)
         if debug:
             print(f"DEBUG: Delete response status: {r.status_code}", file=sys.stderr)
         r.raise_for_status()
         
         # Step 2: Get team ID for the new team
-        team_name_list = [name.strip() for name in team_names.split() if name.strip()]
-        if not team_name_list:
+        team_ids = resolve_team_field(base_url, master_key, team_names, debug)
+        if not team_ids:
             raise ValueError("No valid team names provided")
         
         # Use the first team as primary team_id
-        primary_team_name = team_name_list[0]
-        team_id = get_team_id_by_name(base_url, master_key, primary_team_name, debug)
-        if not team_id:
-            raise ValueError(f"Team '{primary_team_name}' not found")
+        team_id = team_ids[0]
         
         # Step 3: Recreate the user
-        create_url = f"{base_url.rstrip('/')}/user/new"
+        create_url = client.url("/user/new")
         create_payload = {
             "user_email": user_email,
             "user_role": user_role,
@@ -378,10 +349,18 @@ def recreate_user_with_teams(base_url: str, master_key: str, user_id: str, user_
         if debug:
             print(f"DEBUG: Creating user with payload: {create_payload}", file=sys.stderr)
         
-        r = requests.post(create_url, headers=headers, json=create_payload, timeout=30)
+        retry_if, existing = client.new_user_guard(user_email)
+        try:
+            r = client.post(create_url, json=create_payload, retry_if=retry_if)
+        except requests.RequestException:
+            if existing:
+                return existing
+            raise
         if debug:
             print(f"DEBUG: Create response status: {r.status_code}", file=sys.stderr)
             print(f"DEBUG: Create response text: {r.text[:500]}...", file=sys.stderr)
+        if existing and not r.ok:
+            return existing
         r.raise_for_status()
         
         return r.json()
@@ -391,53 +370,15 @@ def recreate_user_with_teams(base_url: str, master_key: str, user_id: str, user_
             print(f"DEBUG: Error during user recreation: {e}", file=sys.stderr)
         raise
 
-def verify_team_update(base_url: str, master_key: str, user_id: str, expected_team_names: str, debug: bool = False) -> bool:
-    """Verify if user's teams match expected teams"""
-    try:
-        # Get current user info
-        headers = {
-            "Authorization": f"Bearer {master_key}",
-            "Content-Type": "application/json",
-        }
-        
-        url = f"{base_url.rstrip('/')}/user/list"
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        users = data if isinstance(data, list) else data.get("data", []) or data.get("users", [])
-        
-        for user in users:
-            if user.get("user_id") == user_id:
-                current_team_ids = user.get("teams", [])
-                current_team_names = get_team_names_from_ids(base_url, master_key, current_team_ids, debug)
-                current_teams_display = " ".join(current_team_names) if current_team_names else ""
-                
-                expected_teams_normalized = " ".join(expected_team_names.split()) if expected_team_names else ""
-                current_teams_normalized = " ".join(current_teams_display.split()) if current_teams_display else ""
-                
-                if debug:
-                    print(f"DEBUG: Expected teams: '{expected_teams_normalized}'", file=sys.stderr)
-                    print(f"DEBUG: Current teams: '{current_teams_normalized}'", file=sys.stderr)
-                
-                return expected_teams_normalized == current_teams_normalized
-        
-        return False
-        
-    except Exception as e:
-        if debug:
-            print(f"DEBUG: Error verifying team update: {e}", file=sys.stderr)
-        return False
+def update_user(base_url: str, master_key: str, user_id: str, user_role: str = None, team_names: str = None, current_team_ids: List[str] = None, debug: bool = False) -> Dict:
+    """Update a user's role and/or teams via LiteLLM API
 
-
-def update_user(base_url: str, master_key: str, user_id: str, user_role: str = None, team_names: str = None, current_team_ids: List[str] = None, user_email: str = None, debug: bool = False) -> Dict:
-    """Update a user's role and/or teams via LiteLLM API with fallback recreation"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    Team changes are verified afterwards for all users at once (see
+    find_diverged_team_updates), not per user here.
+    """
+    client = get_client(base_url, master_key)
     
-    url = f"{base_url.rstrip('/')}/user/update"
+    url = client.url("/user/update")
     payload = {
         "user_id": user_id,
     }
@@ -454,27 +395,6 @@ def update_user(base_url: str, master_key: str, user_id: str, user_role: str = N
         # Use safe team update method
         team_result = update_user_teams_safely(base_url, master_key, user_id, current_team_ids or [], team_names, debug)
         
-        # Verify if team update was successful
-        if debug:
-            print(f"DEBUG: Verifying team update for user {user_id}", file=sys.stderr)
-        
-        team_update_successful = verify_team_update(base_url, master_key, user_id, team_names, debug)
-        
-        if not team_update_successful:
-            if debug:
-                print(f"DEBUG: Team update verification failed, using fallback recreation method", file=sys.stderr)
-            
-            if not user_email:
-                raise ValueError("user_email is required for fallback recreation")
-            
-            # Fallback: recreate user with correct teams
-            recreation_result = recreate_user_with_teams(base_url, master_key, user_id, user_email, user_role or "internal_user", team_names, debug)
-            
-            if debug:
-                print(f"DEBUG: User recreation completed successfully", file=sys.stderr)
-            
-            return recreation_result
-        
         # If only team update was requested, return the team update result
         if not user_role:
             return team_result
@@ -488,7 +408,7 @@ def update_user(base_url: str, master_key: str, user_id: str, user_role: str = N
         if debug:
             print(f"DEBUG: Updating role for user {user_id} to {user_role}", file=sys.stderr)
         
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
+        r = client.post(url, json=payload)
         
         if debug:
             print(f"DEBUG: Role update response status: {r.status_code}", file=sys.stderr)
@@ -502,17 +422,14 @@ def update_user(base_url: str, master_key: str, user_id: str, user_role: str = N
 
 def get_user_virtual_keys(base_url: str, master_key: str, user_id: str, debug: bool = False) -> str:
     """Get user's virtual keys (actual API keys starting with sk-) from LiteLLM API"""
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
+    client = get_client(base_url, master_key)
     
     # Try to get user info which contains the keys
-    url = f"{base_url.rstrip('/')}/user/info"
+    url = client.url("/user/info")
     params = {"user_id": user_id}
     
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        r = client.get(url, params=params)
         
         if debug:
             print(f"DEBUG: Getting user info for API keys - URL: {url}", file=sys.stderr)
@@ -568,10 +485,16 @@ def sanitize_user(u: Dict) -> Dict:
     """Remove sensitive information from user data"""
     return {k: v for k, v in u.items() if k not in SENSITIVE_KEYS}
 
+def report_status(user: Dict) -> str:
+    """Report status of one sync result (SKIPPED when a --apply plan entry was stale)"""
+    if user.get('skipped'):
+        return 'SKIPPED'
+    return 'SUCCESS' if user.get('success') else 'FAILED'
+
 def write_sync_report(sync_results: Dict, filename: str = "user_sync_result.csv"):
     """Write synchronization results to CSV file"""
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
+        with atomic_write(filename, newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['action', 'email', 'user_id', 'role', 'team_name', 'api_keys', 'status', 'error_reason'])
             
@@ -584,7 +507,7 @@ def write_sync_report(sync_results: Dict, filename: str = "user_sync_result.csv"
                     user.get('role', ''),
                     user.get('team_name', ''),
                     user.get('api_key', ''),
-                    'SUCCESS' if user.get('success') else 'FAILED',
+                    report_status(user),
                     user.get('error', '')
                 ])
             
@@ -597,7 +520,7 @@ def write_sync_report(sync_results: Dict, filename: str = "user_sync_result.csv"
                     user.get('role', ''),
                     user.get('team_name', ''),
                     user.get('api_key', ''),
-                    'SUCCESS' if user.get('success') else 'FAILED',
+                    report_status(user),
                     user.get('error', '')
                 ])
             
@@ -610,7 +533,7 @@ def write_sync_report(sync_results: Dict, filename: str = "user_sync_result.csv"
                     user.get('role', ''),
                     user.get('team_name', ''),
                     user.get('api_key', ''),
-                    'SUCCESS' if user.get('success') else 'FAILED',
+                    report_status(user),
                     user.get('error', '')
                 ])
             
@@ -626,130 +549,263 @@ def write_sync_report(sync_results: Dict, filename: str = "user_sync_result.csv"
                     'SUCCESS',
                     ''
                 ])
+            
+            # Write rows rejected by the pre-validation (no API call was made for them)
+            for user in sync_results.get('rejected', []):
+                writer.writerow([
+                    'REJECTED',
+                    user.get('email', ''),
+                    '',
+                    user.get('role', ''),
+                    user.get('team_name', ''),
+                    '',
+                    'FAILED',
+                    user.get('error', '')
+                ])
         
         print(f"Synchronization report written to '{filename}'")
     except Exception as e:
         print(f"Failed to write sync report: {e}", file=sys.stderr)
 
 def get_team_names_from_ids(base_url: str, master_key: str, team_ids: List[str], debug: bool = False) -> List[str]:
-    """Get team names from team IDs"""
+    """Get team names from team IDs (resolved through the shared team directory)"""
     if not team_ids:
         return []
     
-    headers = {
-        "Authorization": f"Bearer {master_key}",
-        "Content-Type": "application/json",
-    }
-    
-    url = f"{base_url.rstrip('/')}/team/list"
-    
     try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        
-        teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
-        
-        team_names = []
-        for team_id in team_ids:
-            for team in teams:
-                if team.get("team_id") == team_id:
-                    team_name = team.get("team_alias") or team.get("team_name", "")
-                    if team_name:
-                        team_names.append(team_name)
-                    break
-        
-        return team_names
+        return get_team_directory(base_url, master_key, debug).names_for_ids(team_ids)
         
     except Exception as e:
         if debug:
             print(f"DEBUG: Error getting team names for IDs {team_ids}: {e}", file=sys.stderr)
         return [f"Team ID: {tid}" for tid in team_ids]
 
+class UserComparator:
+    """Decide what a CSV row means for the matching API user (shared by both diff modes)
+
+    Teams are compared as sets of team IDs: each distinct CSV team_name value is
+    resolved once through the team directory, so the comparison does not depend
+    on team order or on how names are joined.
+    """
+
+    def __init__(self, base_url: str, master_key: str, debug: bool = False):
+        try:
+            self.directory = get_team_directory(base_url, master_key, debug).ensure_loaded()
+        except Exception as e:
+            # チーム一覧が取得できない場合、チームは比較せずロールだけを同期する
+            print(f"WARNING: Could not load the team list, team changes are not synchronized: {e}", file=sys.stderr)
+            self.directory = None
+        # Memoized per distinct value; most users share a handful of team combinations
+        self.csv_teams_cache: Dict[str, Tuple[str, List[str], Optional[FrozenSet[str]]]] = {}
+        self.api_teams_cache: Dict[Tuple[str, ...], Tuple[str, FrozenSet[str]]] = {}
+    
+    def resolve_csv_teams(self, team_name: str) -> Tuple[str, List[str], Optional[FrozenSet[str]]]:
+        """(normalized team_name, team IDs in CSV order, ID set or None if a name is unknown)"""
+        resolved = self.csv_teams_cache.get(team_name)
+        if resolved is None:
+            team_ids, unknown = self.directory.ids_for_team_field(team_name) if self.directory is not None else ([], [team_name])
+            resolved = (" ".join(team_name.split()), team_ids, None if unknown else frozenset(team_ids))
+            self.csv_teams_cache[team_name] = resolved
+        return resolved
+    
+    def api_teams(self, team_ids: List[str]) -> Tuple[str, FrozenSet[str]]:
+        """(display names joined by spaces, ID set) for an API user's teams"""
+        key = tuple(team_ids)
+        resolved = self.api_teams_cache.get(key)
+        if resolved is None:
+            if self.directory is None:
+                names = [f"Team ID: {tid}" for tid in team_ids]
+            else:
+                names = self.directory.names_for_ids(team_ids)
+            resolved = (" ".join(names), frozenset(team_ids))
+            self.api_teams_cache[key] = resolved
+        return resolved
+    
+    def compare(self, email: str, csv_user: Dict, api_user: Dict) -> Tuple[bool, Dict]:
+        """(True, update entry) if the user needs an update, else (False, unchanged entry)"""
+        role_changed = csv_user['role'] != api_user.get('user_role')
+        
+        csv_teams, new_team_ids, new_team_set = self.resolve_csv_teams(csv_user.get('team_name', ''))
+        api_team_ids = api_user.get('teams') or []
+        current_teams_display, current_team_set = self.api_teams(api_team_ids)
+        
+        # An empty team_name in the CSV leaves the user's teams as they are.
+        # 解決できないチーム名ではチームを変更しない（一部だけ解決した ID 集合で既存のチームを外さないため）。
+        # 未登録のチーム名は RowValidator が事前に除外して報告する
+        team_changed = bool(csv_teams) and new_team_set is not None and new_team_set != current_team_set
+        
+        if role_changed or team_changed:
+            return True, {
+                'email': email,
+                'user_id': api_user.get('user_id'),
+                'current_role': api_user.get('user_role'),
+                'new_role': csv_user['role'],
+                'current_teams': current_teams_display,
+                'new_teams': csv_teams,
+                'current_team_ids': list(api_team_ids),
+                'new_team_ids': list(new_team_ids),
+                'role_changed': role_changed,
+                'team_changed': team_changed
+            }
+        # API keys are not available for unchanged users
+        return False, {
+            'email': email,
+            'user_id': api_user.get('user_id'),
+            'role': api_user.get('user_role'),
+            'team_name': current_teams_display,
+            'api_key': ''
+        }
+    
+    def delete_entry(self, email: str, api_user: Dict) -> Dict:
+        return {
+            'email': email,
+            'user_id': api_user.get('user_id'),
+            'role': api_user.get('user_role'),
+            'team_name': self.api_teams(api_user.get('teams') or [])[0]
+        }
+
+def is_sync_target(user: Dict) -> bool:
+    """API users taking part in the sync (excludes users without email, like default_user_id, and non-internal roles)"""
+    return bool(user.get("user_email")) and user.get("user_role") in INTERNAL_ROLES
+
 def compare_users(csv_users: List[Dict], api_users: List[Dict], base_url: str, master_key: str, debug: bool = False) -> Tuple[List[Dict], List[Dict], List[Dict], List[Dict]]:
-    """Compare CSV users with API users and determine what needs to be synced"""
+    """Compare CSV users with API users and determine what needs to be synced
+
+    Results follow CSV order (deletions follow API order).
+    """
     
     # Filter out users without email (like default_user_id) and non-internal roles
-    valid_api_users = []
-    for user in api_users:
-        user_email = user.get("user_email")
-        user_role = user.get("user_role")
-        if user_email and user_role in INTERNAL_ROLES:
-            valid_api_users.append(user)
+    valid_api_users = [user for user in api_users if is_sync_target(user)]
     
     if debug:
         print(f"DEBUG: Found {len(valid_api_users)} valid API users (with email and internal roles)", file=sys.stderr)
         print(f"DEBUG: Found {len(csv_users)} CSV users", file=sys.stderr)
     
+    comparator = UserComparator(base_url, master_key, debug)
+    
     # Create lookup dictionaries
     csv_users_dict = {user['email']: user for user in csv_users}
     api_users_dict = {user['user_email']: user for user in valid_api_users}
     
-    # Users to add (in CSV but not in API)
     to_add = []
+    to_update = []
+    unchanged = []
     for email, csv_user in csv_users_dict.items():
-        if email not in api_users_dict:
+        api_user = api_users_dict.get(email)
+        
+        # Users to add (in CSV but not in API)
+        if api_user is None:
             to_add.append(csv_user)
+            continue
+        
+        # Users to update (in both but with different roles/teams)
+        changed, entry = comparator.compare(email, csv_user, api_user)
+        (to_update if changed else unchanged).append(entry)
     
     # Users to delete (in API but not in CSV)
-    to_delete = []
-    for email, api_user in api_users_dict.items():
-        if email not in csv_users_dict:
-            # Get team names for display
-            team_ids = api_user.get('teams', [])
-            team_names = get_team_names_from_ids(base_url, master_key, team_ids, debug)
-            team_display = " ".join(team_names) if team_names else ""
-            
-            to_delete.append({
-                'email': email,
-                'user_id': api_user.get('user_id'),
-                'role': api_user.get('user_role'),
-                'team_name': team_display
-            })
+    to_delete = [comparator.delete_entry(email, api_user) for email, api_user in api_users_dict.items() if email not in csv_users_dict]
     
-    # Users to update (in both but with different roles/teams)
-    to_update = []
-    unchanged = []
-    for email in set(csv_users_dict.keys()) & set(api_users_dict.keys()):
-        csv_user = csv_users_dict[email]
-        api_user = api_users_dict[email]
-        
-        # Check if role needs updating
-        role_changed = csv_user['role'] != api_user.get('user_role')
-        
-        # For team comparison, resolve current team names
-        csv_teams = csv_user.get('team_name', '').strip()
-        api_team_ids = api_user.get('teams', [])
-        api_team_names = get_team_names_from_ids(base_url, master_key, api_team_ids, debug)
-        current_teams_display = " ".join(api_team_names) if api_team_names else ""
-        
-        # Compare teams (normalize spaces)
-        csv_teams_normalized = " ".join(csv_teams.split()) if csv_teams else ""
-        current_teams_normalized = " ".join(current_teams_display.split()) if current_teams_display else ""
-        
-        team_changed = csv_teams_normalized != current_teams_normalized and csv_teams_normalized != ""
-        
-        if role_changed or team_changed:
-            update_info = {
-                'email': email,
-                'user_id': api_user.get('user_id'),
-                'current_role': api_user.get('user_role'),
-                'new_role': csv_user['role'],
-                'current_teams': current_teams_display,
-                'new_teams': csv_teams,
-                'role_changed': role_changed,
-                'team_changed': team_changed
-            }
-            to_update.append(update_info)
+    if debug:
+        print(f"DEBUG: Users to add: {len(to_add)}", file=sys.stderr)
+        print(f"DEBUG: Users to delete: {len(to_delete)}", file=sys.stderr)
+        print(f"DEBUG: Users to update: {len(to_update)}", file=sys.stderr)
+        print(f"DEBUG: Users unchanged: {len(unchanged)}", file=sys.stderr)
+    
+    return to_add, to_delete, to_update, unchanged
+
+def compare_users_external(csv_users: Iterable[Dict], api_users: Iterable[Dict], base_url: str, master_key: str, sorter_factory: Callable[[str], ExternalSorter], debug: bool = False, validator: Optional[RowValidator] = None, rejected: Optional[List[Dict]] = None) -> Tuple[List[Dict], List[Dict], List[Dict], SpillList, int, int]:
+    """Out-of-core compare_users for inputs too large to index in memory
+
+    Both sides are spilled to sorted runs on disk keyed by (normalized email,
+    email, input position) and merge-joined, so memory holds one run plus the
+    users that need a change. Users are matched on the exact email and a
+    duplicated email keeps the position of its first row with the values of
+    its last, as in compare_users; the add, delete and update lists come out
+    in the same order too. Unchanged users are
+    written to a SpillList next to the runs. Returns (to_add, to_delete,
+    to_update, unchanged, CSV row count, number of API users read).
+    
+    With a validator, invalid rows and case-insensitive duplicates (adjacent
+    once sorted; the first row in the CSV is kept) are left out and appended
+    to `rejected` in CSV order, as RowValidator.validate does in memory.
+    """
+    fetched = 0
+    csv_count = 0
+    rejected_rows: List[Tuple[int, Dict]] = []
+    
+    def csv_rows() -> Iterator[List]:
+        nonlocal csv_count
+        for i, u in enumerate(csv_users):
+            csv_count = i + 1
+            error = validator.row_error(u) if validator is not None else ""
+            if error:
+                rejected_rows.append((i, dict(u, error=error)))
+                continue
+            yield [normalize_email(u['email']), u['email'], i, u['role'], u.get('team_name', ''), u.get('key_name', '')]
+    
+    def user_from_row(row: List) -> Dict:
+        csv_user = {"email": row[1], "role": row[3]}
+        if row[4]:
+            csv_user["team_name"] = row[4]
+        if row[5]:
+            csv_user["key_name"] = row[5]
+        return csv_user
+    
+    def first_per_email(rows: Iterator[List]) -> Iterator[List]:
+        # 正規化メールが同じ行はソート後に隣接するため、CSVで最初の行だけを残す
+        for _, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            first = min(group, key=lambda row: row[2])
+            for row in group:
+                if row is not first:
+                    rejected_rows.append((row[2], dict(user_from_row(row), error=DUPLICATE_EMAIL)))
+            yield first
+    
+    def api_rows() -> Iterator[List]:
+        nonlocal fetched
+        for i, u in enumerate(api_users):
+            fetched = i + 1
+            if is_sync_target(u):
+                yield [normalize_email(u['user_email']), u['user_email'], i, u.get('user_id'), u.get('user_role'), list(u.get('teams') or [])]
+    
+    csv_sorter = sorter_factory("sync-csv-")
+    api_sorter = sorter_factory("sync-api-")
+    # 行: [正規化メール, メール, 入力順, ...]。先頭3項目がソートキー
+    csv_sorter.extend(csv_rows())
+    api_sorter.extend(api_rows())
+    
+    if debug:
+        print(f"DEBUG: Sorted {csv_sorter.count} CSV rows into {max(1, len(csv_sorter.runs))} run(s) and "
+              f"{api_sorter.count} valid API users into {max(1, len(api_sorter.runs))} run(s)", file=sys.stderr)
+    
+    comparator = UserComparator(base_url, master_key, debug)
+    to_add: List[Tuple[int, Dict]] = []
+    to_update: List[Tuple[int, Dict]] = []
+    to_delete: List[Tuple[int, Dict]] = []
+    unchanged = csv_sorter.spill_list("unchanged.jsonl")
+    # 重複したメールは dict と同じく、最初の位置に最後の行の内容を使う
+    def first_position_last_values(previous: List, row: List) -> List:
+        return row[:2] + [previous[2]] + row[3:]
+    
+    csv_merged = csv_sorter.merged()
+    if validator is not None:
+        csv_merged = first_per_email(csv_merged)
+    for csv_row, api_row in merge_join(csv_merged, api_sorter.merged(), key=lambda row: (row[0], row[1]), combine=first_position_last_values):
+        if csv_row is not None:
+            csv_user = user_from_row(csv_row)
+        if api_row is not None:
+            api_user = {"user_id": api_row[3], "user_email": api_row[1], "user_role": api_row[4], "teams": api_row[5]}
+        
+        if api_row is None:
+            to_add.append((csv_row[2], csv_user))
+        elif csv_row is None:
+            to_delete.append((api_row[2], comparator.delete_entry(api_row[1], api_user)))
         else:
-            # API keys are not available for unchanged users
-            unchanged.append({
-                'email': email,
-                'user_id': api_user.get('user_id'),
-                'role': api_user.get('user_role'),
-                'team_name': current_teams_display,
-                'api_key': ''
-            })
+            changed, entry = comparator.compare(csv_row[1], csv_user, api_user)
+            if changed:
+                to_update.append((csv_row[2], entry))
+            else:
+                unchanged.append(entry)
     
     if debug:
         print(f"DEBUG: Users to add: {len(to_add)}", file=sys.stderr)
@@ -757,7 +813,475 @@ def compare_users(csv_users: List[Dict], api_users: List[Dict], base_url: str, m
         print(f"DEBUG: Users to update: {len(to_update)}", file=sys.stderr)
         print(f"DEBUG: Users unchanged: {len(unchanged)}", file=sys.stderr)
     
-    return to_add, to_delete, to_update, unchanged
+    def in_input_order(items: List[Tuple[int, Dict]]) -> List[Dict]:
+        # 変更対象は件数が少ないため、入力順に並べ直して compare_users と同じ順序にする
+        return [entry for _, entry in sorted(items, key=lambda item: item[0])]
+    
+    if rejected is not None:
+        rejected.extend(in_input_order(rejected_rows))
+    return in_input_order(to_add), in_input_order(to_delete), in_input_order(to_update), unchanged, csv_count, fetched
+
+def apply_add(base_url: str, master_key: str, user: Dict, debug: bool = False, journal: RunJournal = None) -> Tuple[Dict, List[str]]:
+    """Create one user from the sync plan and return (sync result, console lines)"""
+    try:
+        # A user created by an interrupted run is not created again
+        key = normalize_email(user['email'])
+        result = journal.result("create", key) if journal else None
+        if result is None:
+            result = create_user(
+                base_url,
+                master_key,
+                user['email'],
+                user['role'],
+                user.get('team_name'),
+                debug
+            )
+            if journal:
+                journal.record("create", key, sanitize_user(result))
+        # Get API key for the newly created user (only available in creation response)
+        api_key = result.get('key', '') or result.get('api_key', '') or result.get('token', '')
+        user_id = result.get('user_id')
+        key_name = user.get('key_name')
+        
+        # Update API key alias if key_name is provided
+        if api_key and key_name:
+            update_result = update_api_key_alias(base_url, master_key, api_key, key_name, debug)
+            if update_result:
+                if debug:
+                    print(f"DEBUG: Updated API key alias to '{key_name}' for user {user['email']}", file=sys.stderr)
+            else:
+                if debug:
+                    print(f"DEBUG: Failed to update API key alias for user {user['email']}", file=sys.stderr)
+        
+        if debug:
+            print(f"DEBUG: API key for new user {user['email']}: {'Found' if api_key else 'Not found'}", file=sys.stderr)
+            if api_key:
+                print(f"DEBUG: API key value: {api_key[:10]}...", file=sys.stderr)
+        
+        return {
+            'email': user['email'],
+            'user_id': user_id,
+            'role': user['role'],
+            'team_name': user.get('team_name', ''),
+            'api_key': api_key,
+            'key_name': key_name,
+            'success': True
+        }, [f"  ✓ Added user: {user['email']}"]
+        
+    except Exception as e:
+        error_msg = str(e)
+        return {
+            'email': user['email'],
+            'user_id': '',
+            'role': user['role'],
+            'team_name': user.get('team_name', ''),
+            'api_key': '',
+            'success': False,
+            'error': error_msg
+        }, [f"  ✗ Failed to add user {user['email']}: {error_msg}"]
+
+def apply_delete(base_url: str, master_key: str, user: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+    """Delete one user from the sync plan and return (sync result, console lines)"""
+    try:
+        success = delete_user(base_url, master_key, user['user_id'], debug)
+        if success:
+            return {
+                'email': user['email'],
+                'user_id': user['user_id'],
+                'role': user['role'],
+                'team_name': user.get('team_name', ''),
+                'success': True
+            }, [f"  ✓ Deleted user: {user['email']}"]
+        return {
+            'email': user['email'],
+            'user_id': user['user_id'],
+            'role': user['role'],
+            'team_name': user.get('team_name', ''),
+            'success': False,
+            'error': 'API deletion failed'
+        }, [f"  ✗ Failed to delete user: {user['email']}"]
+        
+    except Exception as e:
+        error_msg = str(e)
+        return {
+            'email': user['email'],
+            'user_id': user['user_id'],
+            'role': user['role'],
+            'team_name': user.get('team_name', ''),
+            'success': False,
+            'error': error_msg
+        }, [f"  ✗ Failed to delete user {user['email']}: {error_msg}"]
+
+def get_current_user(base_url: str, master_key: str, user_id: str, debug: bool = False) -> Optional[Dict]:
+    """Current /user/info record of a user, None if the user no longer exists"""
+    client = get_client(base_url, master_key)
+    r = client.get("/user/info", params={"user_id": user_id})
+    if debug:
+        print(f"DEBUG: User info response status for {user_id}: {r.status_code}", file=sys.stderr)
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    return r.json().get("user_info") or None
+
+def user_is_gone(base_url: str, master_key: str, user_id: str, debug: bool = False) -> bool:
+    """True if /user/info reports that the user no longer exists"""
+    try:
+        return get_current_user(base_url, master_key, user_id, debug) is None
+    except Exception as e:
+        if debug:
+            print(f"DEBUG: Error checking whether user {user_id} exists: {e}", file=sys.stderr)
+        return False
+
+def apply_resumed_delete(base_url: str, master_key: str, user: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+    """apply_delete for a resumed run
+
+    A delete that was in flight when the run was interrupted may have reached
+    the proxy without being journaled; a user that is already gone counts as deleted.
+    """
+    result, output = apply_delete(base_url, master_key, user, debug)
+    if not result['success'] and user_is_gone(base_url, master_key, user['user_id'], debug):
+        result = {k: v for k, v in result.items() if k != 'error'}
+        result['success'] = True
+        output = [f"  ✓ Deleted user: {user['email']}"]
+    return result, output
+
+def apply_update(base_url: str, master_key: str, user: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+    """Update one user from the sync plan and return (sync result, console lines)"""
+    try:
+        changes = []
+        if user['role_changed']:
+            changes.append(f"Role: {user['current_role']} → {user['new_role']}")
+        if user['team_changed']:
+            current_display = user['current_teams'] if user['current_teams'] else "(none)"
+            new_display = user['new_teams'] if user['new_teams'] else "(none)"
+            changes.append(f"Teams: {current_display} → {new_display}")
+        
+        if debug:
+            print(f"\nDEBUG: Updating user: {user['email']} ({', '.join(changes)})", file=sys.stderr)
+        
+        # Determine what to update
+        new_role = user['new_role'] if user['role_changed'] else None
+        new_teams = user['new_teams'] if user['team_changed'] else None
+        current_team_ids = user.get('current_team_ids', [])
+        
+        update_user(
+            base_url,
+            master_key,
+            user['user_id'],
+            new_role,
+            new_teams,
+            current_team_ids,
+            debug
+        )
+        
+        # API keys are not available for updated users
+        return {
+            'email': user['email'],
+            'user_id': user['user_id'],
+            'role': user['new_role'],
+            'team_name': user.get('new_teams', ''),
+            'api_key': '',
+            'success': True
+        }, [f"  ✓ Updated user: {user['email']} ({', '.join(changes)})"]
+        
+    except Exception as e:
+        error_msg = str(e)
+        return {
+            'email': user['email'],
+            'user_id': user['user_id'],
+            'role': user['new_role'],
+            'team_name': user.get('new_teams', ''),
+            'api_key': '',
+            'success': False,
+            'error': error_msg
+        }, [f"  ✗ Failed to update user {user['email']}: {error_msg}"]
+
+def find_diverged_team_updates(base_url: str, master_key: str, updates: List[Tuple[Dict, Dict]], debug: bool = False) -> List[Tuple[Dict, Dict]]:
+    """Check all team updates of a run against one fresh inventory fetch
+
+    `updates` are (plan entry, update result) pairs. A user converged when its
+    team ID set equals the planned one; its result then takes the user_id
+    found in the inventory. Users missing from the inventory are marked
+    failed. Returns the pairs whose teams did not converge.
+    """
+    wanted = {normalize_email(item['email']) for item, _ in updates}
+    current: Dict[str, Dict] = {}
+    # 1回の全件取得（ページ単位で読み流す）で、更新した全ユーザーの現在のチームを得る
+    for user in iter_all_users(base_url, master_key, debug):
+        email = user.get('user_email')
+        if email and normalize_email(email) in wanted:
+            current[normalize_email(email)] = user
+    
+    directory = None
+    diverged = []
+    for item, result in updates:
+        user = current.get(normalize_email(item['email']))
+        if user is None:
+            result.update(success=False, error="User not found when verifying the team update")
+            continue
+        expected_ids = item.get('new_team_ids')
+        if not expected_ids:
+            # new_team_ids を持たない古い計画はチーム名から解決する
+            directory = directory or get_team_directory(base_url, master_key, debug)
+            expected_ids, _ = directory.ids_for_team_field(item['new_teams'])
+        if set(user.get('teams') or []) == set(expected_ids):
+            result['user_id'] = user.get('user_id') or result.get('user_id')
+            continue
+        if debug:
+            print(f"DEBUG: Teams of {item['email']} did not converge: {list(user.get('teams') or [])} != {expected_ids}", file=sys.stderr)
+        diverged.append((item, result))
+    return diverged
+
+def apply_recreate(base_url: str, master_key: str, user: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+    """Recreate one user whose team update did not converge and return (sync result, console lines)"""
+    try:
+        created = recreate_user_with_teams(base_url, master_key, user['user_id'], user['email'], user['new_role'], user['new_teams'], debug)
+        return {
+            'email': user['email'],
+            'user_id': created.get('user_id') or user['user_id'],
+            'role': user['new_role'],
+            'team_name': user.get('new_teams', ''),
+            # 再作成したユーザーには新しいキーが発行される
+            'api_key': created.get('key', '') or created.get('api_key', '') or created.get('token', ''),
+            'success': True
+        }, [f"  ✓ Recreated user: {user['email']} (Teams: {user['new_teams']})"]
+    except Exception as e:
+        error_msg = f"Team update did not converge and user recreation failed: {e}"
+        return {
+            'email': user['email'],
+            'user_id': user['user_id'],
+            'role': user['new_role'],
+            'team_name': user.get('new_teams', ''),
+            'api_key': '',
+            'success': False,
+            'error': error_msg
+        }, [f"  ✗ Failed to recreate user {user['email']}: {error_msg}"]
+
+def stale_plan_reason(op: str, base_url: str, master_key: str, item: Dict, debug: bool = False) -> str:
+    """Why a planned operation no longer matches the user's current state ("" if it still does)"""
+    if op == "add":
+        if get_client(base_url, master_key).find_user_by_email(item['email']):
+            return "user was created after the plan was made"
+        return ""
+    
+    current = get_current_user(base_url, master_key, item['user_id'], debug)
+    if current is None:
+        return "user no longer exists"
+    if normalize_email(current.get('user_email')) != normalize_email(item['email']):
+        return f"user ID now belongs to '{current.get('user_email')}'"
+    if op == "update":
+        if current.get('user_role') != item['current_role']:
+            return f"role changed to '{current.get('user_role')}' after the plan was made"
+        if frozenset(current.get('teams') or []) != frozenset(item.get('current_team_ids') or []):
+            return "teams changed after the plan was made"
+    return ""
+
+def skip_if_stale(op: str, worker: Callable, journal: RunJournal = None) -> Callable:
+    """Wrap an apply worker so each user is checked against the plan right before it is changed
+
+    Users whose state changed since the plan was made are skipped and reported
+    as SKIPPED. Steps an interrupted run already performed are not re-checked.
+    """
+    def run(base_url: str, master_key: str, item: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+        if op == "add" and journal is not None and journal.result("create", normalize_email(item['email'])) is not None:
+            return worker(base_url, master_key, item, debug)
+        try:
+            reason = stale_plan_reason(op, base_url, master_key, item, debug)
+        except Exception as e:
+            reason = f"could not check current state: {e}"
+        # 中断時に削除済みだった可能性があるため、再開時は apply_resumed_delete に任せる
+        if reason == "user no longer exists" and op == "delete" and journal is not None and journal.resumed:
+            reason = ""
+        if not reason:
+            return worker(base_url, master_key, item, debug)
+        return {
+            'email': item['email'],
+            'user_id': item.get('user_id', ''),
+            'role': item.get('new_role', item.get('role', '')),
+            'team_name': item.get('new_teams', item.get('team_name', '')),
+            'api_key': '',
+            'success': False,
+            'skipped': True,
+            'error': f"Stale plan: {reason}"
+        }, [f"  - Skipped {item['email']}: {reason}"]
+    return run
+
+def run_phase(items: List[Dict], worker: Callable, base_url: str, master_key: str, executor: ThreadPoolExecutor, debug: bool = False) -> List[Dict]:
+    """Run one apply phase on the shared thread pool
+
+    The pool's size is the only concurrency limit: at most that many users are
+    in flight. Results and console lines are emitted in plan order regardless
+    of completion order.
+    """
+    futures = [executor.submit(worker, base_url, master_key, item, debug) for item in items]
+    results = []
+    for future in futures:
+        result, output = future.result()
+        for line in output:
+            print(line)
+        results.append(result)
+    return results
+
+def run_journaled_phase(op: str, items: List[Dict], worker: Callable, base_url: str, master_key: str, executor: ThreadPoolExecutor, journal: RunJournal, debug: bool = False) -> List[Dict]:
+    """run_phase that records every result in the journal
+
+    Users the journal already has a successful result for (from an interrupted
+    run) are not processed again; their recorded results are returned in place.
+    """
+    done = [journal.result(op, normalize_email(item['email'])) for item in items]
+    pending = [item for item, result in zip(items, done) if result is None]
+    if len(pending) < len(items):
+        print(f"  Skipping {len(items) - len(pending)} users completed by the interrupted run")
+    
+    def run(base_url: str, master_key: str, item: Dict, debug: bool = False) -> Tuple[Dict, List[str]]:
+        result, output = worker(base_url, master_key, item, debug)
+        journal.record(op, normalize_email(item['email']), result, result.get('success'))
+        return result, output
+    
+    results = iter(run_phase(pending, run, base_url, master_key, executor, debug))
+    return [result if result is not None else next(results) for result in done]
+
+def apply_sync_plan(to_add: List[Dict], to_delete: List[Dict], to_update: List[Dict], unchanged: List[Dict], base_url: str, master_key: str, concurrency: int = 1, debug: bool = False, journal: RunJournal = None, check_stale: bool = False) -> Dict:
+    """Apply a sync plan and return the sync_results consumed by write_sync_report
+
+    Phases run strictly one after another (add, then delete, then update);
+    within a phase up to `concurrency` users are processed at once. With a
+    journal, every completed operation is checkpointed and operations finished
+    by an interrupted run are skipped. With check_stale (plans read from a
+    file), each user is re-checked against the plan before it is changed.
+    """
+    sync_results = {
+        'added': [],
+        'deleted': [],
+        'updated': [],
+        'unchanged': unchanged
+    }
+    
+    def phase(op: str, items: List[Dict], worker: Callable) -> List[Dict]:
+        if check_stale:
+            worker = skip_if_stale(op, worker, journal)
+        if journal is None:
+            return run_phase(items, worker, base_url, master_key, executor, debug)
+        return run_journaled_phase(op, items, worker, base_url, master_key, executor, journal, debug)
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        # Add new users
+        if to_add:
+            print(f"\nAdding {len(to_add)} new users...")
+            sync_results['added'] = phase("add", to_add, partial(apply_add, journal=journal))
+        
+        # Delete users
+        if to_delete:
+            print(f"\nDeleting {len(to_delete)} users...")
+            delete_worker = apply_resumed_delete if journal is not None and journal.resumed else apply_delete
+            sync_results['deleted'] = phase("delete", to_delete, delete_worker)
+        
+        # Update users
+        if to_update:
+            print(f"\nUpdating {len(to_update)} users...")
+            sync_results['updated'] = phase("update", to_update, apply_update)
+        
+        # Verify every team change with one inventory fetch, then recreate the users that did not converge
+        team_updates = [(item, result) for item, result in zip(to_update, sync_results['updated'])
+                        if item['team_changed'] and result.get('success')]
+        if team_updates:
+            print(f"\nVerifying teams of {len(team_updates)} updated users...")
+            try:
+                diverged = find_diverged_team_updates(base_url, master_key, team_updates, debug)
+            except Exception as e:
+                # 検証できなかった場合は更新結果をそのまま報告する
+                print(f"WARNING: Could not verify team updates: {e}", file=sys.stderr)
+                diverged = []
+            if diverged:
+                print(f"Recreating {len(diverged)} users whose teams did not converge...")
+                items = [item for item, _ in diverged]
+                if journal is None:
+                    recreated = run_phase(items, apply_recreate, base_url, master_key, executor, debug)
+                else:
+                    recreated = run_journaled_phase("recreate", items, apply_recreate, base_url, master_key, executor, journal, debug)
+                for (_, result), new_result in zip(diverged, recreated):
+                    result.clear()
+                    result.update(new_result)
+            else:
+                print("  All team changes converged")
+    
+    return sync_results
+
+def build_sync_plan(to_add: List[Dict], to_delete: List[Dict], to_update: List[Dict], unchanged: List[Dict], skipped_deletes: List[str], csv_users: List[Dict], plan_csv_users: List[Dict], csv_state: Optional[CsvSyncState], delta_removed: Set[str], rejected: List[Dict]) -> Dict:
+    """Serializable form of a computed plan (--plan-out file and checkpoint journal)"""
+    return {
+        'to_add': to_add,
+        'to_delete': to_delete,
+        'to_update': to_update,
+        'unchanged': unchanged,
+        'skipped_deletes': skipped_deletes,
+        'rejected': rejected,
+        'csv_delta': csv_state is not None,
+        'full': csv_state is None or not csv_state.loaded,
+        'delta_removed': sorted(delta_removed),
+        'plan_emails': None if plan_csv_users is csv_users else sorted(normalize_email(u['email']) for u in plan_csv_users),
+    }
+
+def storable_plan(plan: Dict) -> Dict:
+    """Plan as written to the journal or a plan file
+
+    Unchanged users spilled to disk by --external-diff are stored as a count,
+    so the JSON stays small; they only feed the report.
+    """
+    if isinstance(plan['unchanged'], list):
+        return plan
+    return dict(plan, unchanged=[], unchanged_count=len(plan['unchanged']))
+
+def restore_sync_plan(plan: Dict, csv_users: Optional[List[Dict]], base_url: str, csv_file: str, debug: bool = False) -> Tuple[List[Dict], Optional[CsvSyncState], Set[str]]:
+    """Rebuild (plan_csv_users, csv_state, delta_removed) for a recorded plan
+
+    Without csv_users the CSV sync state is not updated after applying.
+    """
+    delta_removed = set(plan['delta_removed'])
+    if csv_users is None:
+        return [], None, delta_removed
+    plan_emails = set(plan['plan_emails']) if plan['plan_emails'] is not None else None
+    plan_csv_users = [u for u in csv_users if plan_emails is None or normalize_email(u['email']) in plan_emails]
+    csv_state = None
+    if plan['csv_delta']:
+        csv_state = CsvSyncState(base_url, csv_file, debug=debug)
+        csv_state.loaded = csv_state.load() and not plan['full']
+    return plan_csv_users, csv_state, delta_removed
+
+def write_plan_file(plan: Dict, filename: str, base_url: str, csv_file: str, options: Dict):
+    """Write a computed plan for a later --apply"""
+    data = {
+        "version": PLAN_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "base_url": base_url.rstrip('/'),
+        "csv_file": os.path.abspath(csv_file),
+        "csv_sha256": file_digest(csv_file),
+        "options": options,
+    }
+    data.update(storable_plan(plan))
+    with atomic_write(filename) as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"Synchronization plan written to '{filename}'")
+
+def read_plan_file(filename: str, base_url: str) -> Dict:
+    """Read a plan written by --plan-out and check that it targets this proxy"""
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        print(f"ERROR: Plan file '{filename}' not found.", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"ERROR: Plan file '{filename}' is not valid JSON: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    if plan.get("version") != PLAN_VERSION:
+        print(f"ERROR: Unsupported plan file version: {plan.get('version')}", file=sys.stderr)
+        sys.exit(1)
+    if plan.get("base_url") != base_url.rstrip('/'):
+        print(f"ERROR: Plan was made for {plan.get('base_url')}, not {base_url.rstrip('/')}", file=sys.stderr)
+        sys.exit(1)
+    return plan
 
 def main():
     parser = argparse.ArgumentParser(
@@ -785,6 +1309,13 @@ Example usage:
   python sync_user.py --csv-file user_list.csv --dry-run
   python sync_user.py --debug
   python sync_user.py --no-delete --debug
+  python sync_user.py --concurrency 16
+  python sync_user.py --snapshot --dry-run
+  python sync_user.py --csv-delta
+  python sync_user.py --resume
+  python sync_user.py --external-diff --csv-file huge_user_list.csv
+  python sync_user.py --plan-out plan.json
+  python sync_user.py --apply plan.json
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -823,6 +1354,59 @@ Example usage:
         action="store_true",
         help="Do not update existing users (only add/delete)",
     )
+    parser.add_argument(
+        "--page-size",
+        type=page_size_arg,
+        default=DEFAULT_PAGE_SIZE,
+        help=f"Users requested per /user/list page, 1-{MAX_PAGE_SIZE}; remaining pages are fetched in parallel (default: {DEFAULT_PAGE_SIZE})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of users processed in parallel within each sync phase (default: 1)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Read users from the on-disk inventory snapshot, refreshed incrementally (see LITELLM_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--csv-delta",
+        action="store_true",
+        help="Only reconcile CSV rows added, removed or changed since the last successful sync (full reconciliation every LITELLM_CSV_DELTA_MAX_AGE seconds)",
+    )
+    parser.add_argument(
+        "--full-reconcile",
+        action="store_true",
+        help="With --csv-delta, compare the whole CSV against LiteLLM this time",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its checkpoint journal with its recorded plan, skipping completed operations",
+    )
+    parser.add_argument(
+        "--external-diff",
+        action="store_true",
+        help="Compare CSV and LiteLLM users out of core: both sides are sorted into runs on disk (LITELLM_CACHE_DIR) and merge-joined, so memory stays bounded for multi-million-row inputs",
+    )
+    parser.add_argument(
+        "--sort-run-size",
+        type=int,
+        default=DEFAULT_SORT_RUN_SIZE,
+        help=f"Rows per sorted run held in memory by --external-diff (env LITELLM_SORT_RUN_SIZE, default: {DEFAULT_SORT_RUN_SIZE})",
+    )
+    parser.add_argument(
+        "--plan-out",
+        metavar="FILE",
+        help="Write the computed synchronization plan to FILE and exit without applying it",
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="FILE",
+        help="Apply a plan written by --plan-out without fetching and comparing users again; entries whose user changed since are skipped",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -830,229 +1414,225 @@ Example usage:
     )
     args = parser.parse_args()
 
+    if args.external_diff and args.csv_delta:
+        print("ERROR: --external-diff cannot be combined with --csv-delta.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.apply and (args.plan_out or args.dry_run):
+        print("ERROR: --apply cannot be combined with --plan-out or --dry-run.", file=sys.stderr)
+        sys.exit(1)
+
     if not args.master_key:
         print("ERROR: --master-key or env LITELLM_MASTER_KEY is required.", file=sys.stderr)
         sys.exit(1)
 
+    # Size the shared connection pool for the apply phase workers
+    get_client(args.base_url, args.master_key, pool_size=max(DEFAULT_POOL_SIZE, args.concurrency))
+
+    # Run files of the external diff, removed when the run ends
+    sorters: List[ExternalSorter] = []
+    
+    def new_sorter(prefix: str) -> ExternalSorter:
+        sorter = ExternalSorter(args.sort_run_size, prefix=prefix)
+        sorters.append(sorter)
+        return sorter
+
+    # Invalid rows are rejected locally, before any user API call
+    validator = RowValidator(args.base_url, args.master_key, debug=args.debug)
+    rejected: List[Dict] = []
+
     try:
-        # Fetch current users from API
-        print("Fetching current users from LiteLLM API...")
-        api_users = fetch_all_users(args.base_url, args.master_key, args.debug)
-        print(f"Found {len(api_users)} total users in LiteLLM")
-        
-        # Read users from CSV
-        print(f"Reading users from '{args.csv_file}'...")
-        csv_users = read_csv_users(args.csv_file, args.user_role)
-        print(f"Found {len(csv_users)} users in CSV file")
-        
-        # Compare and determine sync actions
-        to_add, to_delete, to_update, unchanged = compare_users(csv_users, api_users, args.base_url, args.master_key, args.debug)
-        
-        print(f"\nSynchronization Plan:")
-        print(f"  Users to add: {len(to_add)}")
-        print(f"  Users to delete: {len(to_delete)}")
-        print(f"  Users to update: {len(to_update)}")
-        print(f"  Users unchanged: {len(unchanged)}")
-        
-        if args.dry_run:
-            print("\nDRY RUN - Changes that would be made:")
+        csv_state = None
+        check_stale = False
+        if args.apply:
+            # Apply a plan made earlier with --plan-out, without fetching and comparing again
+            plan = read_plan_file(args.apply, args.base_url)
+            print(f"Applying synchronization plan '{args.apply}' (created {plan['created_at']})")
+            journal = RunJournal("apply", args.base_url, args.apply, debug=args.debug).start(args.resume)
+            csv_users = None
+            if plan['csv_delta']:
+                # CSVが計画作成時から変わっていなければ差分同期の状態も更新する
+                if os.path.exists(plan['csv_file']) and file_digest(plan['csv_file']) == plan['csv_sha256']:
+                    csv_users, _ = validator.validate(read_csv_users(plan['csv_file'], args.user_role))
+                else:
+                    print(f"WARNING: '{plan['csv_file']}' changed since the plan was made, the CSV sync state will not be updated", file=sys.stderr)
+            plan_csv_users, csv_state, delta_removed = restore_sync_plan(plan, csv_users, args.base_url, plan['csv_file'], args.debug)
+            check_stale = True
+        else:
+            # Read users from CSV (the external diff streams it from disk instead)
+            csv_users = None
+            if not args.external_diff:
+                print(f"Reading users from '{args.csv_file}'...")
+                csv_users = read_csv_users(args.csv_file, args.user_role)
+                print(f"Found {len(csv_users)} users in CSV file")
+                csv_users, rejected = validator.validate(csv_users)
+                if rejected:
+                    print(f"Rejected {len(rejected)} invalid rows before contacting the API:")
+                    print_rejected(rejected)
+            
+            # A run interrupted after planning is resumed with its recorded plan
+            journal = None
+            plan = None
+            if not args.dry_run and not args.plan_out:
+                journal = RunJournal("sync", args.base_url, args.csv_file, debug=args.debug).start(args.resume)
+                plan = journal.result("plan", "plan")
+            if plan is not None:
+                print("Resuming interrupted run with its recorded synchronization plan")
+                plan_csv_users, csv_state, delta_removed = restore_sync_plan(plan, csv_users, args.base_url, args.csv_file, args.debug)
+        
+        if plan is None:
+            # In CSV delta mode, only rows that changed since the last sync are reconciled
+            csv_state = None
+            delta_removed: Set[str] = set()
+            plan_csv_users = csv_users
+            rejected_emails = {normalize_email(u['email']) for u in rejected}
+            if args.csv_delta:
+                csv_state = CsvSyncState(args.base_url, args.csv_file, debug=args.debug)
+                csv_state.load()
+                added, changed, delta_removed = csv_state.delta(csv_users)
+                # 検証で除外した行は削除扱いにしない
+                delta_removed -= rejected_emails
+                affected = added | changed | delta_removed
+                # 影響行が多い場合は全件取得の方がリクエスト数が少ない
+                full_fetch_cost = (len(csv_users) + args.page_size - 1) // max(1, args.page_size)
+                if args.full_reconcile or csv_state.needs_full_reconciliation() or len(affected) >= full_fetch_cost:
+                    print("CSV delta: running a full reconciliation")
+                    csv_state.loaded = False
+                    delta_removed = set()
+                else:
+                    print(f"CSV delta: {len(added)} added, {len(changed)} changed, {len(delta_removed)} removed rows "
+                          f"({len(csv_users) - len(added) - len(changed)} unchanged rows skipped)")
+                    touched = added | changed
+                    plan_csv_users = [u for u in csv_users if normalize_email(u['email']) in touched]
+            
+            if args.external_diff:
+                print(f"Comparing '{args.csv_file}' with the users in LiteLLM on disk (runs of {args.sort_run_size} rows)...")
+                to_add, to_delete, to_update, unchanged, csv_count, api_count = compare_users_external(
+                    iter_csv_users(args.csv_file, args.user_role),
+                    iter_all_users(args.base_url, args.master_key, args.debug, args.page_size, args.snapshot, not args.dry_run),
+                    args.base_url, args.master_key, new_sorter, args.debug, validator, rejected)
+                print(f"Found {csv_count} users in CSV file and {api_count} total users in LiteLLM")
+                if rejected:
+                    print(f"Rejected {len(rejected)} invalid rows before contacting the API:")
+                    print_rejected(rejected)
+                    rejected_emails = {normalize_email(u['email']) for u in rejected}
+            elif csv_state is not None and csv_state.loaded:
+                print(f"Fetching {len(affected)} affected users from LiteLLM API...")
+                api_users = fetch_users_by_email(args.base_url, args.master_key, sorted(affected), args.debug)
+                print(f"Found {len(api_users)} of them in LiteLLM")
+            else:
+                # Fetch current users from API
+                print("Fetching current users from LiteLLM API...")
+                api_users = fetch_all_users(args.base_url, args.master_key, args.debug, args.page_size, args.snapshot, not args.dry_run)
+                print(f"Found {len(api_users)} total users in LiteLLM")
+            
+            if not args.external_diff:
+                # Compare and determine sync actions
+                to_add, to_delete, to_update, unchanged = compare_users(plan_csv_users, api_users, args.base_url, args.master_key, args.debug)
+            
+            # 除外した行のユーザーは CSV から消えたわけではないため削除しない
+            if rejected_emails:
+                to_delete = [u for u in to_delete if normalize_email(u['email']) not in rejected_emails]
+            
+            print(f"\nSynchronization Plan:")
+            print(f"  Users to add: {len(to_add)}")
+            print(f"  Users to delete: {len(to_delete)}")
+            print(f"  Users to update: {len(to_update)}")
+            print(f"  Users unchanged: {len(unchanged)}")
+            
+            skipped_deletes = [u['email'] for u in to_delete] if args.no_delete else []
+            plan = build_sync_plan(to_add, to_delete if not args.no_delete else [], to_update if not args.no_update else [], unchanged,
+                                   skipped_deletes, csv_users, plan_csv_users, csv_state, delta_removed, rejected)
+            if args.plan_out:
+                write_plan_file(plan, args.plan_out, args.base_url, args.csv_file,
+                                {"no_delete": args.no_delete, "no_update": args.no_update, "csv_delta": args.csv_delta})
+            
+            if args.dry_run:
+                print("\nDRY RUN - Changes that would be made:")
+            
+                if to_add:
+                    print("\n  Users to ADD:")
+                    for user in to_add:
+                        team_info = f", Team: {user.get('team_name')}" if user.get('team_name') else ""
+                        key_info = f", Key Name: {user.get('key_name')}" if user.get('key_name') else ""
+                        print(f"    + {user['email']} (Role: {user['role']}{team_info}{key_info})")
             
-            if to_add:
-                print("\n  Users to ADD:")
-                for user in to_add:
-                    team_info = f", Team: {user.get('team_name')}" if user.get('team_name') else ""
-                    key_info = f", Key Name: {user.get('key_name')}" if user.get('key_name') else ""
-                    print(f"    + {user['email']} (Role: {user['role']}{team_info}{key_info})")
+                if to_delete and not args.no_delete:
+                    print("\n  Users to DELETE:")
+                    for user in to_delete:
+                        team_info = f", Team: {user.get('team_name')}" if user.get('team_name') else ""
+                        print(f"    - {user['email']} (Role: {user['role']}{team_info})")
             
-            if to_delete and not args.no_delete:
-                print("\n  Users to DELETE:")
-                for user in to_delete:
-                    team_info = f", Team: {user.get('team_name')}" if user.get('team_name') else ""
-                    print(f"    - {user['email']} (Role: {user['role']}{team_info})")
+                if to_update and not args.no_update:
+                    print("\n  Users to UPDATE:")
+                    for user in to_update:
+                        changes = []
+                        if user['role_changed']:
+                            changes.append(f"Role: {user['current_role']} → {user['new_role']}")
+                        if user['team_changed']:
+                            current_display = user['current_teams'] if user['current_teams'] else "(none)"
+                            new_display = user['new_teams'] if user['new_teams'] else "(none)"
+                            changes.append(f"Teams: {current_display} → {new_display}")
+                        print(f"    ~ {user['email']} ({', '.join(changes)})")
             
-            if to_update and not args.no_update:
-                print("\n  Users to UPDATE:")
-                for user in to_update:
-                    changes = []
-                    if user['role_changed']:
-                        changes.append(f"Role: {user['current_role']} → {user['new_role']}")
-                    if user['team_changed']:
-                        current_display = user['current_teams'] if user['current_teams'] else "(none)"
-                        new_display = user['new_teams'] if user['new_teams'] else "(none)"
-                        changes.append(f"Teams: {current_display} → {new_display}")
-                    print(f"    ~ {user['email']} ({', '.join(changes)})")
+                if unchanged:
+                    print(f"\n  Users UNCHANGED: {len(unchanged)} users")
             
-            if unchanged:
-                print(f"\n  Users UNCHANGED: {len(unchanged)} users")
+                return
             
-            return
+            if args.plan_out:
+                print(f"Review the plan, then apply it with: python sync_user.py --apply {args.plan_out}")
+                return
+            
+            # Record the plan to apply, so --resume does not fetch and compare again
+            journal.record("plan", "plan", storable_plan(plan))
+        
+        to_add, to_delete, to_update, unchanged = plan['to_add'], plan['to_delete'], plan['to_update'], plan['unchanged']
+        unchanged_count = plan.get('unchanged_count', len(unchanged))
+        rejected = plan.get('rejected', [])
+        if args.apply or journal.resumed:
+            print(f"\nSynchronization Plan:")
+            print(f"  Users to add: {len(to_add)}")
+            print(f"  Users to delete: {len(to_delete)}")
+            print(f"  Users to update: {len(to_update)}")
+            print(f"  Users unchanged: {unchanged_count}")
         
         # Execute synchronization
-        sync_results = {
-            'added': [],
-            'deleted': [],
-            'updated': [],
-            'unchanged': unchanged
-        }
-        
-        # Add new users
-        if to_add:
-            print(f"\nAdding {len(to_add)} new users...")
-            for user in to_add:
-                try:
-                    result = create_user(
-                        args.base_url,
-                        args.master_key,
-                        user['email'],
-                        user['role'],
-                        user.get('team_name'),
-                        args.debug
-                    )
-                    # Get API key for the newly created user (only available in creation response)
-                    api_key = result.get('key', '') or result.get('api_key', '') or result.get('token', '')
-                    user_id = result.get('user_id')
-                    key_name = user.get('key_name')
-                    
-                    # Update API key alias if key_name is provided
-                    if api_key and key_name:
-                        update_result = update_api_key_alias(args.base_url, args.master_key, api_key, key_name, args.debug)
-                        if update_result:
-                            if args.debug:
-                                print(f"DEBUG: Updated API key alias to '{key_name}' for user {user['email']}", file=sys.stderr)
-                        else:
-                            if args.debug:
-                                print(f"DEBUG: Failed to update API key alias for user {user['email']}", file=sys.stderr)
-                    
-                    if args.debug:
-                        print(f"DEBUG: API key for new user {user['email']}: {'Found' if api_key else 'Not found'}", file=sys.stderr)
-                        if api_key:
-                            print(f"DEBUG: API key value: {api_key[:10]}...", file=sys.stderr)
-                    
-                    sync_results['added'].append({
-                        'email': user['email'],
-                        'user_id': user_id,
-                        'role': user['role'],
-                        'team_name': user.get('team_name', ''),
-                        'api_key': api_key,
-                        'key_name': key_name,
-                        'success': True
-                    })
-                    print(f"  ✓ Added user: {user['email']}")
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    sync_results['added'].append({
-                        'email': user['email'],
-                        'user_id': '',
-                        'role': user['role'],
-                        'team_name': user.get('team_name', ''),
-                        'api_key': '',
-                        'success': False,
-                        'error': error_msg
-                    })
-                    print(f"  ✗ Failed to add user {user['email']}: {error_msg}")
-        
-        # Delete users (if not disabled)
-        if to_delete and not args.no_delete:
-            print(f"\nDeleting {len(to_delete)} users...")
-            for user in to_delete:
-                try:
-                    success = delete_user(args.base_url, args.master_key, user['user_id'], args.debug)
-                    if success:
-                        sync_results['deleted'].append({
-                            'email': user['email'],
-                            'user_id': user['user_id'],
-                            'role': user['role'],
-                            'team_name': user.get('team_name', ''),
-                            'success': True
-                        })
-                        print(f"  ✓ Deleted user: {user['email']}")
-                    else:
-                        sync_results['deleted'].append({
-                            'email': user['email'],
-                            'user_id': user['user_id'],
-                            'role': user['role'],
-                            'team_name': user.get('team_name', ''),
-                            'success': False,
-                            'error': 'API deletion failed'
-                        })
-                        print(f"  ✗ Failed to delete user: {user['email']}")
-                        
-                except Exception as e:
-                    error_msg = str(e)
-                    sync_results['deleted'].append({
-                        'email': user['email'],
-                        'user_id': user['user_id'],
-                        'role': user['role'],
-                        'team_name': user.get('team_name', ''),
-                        'success': False,
-                        'error': error_msg
-                    })
-                    print(f"  ✗ Failed to delete user {user['email']}: {error_msg}")
-        
-        # Update users (if not disabled)
-        if to_update and not args.no_update:
-            print(f"\nUpdating {len(to_update)} users...")
-            for user in to_update:
-                try:
-                    changes = []
-                    if user['role_changed']:
-                        changes.append(f"Role: {user['current_role']} → {user['new_role']}")
-                    if user['team_changed']:
-                        current_display = user['current_teams'] if user['current_teams'] else "(none)"
-                        new_display = user['new_teams'] if user['new_teams'] else "(none)"
-                        changes.append(f"Teams: {current_display} → {new_display}")
-                    
-                    if args.debug:
-                        print(f"\nDEBUG: Updating user: {user['email']} ({', '.join(changes)})", file=sys.stderr)
-                    
-                    # Determine what to update
-                    new_role = user['new_role'] if user['role_changed'] else None
-                    new_teams = user['new_teams'] if user['team_changed'] else None
-                    current_team_ids = user.get('current_team_ids', [])
-                    
-                    result = update_user(
-                        args.base_url,
-                        args.master_key,
-                        user['user_id'],
-                        new_role,
-                        new_teams,
-                        current_team_ids,
-                        user['email'],
-                        args.debug
-                    )
-                    
-                    # API keys are not available for updated users
-                    sync_results['updated'].append({
-                        'email': user['email'],
-                        'user_id': user['user_id'],
-                        'role': user['new_role'],
-                        'team_name': user.get('new_teams', ''),
-                        'api_key': '',
-                        'success': True
-                    })
-                    print(f"  ✓ Updated user: {user['email']} ({', '.join(changes)})")
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    sync_results['updated'].append({
-                        'email': user['email'],
-                        'user_id': user['user_id'],
-                        'role': user['new_role'],
-                        'team_name': user.get('new_teams', ''),
-                        'api_key': '',
-                        'success': False,
-                        'error': error_msg
-                    })
-                    print(f"  ✗ Failed to update user {user['email']}: {error_msg}")
+        sync_results = apply_sync_plan(
+            to_add,
+            to_delete,
+            to_update,
+            unchanged,
+            args.base_url,
+            args.master_key,
+            args.concurrency,
+            args.debug,
+            journal,
+            check_stale
+        )
+        sync_results['rejected'] = rejected
+        
+        # 反映に成功した行だけ指紋を保存（失敗・未実行の行は次回も照合対象）
+        if csv_state is not None:
+            try:
+                csv_state.record_results(plan_csv_users, sync_results, full=not csv_state.loaded, removed=delta_removed)
+                csv_state.mark_pending_deletes(plan['skipped_deletes'])
+                csv_state.save()
+            except Exception as e:
+                print(f"WARNING: Failed to save CSV sync state: {e}", file=sys.stderr)
+        
+        if args.snapshot:
+            forget_deleted_users(args.base_url, args.master_key,
+                                 [u['user_id'] for u in sync_results['deleted'] if u.get('success') and u.get('user_id')], args.debug)
         
         # Summary
         added_success = len([u for u in sync_results['added'] if u.get('success')])
-        added_failed = len([u for u in sync_results['added'] if not u.get('success')])
+        added_failed = len([u for u in sync_results['added'] if not u.get('success') and not u.get('skipped')])
         deleted_success = len([u for u in sync_results['deleted'] if u.get('success')])
-        deleted_failed = len([u for u in sync_results['deleted'] if not u.get('success')])
+        deleted_failed = len([u for u in sync_results['deleted'] if not u.get('success') and not u.get('skipped')])
         updated_success = len([u for u in sync_results['updated'] if u.get('success')])
-        updated_failed = len([u for u in sync_results['updated'] if not u.get('success')])
+        updated_failed = len([u for u in sync_results['updated'] if not u.get('success') and not u.get('skipped')])
+        stale_skipped = len([u for phase in ('added', 'deleted', 'updated') for u in sync_results[phase] if u.get('skipped')])
         
         print(f"\nSynchronization Summary:")
         print(f"  Successfully added: {added_success} users")
@@ -1061,17 +1641,26 @@ Example usage:
         print(f"  Failed to delete: {deleted_failed} users")
         print(f"  Successfully updated: {updated_success} users")
         print(f"  Failed to update: {updated_failed} users")
-        print(f"  Unchanged: {len(unchanged)} users")
+        print(f"  Unchanged: {unchanged_count} users")
+        print(f"  Rejected (invalid CSV rows): {len(rejected)} users")
+        if check_stale:
+            print(f"  Skipped (stale plan): {stale_skipped} users")
         
         # Write sync report
         write_sync_report(sync_results)
         
+        # The run is complete and its report is written
+        journal.finish()
+        
     except requests.HTTPError as e:
         print(f"HTTPError: {e} - {getattr(e.response, 'text', '')}", file=sys.stderr)
         sys.exit(2)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(2)
+    finally:
+        for sorter in sorters:
+            sorter.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
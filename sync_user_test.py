@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from sync_user import compare_users
+from team_directory import get_team_directory
+
+# API を呼ばないダミーの接続先（チーム一覧は事前にロード済みのディレクトリから引く）
+BASE_URL = "http://sync-user-test.invalid"
+MASTER_KEY = "sk-test"
+TEAMS = [
+    {"team_id": "T1", "team_alias": "Data Science"},
+    {"team_id": "T2", "team_alias": "Ops"},
+    {"team_id": "T3", "team_alias": "Data"},
+]
+
+def api_user(email, teams, role="internal_user"):
+    return {"user_id": f"id-{email}", "user_email": email, "user_role": role, "teams": teams}
+
+def csv_user(email, team_name, role="internal_user"):
+    return {"email": email, "role": role, "team_name": team_name}
+
+def compare(csv_users, api_users):
+    get_team_directory(BASE_URL, MASTER_KEY).load(teams=TEAMS)
+    return compare_users(csv_users, api_users, BASE_URL, MASTER_KEY)
+
+def test_team_name_with_spaces_is_unchanged():
+    to_add, to_delete, to_update, unchanged = compare([csv_user("a@example.com", "Data Science")],
+                                                      [api_user("a@example.com", ["T1"])])
+    assert to_update == []
+    assert [u["email"] for u in unchanged] == ["a@example.com"]
+
+def test_multi_word_names_are_grouped_by_longest_match():
+    _, _, to_update, _ = compare([csv_user("a@example.com", "Data  Science Ops")],
+                                 [api_user("a@example.com", ["T1"])])
+    assert len(to_update) == 1
+    assert to_update[0]["new_team_ids"] == ["T1", "T2"]
+    assert to_update[0]["new_teams"] == "Data Science Ops"
+
+def test_unresolved_team_names_never_produce_a_team_update():
+    _, _, to_update, unchanged = compare([csv_user("a@example.com", "Nope Data"),
+                                          csv_user("b@example.com", "Nope", role="proxy_admin")],
+                                         [api_user("a@example.com", ["T1"]), api_user("b@example.com", ["T1"])])
+    # チームは変更せず、ロールの変更だけが計画される
+    assert [u["email"] for u in unchanged] == ["a@example.com"]
+    assert [(u["email"], u["role_changed"], u["team_changed"]) for u in to_update] == [("b@example.com", True, False)]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from litellm_client import LiteLLMClient, get_client
+
+class TeamDirectory:
+    """In-memory index of /team/list, fetched once per run
+
+    Teams are indexed by team_id and by both team_name and team_alias, so every
+    lookup after the first costs a dict access instead of a full /team/list call.
+    """
+
+    def __init__(self, client: LiteLLMClient, debug: bool = False):
+        self.client = client
+        self.debug = debug
+        self.teams: List[Dict] = []
+        self.by_id: Dict[str, Dict] = {}
+        self.by_name: Dict[str, Dict] = {}
+        self.loaded = False
+        self._lock = threading.RLock()
+
+    def load(self, teams: Optional[List[Dict]] = None) -> "TeamDirectory":
+        """Fetch /team/list (unless teams are given) and rebuild the indexes"""
+        with self._lock:
+            if teams is None:
+                url = self.client.url("/team/list")
+                if self.debug:
+                    print(f"DEBUG: Getting team list - URL: {url}", file=sys.stderr)
+                r = self.client.get(url)
+                if self.debug:
+                    print(f"DEBUG: Team list response status: {r.status_code}", file=sys.stderr)
+                r.raise_for_status()
+                data = r.json()
+                # Get teams from response - API returns list directly
+                teams = data if isinstance(data, list) else data.get("teams", []) or data.get("data", [])
+
+            by_id: Dict[str, Dict] = {}
+            by_name: Dict[str, Dict] = {}
+            for team in teams:
+                team_id = team.get("team_id")
+                if team_id:
+                    by_id.setdefault(team_id, team)
+                # 先に出現したチームを優先（従来の線形探索と同じ結果になる）
+                for name in (team.get("team_name"), team.get("team_alias")):
+                    if name:
+                        by_name.setdefault(name, team)
+
+            self.teams = list(teams)
+            self.by_id = by_id
+            self.by_name = by_name
+            self.loaded = True
+
+            if self.debug:
+                print(f"DEBUG: Indexed {len(self.teams)} teams", file=sys.stderr)
+        return self
+
+    def ensure_loaded(self) -> "TeamDirectory":
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+        return self
+
+    def id_for_name(self, team_name: str) -> str:
+        """Return the team ID for a team_name or team_alias ("" if unknown)"""
+        team = self.ensure_loaded().by_name.get(team_name)
+        return team.get("team_id", "") if team else ""
+
+    def name_for_id(self, team_id: str) -> str:
+        """Return the display name (team_alias, else team_name) for a team ID ("" if unknown)"""
+        team = self.ensure_loaded().by_id.get(team_id)
+        if not team:
+            return ""
+        return team.get("team_alias") or team.get("team_name", "")
+
+    def names_for_ids(self, team_ids: List[str]) -> List[str]:
+        """Return display names for team IDs, skipping unknown IDs"""
+        names = []
+        for team_id in team_ids or []:
+            name = self.name_for_id(team_id)
+            if name:
+                names.append(name)
+        return names
+
+    def ids_for_names(self, team_names: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Resolve team names to IDs, returns (IDs in input order without duplicates, unknown names)"""
+        by_name = self.ensure_loaded().by_name
+        team_ids: List[str] = []
+        unknown: List[str] = []
+        for name in team_names:
+            team = by_name.get(name)
+            team_id = team.get("team_id") if team else None
+            if not team_id:
+                unknown.append(name)
+            elif team_id not in team_ids:
+                team_ids.append(team_id)
+        return team_ids, unknown
+
+    def ids_for_team_field(self, team_field: str) -> Tuple[List[str], List[str]]:
+        """Resolve a space-separated CSV team_name value, returns (IDs in input order without duplicates, unknown names)
+
+        Team names may themselves contain spaces, so the whole value is looked
+        up first; otherwise the words are grouped greedily into the longest
+        run that names a team ("Data Science Ops" -> "Data Science", "Ops").
+        """
+        by_name = self.ensure_loaded().by_name
+        team_field = team_field.strip()
+        if not team_field:
+            return [], []
+        if team_field in by_name:
+            return self.ids_for_names([team_field])
+        words = team_field.split()
+        names: List[str] = []
+        start = 0
+        while start < len(words):
+            # 最長一致: 後ろの単語から順に削り、登録済みのチーム名になる範囲を探す
+            end = len(words)
+            while end > start + 1 and " ".join(words[start:end]) not in by_name:
+                end -= 1
+            names.append(" ".join(words[start:end]))
+            start = end
+        return self.ids_for_names(names)
+
+_directories: Dict[int, TeamDirectory] = {}
+_directories_lock = threading.Lock()
+
+def get_team_directory(base_url: str, master_key: str, debug: bool = False) -> TeamDirectory:
+    """Return the shared team directory for a proxy (one /team/list fetch per run)"""
+    client = get_client(base_url, master_key)
+    with _directories_lock:
+        directory = _directories.get(id(client))
+        if directory is None:
+            directory = TeamDirectory(client, debug)
+            _directories[id(client)] = directory
+    return directory
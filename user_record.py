@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# /user/list の各ユーザーのうち、add/del/sync が参照する項目
+RECORD_FIELDS = ("user_id", "user_email", "user_role", "teams", "key_count", "created_at", "updated_at")
+
+def parse_timestamp(value) -> Optional[float]:
+    """Parse an ISO-8601 timestamp from the API into epoch seconds (None if missing or invalid)"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class UserRecord:
+    """Compact copy of one /user/list entry holding only the fields the tools use
+
+    The proxy returns spend, metadata, models, budgets and more for every user;
+    keeping those dicts for a whole inventory costs several KB per user. A
+    record keeps the fields in RECORD_FIELDS in slots (team IDs as a tuple,
+    timestamps as epoch seconds) and reads like the original dict:
+    record["user_email"], record.get("teams"), "user_id" in record. Fields a
+    caller adds later (api_key, team_name, invitation_url ...) go into a small
+    per-record dict.
+    """
+
+    __slots__ = RECORD_FIELDS + ("extra",)
+
+    def __init__(self, user_id: Optional[str] = None, user_email: Optional[str] = None, user_role: Optional[str] = None,
+                 teams: Tuple[str, ...] = (), key_count: int = 0, created_at: Optional[float] = None, updated_at: Optional[float] = None):
+        self.user_id = user_id
+        self.user_email = user_email
+        self.user_role = user_role
+        self.teams = teams
+        self.key_count = key_count
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_api(cls, user: Dict, shared: Optional[Dict] = None) -> "UserRecord":
+        """Project one API user dict into a record
+
+        `shared` deduplicates the team ID tuples many users have in common so
+        equal tuples are stored once per inventory.
+        """
+        if shared is None:
+            shared = {}
+        teams = user.get("teams")
+        teams = tuple(teams) if isinstance(teams, (list, tuple)) else ()
+        key_count = user.get("key_count")
+        if key_count is None:
+            keys = user.get("keys")
+            key_count = len(keys) if isinstance(keys, list) else 0
+        role = user.get("user_role")
+        return cls(
+            user_id=user.get("user_id"),
+            user_email=user.get("user_email"),
+            user_role=sys.intern(role) if isinstance(role, str) else role,
+            teams=shared.setdefault(teams, teams),
+            key_count=key_count,
+            created_at=parse_timestamp(user.get("created_at")),
+            updated_at=parse_timestamp(user.get("updated_at")),
+        )
+
+    # dict と同じ読み書きを提供し、呼び出し側のコードを変えずに置き換えられるようにする
+    def __getitem__(self, key: str) -> Any:
+        if key in RECORD_FIELDS:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in RECORD_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        if key in RECORD_FIELDS:
+            return getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """dict.get; unset (None) fields return `default` as a missing key would"""
+        if key in RECORD_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def keys(self) -> List[str]:
+        return [k for k in RECORD_FIELDS if getattr(self, k) is not None] + list(self.extra or ())
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key in self.keys():
+            yield key, self[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict (team IDs as a list), e.g. for JSON output"""
+        data = dict(self.items())
+        if "teams" in data:
+            data["teams"] = list(data["teams"])
+        return data
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+def compact_users(users: Iterable[Dict], shared: Optional[Dict] = None) -> List[UserRecord]:
+    """Project API user dicts into records (records are passed through unchanged)"""
+    if shared is None:
+        shared = {}
+    return [u if isinstance(u, UserRecord) else UserRecord.from_api(u, shared) for u in users]